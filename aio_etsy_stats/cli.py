@@ -0,0 +1,314 @@
+"""Command line entry point
+
+    aio-etsy-stats run [--shop S]   Update every shop in ETSY_STORE_NAME on a schedule. This is what the container runs
+    aio-etsy-stats scrape SHOP      Update a shop once and print its stats, for cron jobs
+    aio-etsy-stats parse PAGE       Print the stats in a saved /sold page
+    aio-etsy-stats state [SHOP]     Print the state saved for the shops
+
+Everything else is configured with the environment variables in docker-compose.yml. Only the modules a command needs
+are imported, so ``parse`` and ``state`` don't load Selenium, Adafruit IO or Discord at all.
+"""
+import argparse
+import importlib.abc
+import json
+import logging
+import os
+import sys
+from contextlib import redirect_stdout
+from datetime import datetime
+from os import environ
+from time import perf_counter
+from typing import Dict, List
+
+# Nothing else from the package is imported at the top, so --profile-imports sees every module a command loads
+FETCH_MODES = ("auto", "http", "selenium")
+
+
+# region Import profile
+class _TimedLoader(importlib.abc.Loader):
+    """Wraps a module's loader to time executing it"""
+
+    def __init__(self, loader, name: str, seconds: Dict[str, float]):
+        self._loader = loader
+        self._name = name
+        self._seconds = seconds
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        start = perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._seconds[self._name] = perf_counter() - start
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class ImportProfiler(importlib.abc.MetaPathFinder):
+    """Times every module imported while it is installed, like ``python -X importtime`` but for just one command
+
+    A module's time includes the modules it imports in turn.
+    """
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                spec.loader = _TimedLoader(spec.loader, fullname, self.seconds)
+            return spec
+        return None
+
+    def __enter__(self) -> "ImportProfiler":
+        sys.meta_path.insert(0, self)
+        return self
+
+    def __exit__(self, *exc_info):
+        sys.meta_path.remove(self)
+
+    def report(self, limit: int = 15) -> str:
+        # Packages imported first by this command. Their submodules are already in their time
+        top_level = {name: seconds for name, seconds in self.seconds.items()
+                     if "." not in name or name.rpartition(".")[0] not in self.seconds}
+        lines = [f"Imported {len(self.seconds)} modules in {sum(top_level.values()) * 1000:.1f}ms"]
+        for name, seconds in sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:limit]:
+            lines.append(f"  {seconds * 1000:8.1f}ms  {name}")
+        return "\n".join(lines)
+# endregion
+
+
+# region Configuration
+def browser_profile_from_environment():
+    from aio_etsy_stats.webdriver_pool import BrowserProfile
+
+    block_assets = environ.get("BROWSER_BLOCK_ASSETS", "true").lower() != "false"
+    return BrowserProfile(
+        headless=environ.get("BROWSER_HEADLESS", "true").lower() != "false",
+        block_images=block_assets,
+        block_fonts=block_assets,
+        block_stylesheets=block_assets,
+        block_media=block_assets,
+        blocked_url_patterns=tuple(pattern.strip() for pattern in environ.get("BROWSER_BLOCKED_URLS", "").split(",")
+                                   if pattern.strip()),
+        page_load_strategy=environ.get("PAGE_LOAD_STRATEGY", "eager"),
+        cache_dir=environ.get("BROWSER_CACHE_DIR") or None,
+    )
+
+
+def client_kwargs_from_environment() -> dict:
+    """AIOEtsyStats settings shared by a single shop and MultiShopRunner"""
+    from aio_etsy_stats.resilience import parse_timeouts
+
+    return dict(
+        default_reset_hour=int(environ.get("DEFAULT_RESET_HOUR", 14)),
+        scrape_interval_minutes=int(environ.get("SCRAPE_INTERVAL_MINUTES", 5)),
+        aio_username=environ.get("AIO_USERNAME"),
+        aio_password=environ.get("AIO_PASSWORD"),
+        discord_webhook=environ.get("DISCORD_WEBHOOK"),
+        discord_avatar_url=environ.get("DISCORD_AVATAR_URL"),
+        selenium_host=environ.get("SELENIUM_HOST"),
+        selenium_port=environ.get("SELENIUM_PORT"),
+        webdriver_max_navigations=int(environ.get("WEBDRIVER_MAX_NAVIGATIONS", 50)),
+        webdriver_max_memory_mb=int(environ.get("WEBDRIVER_MAX_MEMORY_MB", 0)) or None,
+        browser_profile=browser_profile_from_environment(),
+        fetch_mode=environ.get("FETCH_MODE", "auto"),
+        parser_engine=environ.get("PARSER_ENGINE", "auto"),
+        parser_workers=int(environ.get("PARSER_WORKERS", 0)),
+        aio_rate_per_minute=float(environ.get("AIO_RATE_PER_MINUTE", 30)),
+        state_dir=environ.get("STATE_DIR"),
+        history_retention_days=int(environ.get("HISTORY_RETENTION_DAYS", 0)) or None,
+        min_scrape_interval_minutes=float(environ.get("MIN_SCRAPE_INTERVAL_MINUTES", 0)) or None,
+        max_scrape_interval_minutes=float(environ.get("MAX_SCRAPE_INTERVAL_MINUTES", 0)) or None,
+        quiet_hours=environ.get("QUIET_HOURS"),
+        metrics_port=int(environ.get("METRICS_PORT", 0)) or None,
+        timeouts=parse_timeouts(environ.get("TIMEOUTS")),
+        breaker_failures=int(environ.get("BREAKER_FAILURES", 5)),
+        breaker_reset_seconds=float(environ.get("BREAKER_RESET_SECONDS", 60)),
+    )
+# endregion
+
+
+# region Commands
+def _print_record(title: str, values: dict, as_json: bool) -> None:
+    if as_json:
+        print(json.dumps(values, indent=2, default=str))
+        return
+    print(title)
+    for key, value in values.items():
+        print(f"  {key}: {value}")
+
+
+def run(args) -> int:
+    shops = args.shops or [shop.strip() for shop in environ.get("ETSY_STORE_NAME", "").split(",") if shop.strip()]
+    if not shops:
+        args.parser.error("no shops to update. Set ETSY_STORE_NAME or pass --shop")
+    runtime = environ.get("RUNTIME", "schedule")
+    lease_seconds = float(environ.get("LEASE_SECONDS", 0)) or None
+    if len(shops) > 1 or runtime == "asyncio" or lease_seconds:
+        from aio_etsy_stats.multi_shop import MultiShopRunner
+
+        runner = MultiShopRunner(shops=shops,
+                                 max_workers=int(environ.get("SCRAPE_WORKERS", 2)),
+                                 runtime=runtime,
+                                 lease_seconds=lease_seconds,
+                                 node_id=environ.get("NODE_ID") or None,
+                                 **client_kwargs_from_environment())
+        runner.main()
+    else:
+        from aio_etsy_stats.main import AIOEtsyStats
+
+        client = AIOEtsyStats(shop=shops[0],
+                              webdriver_pool_size=int(environ.get("WEBDRIVER_POOL_SIZE", 1)),
+                              **client_kwargs_from_environment())
+        client.main()
+    return 0
+
+
+def scrape(args) -> int:
+    """One update of a shop, the same as a scheduled one, then exits. Pending AIO writes are sent before exiting"""
+    from aio_etsy_stats.main import AIOEtsyStats
+
+    kwargs = client_kwargs_from_environment()
+    kwargs["fetch_mode"] = args.fetch_mode or kwargs["fetch_mode"]
+    kwargs["parser_engine"] = args.parser_engine or kwargs["parser_engine"]
+    kwargs["metrics_port"] = None  # Nothing would be around to scrape it
+    # The client logs to stdout, which is kept for the JSON alone when it is asked for
+    with redirect_stdout(sys.stderr if args.json else sys.stdout):
+        client = AIOEtsyStats(shop=args.shop, **kwargs)
+        client.begin_update()
+        stats = client.scrape_etsy_stats()
+        client.process_stats(stats)
+    _print_record(f"Stats for {args.shop}", stats._asdict(), args.json)
+    return 0 if stats.is_complete() else 1
+
+
+def parse(args) -> int:
+    from aio_etsy_stats.parsing import parse_page
+
+    if args.page == "-":
+        page_source = sys.stdin.read()
+    else:
+        with open(args.page, "r", encoding="utf-8") as file:
+            page_source = file.read()
+
+    start = perf_counter()
+    parsed = parse_page(page_source, engine=args.engine, logger=logging.getLogger("aio_etsy_stats"))
+    values = dict(parsed.stats._asdict(), **{
+        "sold-listings": len(parsed.listing_ids),
+        "fingerprint": parsed.fingerprint,
+        "parse-ms": round((perf_counter() - start) * 1000, 3),
+    })
+    _print_record(f"Stats in {args.page}", values, args.json)
+    return 0 if parsed.stats.is_complete() else 1
+
+
+def state(args) -> int:
+    from aio_etsy_stats.provisioning import default_state_dir
+    from aio_etsy_stats.state_store import StateStore
+
+    path = os.path.join(args.state_dir or environ.get("STATE_DIR") or default_state_dir(), "state.db")
+    if not os.path.exists(path):
+        print(f"No state at {path}", file=sys.stderr)
+        return 1
+
+    store = StateStore(path=path)
+    try:
+        shops = [args.shop.lower()] if args.shop else store.shops()
+        states = {shop: store.load(shop) for shop in shops}
+    finally:
+        store.close()
+
+    missing = [shop for shop, shop_state in states.items() if shop_state is None]
+    records = {}
+    for shop, shop_state in states.items():
+        if shop_state is None:
+            continue
+        values = shop_state._asdict()
+        for field in ("reset_timestamp", "updated_timestamp"):
+            if values[field] is not None:
+                values[field] = datetime.fromtimestamp(values[field]).isoformat(sep=" ", timespec="seconds")
+        records[shop] = values
+
+    if args.json:
+        print(json.dumps(records, indent=2))
+    else:
+        for shop, values in records.items():
+            _print_record(shop, values, as_json=False)
+    for shop in missing:
+        print(f"No state saved for {shop}", file=sys.stderr)
+    return 1 if missing else 0
+# endregion
+
+
+def _add_profile_imports(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--profile-imports", action="store_true",
+                        help="Report how long the modules the command loaded took to import")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    from aio_etsy_stats.parsing import PARSER_ENGINES
+
+    parser = argparse.ArgumentParser(prog="aio-etsy-stats", description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="\n".join(__doc__.splitlines()[2:]))
+    _add_profile_imports(parser)
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    run_parser = commands.add_parser("run", help="Update every shop on a schedule")
+    run_parser.add_argument("--shop", action="append", dest="shops", metavar="SHOP",
+                            help="Shop to update, can be repeated. Overrides ETSY_STORE_NAME")
+    run_parser.set_defaults(handler=run, parser=run_parser)
+
+    scrape_parser = commands.add_parser("scrape", help="Update a shop once and print its stats")
+    scrape_parser.add_argument("shop")
+    scrape_parser.add_argument("--fetch-mode", choices=FETCH_MODES, help="Overrides FETCH_MODE")
+    scrape_parser.add_argument("--parser-engine", choices=PARSER_ENGINES, help="Overrides PARSER_ENGINE")
+    scrape_parser.add_argument("--json", action="store_true")
+    scrape_parser.set_defaults(handler=scrape)
+
+    parse_parser = commands.add_parser("parse", help="Print the stats in a saved /sold page")
+    parse_parser.add_argument("page", help="Saved page, or - to read it from stdin")
+    parse_parser.add_argument("--engine", choices=PARSER_ENGINES, default="auto")
+    parse_parser.add_argument("--json", action="store_true")
+    parse_parser.set_defaults(handler=parse)
+
+    state_parser = commands.add_parser("state", help="Print the state saved for the shops")
+    state_parser.add_argument("shop", nargs="?", help="Only this shop")
+    state_parser.add_argument("--state-dir", help="Overrides STATE_DIR")
+    state_parser.add_argument("--json", action="store_true")
+    state_parser.set_defaults(handler=state)
+    return parser
+
+
+def _run(argv: List[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+def main(argv: List[str] = None) -> int:
+    # Checked before the full parser is built, since building it imports the parsing module
+    profile_parser = argparse.ArgumentParser(add_help=False)
+    _add_profile_imports(profile_parser)
+    if not profile_parser.parse_known_args(argv)[0].profile_imports:
+        return _run(argv)
+
+    profiler = ImportProfiler()
+    try:
+        with profiler:
+            return _run(argv)
+    finally:
+        print(profiler.report(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
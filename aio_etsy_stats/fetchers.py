@@ -0,0 +1,159 @@
+import logging
+import re
+import threading
+from collections import Counter
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+from aio_etsy_stats.metrics import PAGE_LOAD_SECONDS
+from aio_etsy_stats.resilience import CircuitBreaker, CircuitOpen
+
+# Etsy sits behind DataDome. A blocked request gets a small page that loads the captcha from these hosts
+BOT_CHALLENGE_MARKERS = ("captcha-delivery.com", "datadome", "Please enable JS and disable any ad blocker")
+BOT_CHALLENGE_STATUS_CODES = (403, 429, 503)
+
+TITLE_PATTERN = re.compile(r"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+# Markers for the fields scrape_etsy_stats needs. If these are missing the page wasn't fully rendered
+REQUIRED_FIELD_PATTERNS = (
+    re.compile(r"\"num_favorers\":\d+"),
+    re.compile(r"[0-9,]+ Sales"),
+)
+
+DEFAULT_USER_AGENT = ("Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                      "Chrome/131.0.0.0 Safari/537.36")
+
+
+class FetchResult(NamedTuple):
+    """Page returned by a fetcher"""
+    title: Optional[str] = None
+    content: Optional[str] = None
+    source: Optional[str] = None  # http, http-cache or selenium
+    status_code: Optional[int] = None
+
+
+class HttpFetcher:
+    """Fetches pages with a pooled keep-alive requests session
+
+    Responses are requested compressed and the ETag/Last-Modified of the last response for each url is sent back, so
+    a page that hasn't changed comes back as a 304 and is served from the copy in memory. Errors and server errors
+    that aren't a bot challenge count against the breaker, if one is given.
+    """
+
+    def __init__(self, timeout: float = 15, pool_size: int = 4, user_agent: str = DEFAULT_USER_AGENT,
+                 breaker: CircuitBreaker = None, logger: logging.Logger = None):
+        self.timeout = timeout
+        self.breaker = breaker
+        self.logger = logger or logging.getLogger(type(self).__name__)
+
+        # requests is only loaded once something is fetched over HTTP
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._session.headers.update({
+            "User-Agent": user_agent,
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Encoding": "gzip, deflate",
+            "Accept-Language": "en-US,en;q=0.9",
+        })
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Tuple[Optional[str], Optional[str], FetchResult]] = {}
+
+    def fetch(self, url: str) -> FetchResult:
+        headers = {}
+        with self._lock:
+            cached = self._cache.get(url)
+        if cached:
+            etag, last_modified, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        if self.breaker and not self.breaker.allow():
+            raise CircuitOpen(f"Not fetching {url}, {self.breaker.name} circuit is open")
+        try:
+            with PAGE_LOAD_SECONDS.time(source="http"):
+                response = self._session.get(url, headers=headers, timeout=self.timeout)
+        except Exception as e:
+            if self.breaker:
+                self.breaker.record_failure(e)
+            raise
+        if self.breaker:
+            # A challenge means Etsy is up but wants a browser
+            if response.status_code >= 500 and not any(marker in response.text for marker in BOT_CHALLENGE_MARKERS):
+                self.breaker.record_failure(Exception(f"Status code {response.status_code} for {url}"))
+            else:
+                self.breaker.record_success()
+        if response.status_code == 304 and cached:
+            return cached[2]._replace(source="http-cache", status_code=304)
+
+        content = response.text if response.ok else None
+        title = None
+        if content:
+            found_title = TITLE_PATTERN.search(content)
+            if found_title:
+                title = found_title[1].strip()
+        result = FetchResult(title=title, content=content, source="http", status_code=response.status_code)
+
+        if response.ok and (response.headers.get("ETag") or response.headers.get("Last-Modified")):
+            with self._lock:
+                self._cache[url] = (response.headers.get("ETag"), response.headers.get("Last-Modified"), result)
+        return result
+
+    def close(self) -> None:
+        self._session.close()
+
+
+class FallbackFetcher:
+    """Tries the cheap HTTP fetch first and only uses the browser when that page can't be used
+
+    ``counts`` keeps how many pages were served by HTTP, how many fell back to Selenium for each reason and how many
+    were skipped because the breaker for Etsy was open.
+    """
+
+    def __init__(self, http_fetcher: HttpFetcher, selenium_fetch: Callable[[str], Tuple[str, str]],
+                 logger: logging.Logger = None):
+        self.http_fetcher = http_fetcher
+        self.selenium_fetch = selenium_fetch
+        self.logger = logger or logging.getLogger(type(self).__name__)
+        self.counts = Counter()
+
+    @staticmethod
+    def fallback_reason(result: FetchResult) -> Optional[str]:
+        """Why the HTTP result can't be used, or None if it can"""
+        if result.status_code in BOT_CHALLENGE_STATUS_CODES:
+            return f"status-{result.status_code}"
+        if not result.content:
+            return "no-content"
+        if any(marker in result.content for marker in BOT_CHALLENGE_MARKERS):
+            return "bot-challenge"
+        if not all(pattern.search(result.content) for pattern in REQUIRED_FIELD_PATTERNS):
+            return "missing-fields"
+        return None
+
+    def fetch(self, url: str) -> FetchResult:
+        try:
+            result = self.http_fetcher.fetch(url)
+            reason = self.fallback_reason(result)
+        except CircuitOpen as e:
+            # Etsy itself is failing, so the browser would only be tied up waiting on it too
+            self.logger.debug(str(e))
+            self.counts["skipped"] += 1
+            return FetchResult(source="http")
+        except Exception as e:
+            self.logger.debug(f"HTTP fetch of {url} failed: {e}")
+            reason = "http-error"
+
+        if reason is None:
+            self.counts[result.source] += 1
+            return result
+
+        self.counts[f"selenium-{reason}"] += 1
+        selenium_total = sum(count for key, count in self.counts.items() if key.startswith("selenium-"))
+        self.logger.debug(f"Falling back to Selenium for {url} ({reason}). "
+                          f"Selenium has been used for {selenium_total} of {sum(self.counts.values())} fetches")
+        title, content = self.selenium_fetch(url)
+        return FetchResult(title=title, content=content, source="selenium")
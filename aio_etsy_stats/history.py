@@ -0,0 +1,272 @@
+import os
+import sqlite3
+import threading
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from aio_etsy_stats.parsing import EtsyStoreStats
+
+STAT_FIELDS = ("favorite_count", "rating", "rating_count", "sold_count")
+PERIODS = ("hour", "day")
+WINDOW_KINDS = ("daily", "weekly", "monthly")
+
+
+class Sample(NamedTuple):
+    """A single scrape"""
+    timestamp: datetime
+    favorite_count: Optional[int] = None
+    rating: Optional[float] = None
+    rating_count: Optional[int] = None
+    sold_count: Optional[int] = None
+    errors: int = 0
+
+
+class Rollup(NamedTuple):
+    """Summary of the samples in one bucket
+
+    ``opening`` holds the stats as of the last sample before the bucket (or the first sample in it if there wasn't one)
+    and ``closing`` the last sample in it, so deltas include changes that happened between buckets.
+    """
+    period: str
+    bucket_start: datetime
+    samples: int
+    first_timestamp: datetime
+    last_timestamp: datetime
+    opening: Sample
+    closing: Sample
+    min_rating: Optional[float]
+    max_rating: Optional[float]
+
+    @property
+    def favorite_delta(self) -> Optional[int]:
+        return _delta(self.opening.favorite_count, self.closing.favorite_count)
+
+    @property
+    def rating_delta(self) -> Optional[float]:
+        return _delta(self.opening.rating, self.closing.rating)
+
+    @property
+    def rating_count_delta(self) -> Optional[int]:
+        return _delta(self.opening.rating_count, self.closing.rating_count)
+
+    @property
+    def sold_delta(self) -> Optional[int]:
+        return _delta(self.opening.sold_count, self.closing.sold_count)
+
+
+def _delta(first, last):
+    return None if first is None or last is None else last - first
+
+
+def _timestamp(value: datetime) -> int:
+    """Stored as integer milliseconds"""
+    return int(value.timestamp() * 1000)
+
+
+def _datetime(value: int) -> datetime:
+    return datetime.fromtimestamp(value / 1000)
+
+
+def bucket_start(period: str, timestamp: datetime) -> datetime:
+    """Start of the hour or day bucket the timestamp falls in"""
+    if period == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if period == "day":
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"period must be one of {', '.join(PERIODS)}, not {period}")
+
+
+# region Reset windows
+def window_start(kind: str, reset_hour: int, timestamp: datetime) -> datetime:
+    """Start of the daily, weekly (from Monday) or monthly (from the 1st) window the timestamp falls in
+
+    Every window starts at the reset hour, so it is made up of whole hourly rollups.
+    """
+    start = timestamp.replace(hour=reset_hour, minute=0, second=0, microsecond=0)
+    if start > timestamp:
+        start -= timedelta(days=1)
+    if kind == "daily":
+        return start
+    if kind == "weekly":
+        return start - timedelta(days=start.weekday())
+    if kind == "monthly":
+        return start.replace(day=1)
+    raise ValueError(f"kind must be one of {', '.join(WINDOW_KINDS)}, not {kind}")
+
+
+def window_end(kind: str, start: datetime) -> datetime:
+    """Start of the window after the one starting at start"""
+    if kind == "daily":
+        return start + timedelta(days=1)
+    if kind == "weekly":
+        return start + timedelta(days=7)
+    if kind == "monthly":
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    raise ValueError(f"kind must be one of {', '.join(WINDOW_KINDS)}, not {kind}")
+
+
+def window_boundaries(kind: str, reset_hour: int, start: datetime, end: datetime) -> List[datetime]:
+    """Starts of the windows that overlap [start, end), followed by the end of the last one"""
+    boundaries = [window_start(kind, reset_hour, start)]
+    while boundaries[-1] < end:
+        boundaries.append(window_end(kind, boundaries[-1]))
+    if len(boundaries) == 1:
+        boundaries.append(window_end(kind, boundaries[0]))
+    return boundaries
+
+
+def _merge(period: str, start: datetime, rollups: List[Rollup]) -> Rollup:
+    """Combines consecutive rollups. Each stat opens with its first known value and closes with its last"""
+    opening = [next((value for value in values if value is not None), None)
+               for values in zip(*(rollup.opening[1:5] for rollup in rollups))]
+    closing = [next((value for value in reversed(values) if value is not None), None)
+               for values in zip(*(rollup.closing[1:5] for rollup in rollups))]
+    min_ratings = [rollup.min_rating for rollup in rollups if rollup.min_rating is not None]
+    max_ratings = [rollup.max_rating for rollup in rollups if rollup.max_rating is not None]
+    return Rollup(
+        period=period, bucket_start=start, samples=sum(rollup.samples for rollup in rollups),
+        first_timestamp=rollups[0].first_timestamp, last_timestamp=rollups[-1].last_timestamp,
+        opening=Sample(rollups[0].first_timestamp, *opening), closing=Sample(rollups[-1].last_timestamp, *closing),
+        min_rating=min(min_ratings, default=None), max_rating=max(max_ratings, default=None))
+# endregion
+
+
+class HistoryStore:
+    """Stores every scrape and keeps hourly and daily rollups up to date as samples arrive
+
+    Samples are kept in a clustered SQLite table keyed by shop and time, so a range is a single index scan. Rollups
+    are upserted on insert, so queries for them never touch the raw samples. Reset windows are put together from the
+    hourly rollups when asked for, so they follow the reset hour even when it changes and never go stale.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS samples (shop TEXT NOT NULL, ts INTEGER NOT NULL, "
+            "favorite_count INTEGER, rating REAL, rating_count INTEGER, sold_count INTEGER, errors INTEGER, "
+            "PRIMARY KEY (shop, ts)) WITHOUT ROWID")
+        opens = ", ".join(f"open_{field}" for field in STAT_FIELDS)
+        closes = ", ".join(f"close_{field}" for field in STAT_FIELDS)
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS rollups (shop TEXT NOT NULL, period TEXT NOT NULL, "
+            f"bucket_start INTEGER NOT NULL, samples INTEGER NOT NULL, first_ts INTEGER, last_ts INTEGER, "
+            f"{opens}, {closes}, min_rating REAL, max_rating REAL, "
+            f"PRIMARY KEY (shop, period, bucket_start)) WITHOUT ROWID")
+
+        # A stat that wasn't scraped keeps the value already in the bucket
+        updates = ", ".join([f"open_{field} = COALESCE(open_{field}, excluded.open_{field})"
+                             for field in STAT_FIELDS] +
+                            [f"close_{field} = COALESCE(excluded.close_{field}, close_{field})"
+                             for field in STAT_FIELDS])
+        self._rollup_upsert = (
+            f"INSERT INTO rollups (shop, period, bucket_start, samples, first_ts, last_ts, {opens}, {closes}, "
+            f"min_rating, max_rating) VALUES (?, ?, ?, 1, ?, ?, {', '.join('?' * len(STAT_FIELDS) * 2)}, ?, ?) "
+            f"ON CONFLICT (shop, period, bucket_start) DO UPDATE SET samples = samples + 1, "
+            f"last_ts = excluded.last_ts, {updates}, "
+            f"min_rating = MIN(COALESCE(min_rating, excluded.min_rating), COALESCE(excluded.min_rating, min_rating)), "
+            f"max_rating = MAX(COALESCE(max_rating, excluded.max_rating), COALESCE(excluded.max_rating, max_rating))"
+        )
+
+    def record(self, shop: str, stats: EtsyStoreStats, timestamp: datetime = None) -> None:
+        """Saves a scrape and folds it into its hour and day rollups"""
+        timestamp = timestamp or datetime.now()
+        shop = shop.lower()
+        values = [getattr(stats, field) for field in STAT_FIELDS]
+        timestamp_value = _timestamp(timestamp)
+        buckets = [(period, bucket_start(period, timestamp)) for period in PERIODS]
+
+        with self._lock:
+            with self._connection:
+                self._connection.execute("BEGIN IMMEDIATE")
+                # A new bucket opens with the values of the sample before it
+                previous = self._connection.execute(
+                    f"SELECT {', '.join(STAT_FIELDS)} FROM samples WHERE shop = ? AND ts < ? "
+                    f"ORDER BY ts DESC LIMIT 1", (shop, timestamp_value)).fetchone()
+                opening = [value if previous is None or previous[index] is None else previous[index]
+                           for index, value in enumerate(values)]
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO samples (shop, ts, favorite_count, rating, rating_count, sold_count, "
+                    "errors) VALUES (?, ?, ?, ?, ?, ?, ?)", (shop, timestamp_value, *values, stats.errors))
+                for period, start in buckets:
+                    self._connection.execute(self._rollup_upsert, (
+                        shop, period, _timestamp(start), timestamp_value, timestamp_value,
+                        *opening, *values, stats.rating, stats.rating))
+
+    def samples(self, shop: str, start: datetime = None, end: datetime = None) -> List[Sample]:
+        """Raw samples with start <= timestamp < end"""
+        start = _timestamp(start) if start else 0
+        end = _timestamp(end) if end else 2 ** 62
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT ts, favorite_count, rating, rating_count, sold_count, errors FROM samples "
+                "WHERE shop = ? AND ts >= ? AND ts < ? ORDER BY ts", (shop.lower(), start, end)).fetchall()
+        return [Sample(_datetime(row[0]), *row[1:]) for row in rows]
+
+    def rollups(self, shop: str, period: str, start: datetime = None, end: datetime = None) -> List[Rollup]:
+        """Rollups for buckets that start in [start, end)"""
+        if period not in PERIODS:
+            raise ValueError(f"period must be one of {', '.join(PERIODS)}, not {period}")
+        start = _timestamp(start) if start else 0
+        end = _timestamp(end) if end else 2 ** 62
+        opens = ", ".join(f"open_{field}" for field in STAT_FIELDS)
+        closes = ", ".join(f"close_{field}" for field in STAT_FIELDS)
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT bucket_start, samples, first_ts, last_ts, {opens}, {closes}, min_rating, max_rating "
+                f"FROM rollups WHERE shop = ? AND period = ? AND bucket_start >= ? AND bucket_start < ? "
+                f"ORDER BY bucket_start", (shop.lower(), period, start, end)).fetchall()
+
+        result = []
+        for row in rows:
+            first_timestamp = _datetime(row[2])
+            last_timestamp = _datetime(row[3])
+            result.append(Rollup(
+                period=period, bucket_start=_datetime(row[0]), samples=row[1],
+                first_timestamp=first_timestamp, last_timestamp=last_timestamp,
+                opening=Sample(first_timestamp, *row[4:8]), closing=Sample(last_timestamp, *row[8:12]),
+                min_rating=row[12], max_rating=row[13]))
+        return result
+
+    def reset_windows(self, shop: str, reset_hour: int, start: datetime, end: datetime,
+                      kinds: Iterable[str] = WINDOW_KINDS) -> Dict[str, List[Rollup]]:
+        """Rollups for every daily, weekly and monthly window that overlaps [start, end) and has samples
+
+        The windows' boundaries are worked out first, then the hourly rollups they cover are read in one index scan
+        and each is folded into the window of every kind it falls in. Opening and closing values are the ones at the
+        window's boundaries, so asking again gives the same answer no matter when it is asked.
+        """
+        boundaries = {kind: window_boundaries(kind, reset_hour, start, end) for kind in kinds}
+        if not boundaries:
+            return {}
+        hourly = self.rollups(shop, "hour", start=min(bounds[0] for bounds in boundaries.values()),
+                              end=max(bounds[-1] for bounds in boundaries.values()))
+
+        buckets: Dict[str, Dict[int, List[Rollup]]] = {kind: {} for kind in boundaries}
+        for rollup in hourly:
+            for kind, bounds in boundaries.items():
+                index = bisect_right(bounds, rollup.bucket_start) - 1
+                if 0 <= index < len(bounds) - 1:
+                    buckets[kind].setdefault(index, []).append(rollup)
+        return {kind: [_merge(kind, boundaries[kind][index], rollups) for index, rollups in sorted(windows.items())]
+                for kind, windows in buckets.items()}
+
+    def prune(self, shop: str, older_than: timedelta) -> int:
+        """Deletes raw samples older than the cutoff. Rollups are kept. Returns the number deleted"""
+        cutoff = _timestamp(datetime.now() - older_than)
+        with self._lock:
+            with self._connection:
+                self._connection.execute("BEGIN IMMEDIATE")
+                cursor = self._connection.execute("DELETE FROM samples WHERE shop = ? AND ts < ?",
+                                                  (shop.lower(), cutoff))
+        return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
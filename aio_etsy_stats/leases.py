@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+# True when the node still holds the lease it was given. Used inside the same transaction as fenced writes
+LEASE_HELD_SQL = "SELECT 1 FROM shop_leases WHERE shop = ? AND owner = ? AND token = ? AND expires > ?"
+
+
+class LeaseLost(Exception):
+    """Raised when a node tries to update a shop after another node took over its lease"""
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def rendezvous_owner(shop: str, nodes: Iterable[str]) -> str:
+    """The node a shop belongs to. Adding or removing a node only moves the shops that hash highest to it"""
+    return max(nodes, key=lambda node: hashlib.blake2b(f"{node}/{shop}".encode("utf-8"), digest_size=8).digest())
+
+
+class ShopLease:
+    """A node's lease on a shop. The token goes up every time the shop changes hands, so a node that lost the shop
+    can't write over the new owner's state even if it doesn't know yet"""
+
+    def __init__(self, coordinator: "LeaseCoordinator", shop: str, token: int):
+        self.coordinator = coordinator
+        self.shop = shop
+        self.owner = coordinator.node_id
+        self.token = token
+
+    def held(self) -> bool:
+        return self.coordinator.holds(self)
+
+    def __repr__(self):
+        return f"ShopLease({self.shop!r}, owner={self.owner!r}, token={self.token})"
+
+
+class LeaseCoordinator:
+    """Splits shops between the nodes sharing a state database, with no other service needed
+
+    Each node heartbeats into the ``nodes`` table and holds a lease per shop that expires after ``lease_seconds``
+    unless renewed. Shops are assigned to the live nodes by rendezvous hashing, so when a node joins the others release
+    the shops that now belong to it, and when a node stops its shops are taken over once their leases run out. The
+    database has to be on a local disk shared by the nodes, not a network filesystem, for SQLite's locking to hold.
+    """
+
+    def __init__(self, path: str, node_id: str = None, lease_seconds: float = 60, logger: logging.Logger = None):
+        self.path = path
+        self.node_id = node_id or default_node_id()
+        self.lease_seconds = lease_seconds
+        self.logger = logger or logging.getLogger(type(self).__name__)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS nodes (node_id TEXT PRIMARY KEY, heartbeat REAL NOT NULL) WITHOUT ROWID")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS shop_leases (shop TEXT PRIMARY KEY, owner TEXT, token INTEGER NOT NULL, "
+            "expires REAL NOT NULL) WITHOUT ROWID")
+
+    def _live_nodes(self, now: float) -> List[str]:
+        rows = self._connection.execute("SELECT node_id FROM nodes WHERE heartbeat > ? ORDER BY node_id",
+                                        (now - self.lease_seconds,)).fetchall()
+        return [row[0] for row in rows]
+
+    def rebalance(self, shops: Iterable[str]) -> Dict[str, ShopLease]:
+        """Heartbeats, renews or claims the leases for the shops that belong to this node and releases the rest
+
+        Returns the leases this node holds afterwards. A shop that belongs to this node but is still leased to another
+        one is claimed on a later call, once that lease is released or expires.
+        """
+        now = datetime.now().timestamp()
+        expires = now + self.lease_seconds
+        held = {}
+        with self._lock:
+            with self._connection:
+                self._connection.execute("BEGIN IMMEDIATE")
+                self._connection.execute(
+                    "INSERT INTO nodes (node_id, heartbeat) VALUES (?, ?) "
+                    "ON CONFLICT (node_id) DO UPDATE SET heartbeat = excluded.heartbeat", (self.node_id, now))
+                nodes = self._live_nodes(now)
+                leases = {shop: (owner, token, lease_expires) for shop, owner, token, lease_expires
+                          in self._connection.execute("SELECT shop, owner, token, expires FROM shop_leases")}
+
+                for shop in dict.fromkeys(shop.lower() for shop in shops):
+                    owner, token, lease_expires = leases.get(shop, (None, 0, 0.0))
+                    mine = owner == self.node_id and lease_expires > now
+                    if rendezvous_owner(shop, nodes) != self.node_id:
+                        if mine:
+                            # Expire it now so the node it belongs to doesn't have to wait out the lease
+                            self._connection.execute("UPDATE shop_leases SET expires = 0 WHERE shop = ?", (shop,))
+                        continue
+                    if not mine and owner is not None and lease_expires > now:
+                        continue  # Still leased to the node it used to belong to
+                    if owner != self.node_id:
+                        token += 1  # Changing hands, so writes with the old token are fenced off
+                    self._connection.execute(
+                        "INSERT INTO shop_leases (shop, owner, token, expires) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (shop) DO UPDATE SET owner = excluded.owner, token = excluded.token, "
+                        "expires = excluded.expires", (shop, self.node_id, token, expires))
+                    held[shop] = token
+        return {shop: ShopLease(self, shop, token) for shop, token in held.items()}
+
+    def holds(self, lease: ShopLease) -> bool:
+        with self._lock:
+            return self._connection.execute(
+                LEASE_HELD_SQL, (lease.shop, lease.owner, lease.token, datetime.now().timestamp())
+            ).fetchone() is not None
+
+    def release_all(self) -> None:
+        """Gives up every lease and leaves, so the other nodes take over the shops right away"""
+        with self._lock:
+            with self._connection:
+                self._connection.execute("BEGIN IMMEDIATE")
+                self._connection.execute("UPDATE shop_leases SET expires = 0 WHERE owner = ?", (self.node_id,))
+                self._connection.execute("DELETE FROM nodes WHERE node_id = ?", (self.node_id,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -1,54 +1,87 @@
+import ast
 import atexit
-import datetime
 import json
 import logging
-import re
+import os
 import socket
 import sys
 import textwrap
-from datetime import datetime, date, time, timedelta
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
 from os import environ
-from random import uniform
-from time import sleep
-from typing import NamedTuple, Optional, Tuple
+from time import monotonic, sleep
+from typing import TYPE_CHECKING, Callable, List, Optional, Tuple
+
+from aio_etsy_stats.fetchers import REQUIRED_FIELD_PATTERNS, FallbackFetcher, HttpFetcher
+from aio_etsy_stats.history import STAT_FIELDS, WINDOW_KINDS, HistoryStore, Rollup, Sample, window_end, window_start
+from aio_etsy_stats.leases import LeaseLost, ShopLease
+from aio_etsy_stats.metrics import (AIO_REQUEST_SECONDS, EXTRACTION_ERRORS, PAGE_FINGERPRINTS, PAGE_LOAD_SECONDS,
+                                    PAGE_TRANSFER_BYTES, PARSE_SECONDS, SCRAPES, SHOP_STAT, start_metrics_server)
+from aio_etsy_stats.parsing import PARSER_ENGINES, EtsyStoreStats, parse_page
+from aio_etsy_stats.provisioning import ProvisioningManifest, default_state_dir, load_group_feeds
+from aio_etsy_stats.resilience import OPEN, CircuitOpen, DependencyTimeouts, circuit_breaker
+from aio_etsy_stats.scheduler import AdaptiveInterval, jitter_range, parse_quiet_hours
+from aio_etsy_stats.sold_index import SoldListingIndex
+from aio_etsy_stats.state_store import ShopState, StateStore
+from aio_etsy_stats.webdriver_pool import BrowserProfile, WebDriverPool, page_transfer_bytes, wait_for_page
+
+# Adafruit IO, Discord, schedule and the parser processes are imported where they are first used, so a run that
+# doesn't need them starts faster
+if TYPE_CHECKING:
+    import Adafruit_IO
+    from aio_etsy_stats.parse_pool import ParserPool
+    from aio_etsy_stats.publisher import AIOPublisher
+
+
+ETSY_BASE_URL = "https://www.etsy.com"
+PUBLIC_IP_URL = "https://api.ipify.org"
+PUBLIC_IP_TTL_SECONDS = 15 * 60
+_public_ip_lock = threading.Lock()
+_public_ip_cache = {"ip": None, "expires": 0.0}
+
+
+def get_public_ip(timeout: float = DependencyTimeouts().ipify) -> str:
+    """The public IP is in most Discord messages, so it is only looked up again after PUBLIC_IP_TTL_SECONDS
+
+    While ipify can't be reached the last IP found is used, or "unknown" if there wasn't one.
+    """
+    with _public_ip_lock:
+        if _public_ip_cache["ip"] and monotonic() < _public_ip_cache["expires"]:
+            return _public_ip_cache["ip"]
+        import requests
 
-import Adafruit_IO
-import requests
-import schedule
-from Adafruit_IO.model import Group, Feed
-from bs4 import BeautifulSoup
-from discord_logging.handler import DiscordHandler
-from selenium import webdriver
-
-
-def get_public_ip():
-    response = requests.get('https://api.ipify.org').text
-    if response:
-        return response
-
-
-class EtsyStoreStats(NamedTuple):
-    """Used to format stats from Etsy store"""
-    favorite_count: Optional[int] = None
-    rating: Optional[float] = None
-    rating_count: Optional[int] = None
-    sold_count: Optional[int] = None
-    avatar_url: Optional[str] = None
-    errors: int = 0
-
-
-def test_port(hostname: str, port: int) -> int:
-    """Tests if port is open on remote host"""
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(2)
-    result = sock.connect_ex((hostname, int(port)))
-    sock.close()
-    return result
-
-
-def get_timedelta_from_now(start: datetime) -> timedelta:
-    result = datetime.now() - start
-    return result
+        try:
+            with circuit_breaker("ipify").guard():
+                response = requests.get(PUBLIC_IP_URL, timeout=timeout)
+                response.raise_for_status()
+        except Exception:
+            return _public_ip_cache["ip"] or "unknown"
+        if response.text:
+            _public_ip_cache.update(ip=response.text, expires=monotonic() + PUBLIC_IP_TTL_SECONDS)
+        return _public_ip_cache["ip"] or "unknown"
+
+
+def stdout_logger(name: str) -> logging.Logger:
+    """Logger that writes everything from debug up to stdout, which is where the container's logs are read from"""
+    logging.basicConfig()
+    logger = logging.Logger(name=name)
+
+    handler_stdout = logging.StreamHandler(sys.stdout)
+    handler_stdout.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    handler_stdout.setLevel(logging.DEBUG)
+    logger.addHandler(handler_stdout)
+    return logger
+
+
+def parse_number(value, number_type: type):
+    """Converts an AIO feed value to a number, or None if it isn't one"""
+    if value is None:
+        return None
+    try:
+        return number_type(float(value)) if number_type is int else number_type(value)
+    except (TypeError, ValueError):
+        return None
 
 
 class AIOEtsyStats:
@@ -57,132 +90,188 @@ class AIOEtsyStats:
     def __init__(self, shop: str, default_reset_hour: int = 14, scrape_interval_minutes: int = 10,
                  aio_username: str = None, aio_password: str = None,
                  discord_webhook: str = None, discord_avatar_url: str = None,
-                 selenium_host: str = None, selenium_port: int = None):
-        # region Logging
-        logging.basicConfig()
-        self.logger = logging.Logger(name=type(self).__name__)
-
-        handler_stdout = logging.StreamHandler(sys.stdout)
-        handler_stdout.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
-        handler_stdout.setLevel(logging.DEBUG)
-        self.logger.addHandler(handler_stdout)
-        # endregion
+                 selenium_host: str = None, selenium_port: int = None,
+                 webdriver_pool_size: int = 1, webdriver_max_navigations: int = 50,
+                 webdriver_max_memory_mb: int = None, webdriver_pool: WebDriverPool = None,
+                 browser_profile: BrowserProfile = None, fetch_mode: str = "auto", parser_engine: str = "auto",
+                 aio_rate_per_minute: float = 30, aio_publisher: "AIOPublisher" = None, state_dir: str = None,
+                 history_retention_days: int = None, min_scrape_interval_minutes: float = None,
+                 max_scrape_interval_minutes: float = None, quiet_hours: str = None, metrics_port: int = None,
+                 parser_workers: int = 0, parser_pool: "ParserPool" = None, aio_client: "Adafruit_IO.Client" = None,
+                 etsy_base_url: str = ETSY_BASE_URL, lease: ShopLease = None, timeouts: DependencyTimeouts = None,
+                 breaker_failures: int = 5, breaker_reset_seconds: float = 60):
+        self.logger = stdout_logger(name=type(self).__name__)
 
         # region Class basics
         self.shop = shop
-        self.scrape_url = f"https://www.etsy.com/shop/{shop}/sold"
+        self.scrape_url = f"{etsy_base_url.rstrip('/')}/shop/{shop}/sold"
         self.default_reset_hour = default_reset_hour
         self.scrape_interval_minutes = scrape_interval_minutes
         self.selenium_host = selenium_host
         self.selenium_port = selenium_port
+        # Set when shops are split between nodes. Updates stop as soon as another node has taken the shop over
+        self.lease = lease
+        # endregion
+
+        # region Dependencies
+        # Every network call has a timeout, and a dependency that keeps failing is skipped until its breaker lets a
+        # probe through. There is one breaker per dependency in the process, so shops share them
+        self.timeouts = timeouts or DependencyTimeouts()
+        breakers = {name: circuit_breaker(name, failure_threshold=breaker_failures,
+                                          reset_seconds=breaker_reset_seconds, logger=self.logger)
+                    for name in ("etsy", "selenium", "aio", "ipify")}
+        self._etsy_breaker = breakers["etsy"]
+        self._selenium_breaker = breakers["selenium"]
+        self._aio_breaker = breakers["aio"]
+        # endregion
+
+        # Timings, error counts and current stats in the Prometheus text format on /metrics. Shops share the server
+        if metrics_port:
+            start_metrics_server(port=metrics_port)
+            self.logger.debug(f"Serving metrics on port {metrics_port}")
+
+        # region Scrape interval
+        # Scrapes speed up while orders and favorites are coming in and slow down overnight or while failing
+        self._scrape_interval = AdaptiveInterval(
+            base_minutes=scrape_interval_minutes,
+            min_minutes=min_scrape_interval_minutes or max(1.0, scrape_interval_minutes / 2),
+            max_minutes=max_scrape_interval_minutes or scrape_interval_minutes * 6,
+            quiet_hours=parse_quiet_hours(quiet_hours),
+        )
+        self.last_scrape_changed = False  # Whether the last scrape saw sold or favorite counts change
+        self.last_scrape_errors = 0
+        # endregion
+
+        # The asyncio pipeline sets these to hand AIO writes and notifications to its own stages
+        self.publish_hook: Optional[Callable[[str, object], None]] = None
+        self.notify_hook: Optional[Callable[[int, str], None]] = None
+
+        # Reuse browser sessions between scrapes. Starting Chrome is most of the time spent scraping. A pool can be
+        # shared between shops, in which case whoever created it is responsible for closing it
+        self._owns_webdriver_pool = webdriver_pool is None
+        self._webdriver_pool = webdriver_pool or WebDriverPool(
+            selenium_host=selenium_host, selenium_port=selenium_port, size=webdriver_pool_size,
+            max_navigations=webdriver_max_navigations, max_memory_mb=webdriver_max_memory_mb,
+            browser_profile=browser_profile, timeout=self.timeouts.selenium, logger=self.logger)
+        self.last_page_bytes: Optional[int] = None  # Transferred by the browser for the last Selenium scrape
+
+        # region Fetching
+        # auto tries a plain HTTP request first and only uses Selenium when Etsy challenges it or fields are missing
+        if fetch_mode not in ("auto", "http", "selenium"):
+            raise ValueError(f"fetch_mode must be auto, http or selenium, not {fetch_mode}")
+        self.fetch_mode = fetch_mode
+        self._http_fetcher = HttpFetcher(timeout=self.timeouts.etsy, breaker=self._etsy_breaker,
+                                         logger=self.logger) if fetch_mode != "selenium" else None
+        self._fetcher = FallbackFetcher(http_fetcher=self._http_fetcher, selenium_fetch=self._get_selenium,
+                                        logger=self.logger) if fetch_mode == "auto" else None
         # endregion
 
-        # Get the current stats just incase this hasn't been set up before or AIO is not used
-        self.logger.debug(f"Getting Etsy stats for {self.shop} to use for loading")
-        stats = self.scrape_etsy_stats()
+        # fast scans the raw page, soup builds a BeautifulSoup tree, auto uses soup when fast misses something
+        if parser_engine not in PARSER_ENGINES:
+            raise ValueError(f"parser_engine must be one of {', '.join(PARSER_ENGINES)}, not {parser_engine}")
+        self.parser_engine = parser_engine
+        # Parsing can run in worker processes so many shops aren't parsed one at a time. Like the browser pool, a
+        # parser pool can be shared between shops
+        self._owns_parser_pool = parser_pool is None and bool(parser_workers)
+        self._parser_pool = parser_pool
+        if parser_pool is None and parser_workers:
+            from aio_etsy_stats.parse_pool import ParserPool
+
+            self._parser_pool = ParserPool(workers=parser_workers, logger=self.logger)
+        # A page whose stat regions hash the same as the last processed one isn't parsed or compared again
+        self.fingerprint_counts = Counter()  # hit, miss
+        self.last_page_unchanged = False
+        self._page_fingerprint: Optional[str] = None  # Of the page being processed
+        self._page_listing_ids: Tuple[str, ...] = ()
+        self._processed_fingerprint: Optional[str] = None
+        self._processed_stats: Optional[EtsyStoreStats] = None
 
         # region Discord
+        self._discord_handler = None
         if discord_webhook:
-            discord_handler = DiscordHandler(
+            from aio_etsy_stats.notifications import QueuedDiscordHandler
+
+            # Messages are queued and sent in batches from a background thread. The shop avatar replaces this once
+            # the first scrape finds it
+            self._discord_handler = QueuedDiscordHandler(
                 service_name=type(self).__name__,
                 webhook_url=discord_webhook,
-                avatar_url=stats.avatar_url or discord_avatar_url,
+                avatar_url=discord_avatar_url,
             )
-            discord_handler.setFormatter(logging.Formatter("%(message)s"))
-            discord_handler.setLevel(logging.INFO)
-            self.logger.addHandler(discord_handler)
+            self._discord_handler.setFormatter(logging.Formatter("%(message)s"))
+            self._discord_handler.setLevel(logging.INFO)
+            self.logger.addHandler(self._discord_handler)
         # endregion
 
-        # Now that logger is enabled, log if it was okay
-        if stats.errors > 0:
-            self.logger.debug(f"Stats were returned with {stats.errors} error(s)")
-        else:
-            self.logger.debug(f"Initial Stats were returned okay. Example... sold {stats.sold_count}")
-
+        interval = self._scrape_interval
         message = textwrap.dedent(f"""
         {type(self).__name__} for **{self.shop}**
         
         -# Scraping for store metrics on host `{socket.gethostname()}`
         -# Current time is **{datetime.now():%Y-%m-%d %H:%M:%S%z}**
-        -# Public IP is `{get_public_ip()}`
-        -# Scraping using Selenium Chrome
-        -# Scrapes run about every **{self.scrape_interval_minutes}** minutes
+        -# Public IP is `{get_public_ip(timeout=self.timeouts.ipify)}`
+        -# Scraping using {self._fetch_description()}
+        -# Scrapes run every **{interval.min_minutes:g}** to **{interval.max_minutes:g}** minutes depending on activity
         """).strip()
         if bool(environ.get("DEV_LOVE_NOTE", "0")):
             message += "\n-# *Shawn ❤️ Nicole*"
         self.logger.info(message.strip())
 
+        # region Local state
+        # State is kept locally so restarts don't need the network. AIO is a mirror of it
+        self._state_dir = state_dir or default_state_dir()
+        self._state_store = StateStore(path=os.path.join(self._state_dir, "state.db"))
+        local_state = self._state_store.load(self.shop)
+        # Every scrape is kept with hourly and daily rollups, which reset windows are worked out from. Raw samples are
+        # pruned after the retention
+        self._history = HistoryStore(path=os.path.join(self._state_dir, "history.db"))
+        self.history_retention_days = history_retention_days
+        # Sold listing entries already counted, so each new entry on the sold page counts as one sale
+        self._sold_index = SoldListingIndex(path=os.path.join(self._state_dir, "state.db"))
+        # endregion
+
         # region Setup AIO
-        if not all([aio_username, aio_password]):
+        self._aio = None
+        self._aio_publisher = None
+        self._owns_aio_publisher = aio_publisher is None
+        self._unset_feeds = set()  # Feeds created this run that get their first value from the first scrape
+        self._aio_username = None
+        # False until the counters kept in AIO have been loaded. Nothing is sent before then, so they aren't replaced
+        self._aio_seeded = True
+        feed_values = None  # Last value of every feed in the group, if they could be loaded
+        if aio_client is None and not all([aio_username, aio_password]):
             self.logger.warning("aio_username and/or aio_password were not provided")
         else:
+            from aio_etsy_stats.publisher import AIOPublisher
+
+            # A client can be passed in instead, like the in-memory one the load test harness uses
+            aio_username = aio_username or aio_client.username
             self.logger.debug(f"Connecting to AIO as {aio_username}")
-            # Create aio if username and password were supplied
-            self._aio = Adafruit_IO.Client(aio_username, aio_password)
-            existing_feed_group = None
-            try:
-                self.logger.debug("Creating Feed Group and Feeds if missing")
-                existing_feed_group = self._aio.groups(self.shop.lower())
-            except Exception as e:
-                pass
-            finally:
-                if not existing_feed_group:
-                    self.logger.debug(f"Creating Feed Group \"{self.shop}\"")
-                    self._aio.create_group(group=Group(name=self.shop, key=self.shop.lower()))
-                feeds = [
-                    (Feed(name="Daily Order Count", key="daily-order-count"), "0"),
-                    (Feed(name="Favorite Count", key="favorite-count"), stats.favorite_count),
-                    (Feed(name="Rating", key="rating"), stats.rating),
-                    (Feed(name="Rating Count", key="rating-count"), stats.rating_count),
-                    (Feed(name="Sold Count", key="sold-count"), stats.sold_count),
-                    (Feed(name="_Reset Hour", key="reset-hour"), default_reset_hour),
-                    (Feed(name="_Starting Stats", key="starting-stats"), {"first": "run"}),
-                ]
-                for feed, initial_value in feeds:
-                    existing_feed = None
-                    try:
-                        existing_feed = self._aio.feeds(self._get_feed_name(feed.key))
-                    except Exception as e:
-                        pass  # No logging
-                    finally:
-                        if not existing_feed:
-                            self.logger.debug(f"Creating feed \"{feed.name}\"")
-                            self._aio.create_feed(feed=feed, group_key=self.shop.lower())
-
-                            if initial_value:
-                                self._send_aio(feed=feed.key, value=initial_value)
+            if aio_client is None:
+                from aio_etsy_stats.publisher import TimeoutClient
+
+                aio_client = TimeoutClient(aio_username, aio_password, timeout=self.timeouts.aio)
+            self._aio = aio_client
+            # Writes are sent from a background thread. A publisher can be shared to share the account's rate limit
+            self._aio_publisher = aio_publisher or AIOPublisher(client=self._aio,
+                                                                rate_per_minute=aio_rate_per_minute,
+                                                                breaker=self._aio_breaker, logger=self.logger)
+            self._aio_username = aio_username
+            feed_values = self._provision_aio(aio_username=aio_username,
+                                              load_values=local_state is None or not local_state.seeded)
         # endregion
 
         # region Set class variables to track stats
-        self.logger.debug("Loading stats from AIO if they exist otherwise using current stats")
         self.update_total = 0  # Used to count the number of times parsing is performed
 
-        self.favorite_count: int = stats.favorite_count
-        self.rating: float = stats.rating
-        self.rating_count: int = stats.rating_count
-        self.sold_count: int = stats.sold_count
-        # The received_aio command will return default_value if the feed doesn't have a value (i.e. this is the first
-        # run. So we can get the stats and use them as the default_value
-        self.daily_order_count: int = int(self._receive_aio(feed="daily-order-count",
-                                                            default_value=0))
-        self.reset_hour: int = int(self._receive_aio(feed="reset-hour",
-                                                     default_value=default_reset_hour))
-
-        starting_stats = self._get_starting_stats()
-
-        # This can't be obtained from parsing, so if it doesn't exist in AIO default to stats 😓
-        self.starting_favorite_count: int = int(starting_stats.get("starting-favorite-count", stats.favorite_count))
-        self.starting_rating: float = float(starting_stats.get("starting-rating", stats.rating))
-        self.starting_rating_count: int = int(starting_stats.get("starting-rating-count", stats.rating_count))
-        self.starting_sold_count: int = int(starting_stats.get("starting-sold-count", stats.sold_count))
-
-        # Load reset timestamp if it was found
-        reset_timestamp = starting_stats.get("reset-timestamp")
-        if reset_timestamp:
-            self.reset_datetime: datetime = datetime.fromtimestamp(float(reset_timestamp))
+        if local_state and local_state.seeded:
+            self.logger.debug(f"Loading stats from {self._state_store.path}")
         else:
-            self.reset_datetime: datetime = datetime.now()
-        self._validate_reset_hour()
+            self.logger.debug("Loading stats from AIO if they exist otherwise using the first scrape")
+            local_state = self._seed_state(local_state, feed_values)
+        self._apply_state(local_state)
+        self._validate_reset_hour(desired_reset_hour=self.reset_hour)
+        self._save_state()
 
         self._log_current_stats()
         # endregion
@@ -191,76 +280,347 @@ class AIOEtsyStats:
 
     def _atexit(self):
         """Log that the client is closing"""
+        if self._owns_webdriver_pool:
+            self._webdriver_pool.close()
+        if self._http_fetcher:
+            self._http_fetcher.close()
+        if self._parser_pool and self._owns_parser_pool:
+            self._parser_pool.close()
+        if self._aio_publisher and self._owns_aio_publisher:
+            self._aio_publisher.close()
+        self._state_store.close()
+        self._history.close()
+        self._sold_index.close()
         self.logger.info(textwrap.dedent(f"""
         {type(self).__name__} for **{self.shop}**
 
         -# Exiting on host `{socket.gethostname()}`
         """).strip())
+        if self._discord_handler:
+            self._discord_handler.close()  # Sends whatever is still queued, including the message above
 
-    def _get_webdriver(self):
-        if self.selenium_host and self.selenium_port:
-            self.logger.debug("Waiting up to 20s for selenium port to be open")
-            start = datetime.now()
-            while (test_port(self.selenium_host, self.selenium_port) != 0) \
-                    and (get_timedelta_from_now(start) < timedelta(seconds=20)):
-                sleep(1)
-
-        if self.selenium_host and self.selenium_port:
-            driver = webdriver.Remote(
-                command_executor=f"http://{self.selenium_host}:{self.selenium_port}",
-                options=webdriver.ChromeOptions()
-            )
+    def _parse_starting_stats(self, value: Optional[str]) -> dict:
+        """Parses the starting-stats feed value. It is sent as a stringified dict"""
+        if not value:
+            return {}
+        try:
+            starting_stats = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            try:
+                starting_stats = json.loads(value.replace("\'", "\""))
+            except ValueError:
+                self.logger.warning(f"Unable to parse starting-stats value {value}")
+                return {}
+        return starting_stats if isinstance(starting_stats, dict) else {}
+
+    def _state_from_feed_values(self, feed_values: dict) -> ShopState:
+        """Builds the shop state from AIO feed values. Used when there is no local state yet"""
+        starting_stats = self._parse_starting_stats(feed_values.get("starting-stats"))
+        reset_timestamp = parse_number(starting_stats.get("reset-timestamp"), float)
+        return ShopState(
+            favorite_count=parse_number(feed_values.get("favorite-count"), int),
+            rating=parse_number(feed_values.get("rating"), float),
+            rating_count=parse_number(feed_values.get("rating-count"), int),
+            sold_count=parse_number(feed_values.get("sold-count"), int),
+            starting_favorite_count=parse_number(starting_stats.get("starting-favorite-count"), int),
+            starting_rating=parse_number(starting_stats.get("starting-rating"), float),
+            starting_rating_count=parse_number(starting_stats.get("starting-rating-count"), int),
+            starting_sold_count=parse_number(starting_stats.get("starting-sold-count"), int),
+            daily_order_count=parse_number(feed_values.get("daily-order-count"), int) or 0,
+            reset_hour=parse_number(feed_values.get("reset-hour"), int),
+            reset_timestamp=reset_timestamp,
+        )
+
+    def _apply_state(self, state: ShopState) -> None:
+        """Sets the counters from a saved or loaded state"""
+        # Stats that weren't saved are set from the first scrape by _prime_from_stats
+        self.favorite_count: Optional[int] = state.favorite_count
+        self.rating: Optional[float] = state.rating
+        self.rating_count: Optional[int] = state.rating_count
+        self.sold_count: Optional[int] = state.sold_count
+        self.daily_order_count: int = state.daily_order_count or 0
+        self.reset_hour: int = self.default_reset_hour if state.reset_hour is None else state.reset_hour
+        self._aio_seeded = state.seeded
+
+        # This can't be obtained from parsing, so if it wasn't saved the first scrape is used 😓
+        self.starting_favorite_count: Optional[int] = state.starting_favorite_count
+        self.starting_rating: Optional[float] = state.starting_rating
+        self.starting_rating_count: Optional[int] = state.starting_rating_count
+        self.starting_sold_count: Optional[int] = state.starting_sold_count
+
+        # Load reset timestamp if it was found
+        if state.reset_timestamp:
+            self.reset_datetime: datetime = datetime.fromtimestamp(float(state.reset_timestamp))
         else:
-            driver = webdriver.Chrome()
+            self.reset_datetime: datetime = datetime.now()
+
+    def _current_state(self) -> ShopState:
+        """The counters as they would be saved"""
+        return ShopState(
+            favorite_count=self.favorite_count, rating=self.rating, rating_count=self.rating_count,
+            sold_count=self.sold_count, starting_favorite_count=self.starting_favorite_count,
+            starting_rating=self.starting_rating, starting_rating_count=self.starting_rating_count,
+            starting_sold_count=self.starting_sold_count, daily_order_count=self.daily_order_count,
+            reset_hour=self.reset_hour, reset_timestamp=self.reset_datetime.timestamp(), seeded=self._aio_seeded,
+        )
+
+    def _seed_state(self, local_state: Optional[ShopState], feed_values: Optional[dict]) -> ShopState:
+        """State for a shop whose counters haven't been loaded from AIO yet
+
+        If AIO can't be read the state is marked as unseeded, so loading it is tried again instead of the counters
+        kept in AIO being replaced for good. Orders counted while it couldn't be read are added to AIO's.
+        """
+        if not self._aio:
+            return local_state._replace(seeded=True) if local_state else ShopState()
+        if feed_values is None:
+            # The bulk load failed, so fall back to asking for each feed
+            feed_values = {key: self._receive_aio(feed=key) for key in ("daily-order-count", "reset-hour",
+                                                                        "starting-stats")}
+            if all(value is None for value in feed_values.values()):
+                self.logger.warning(f"Unable to load the AIO counters for {self.shop}, trying again every update")
+                return (local_state or ShopState())._replace(seeded=False)
+
+        aio_state = self._state_from_feed_values(feed_values)
+        if local_state is None:
+            return aio_state
+
+        # Stats scraped while AIO couldn't be read are newer than AIO's
+        merged = {name: getattr(aio_state, name) if getattr(local_state, name) is None else getattr(local_state, name)
+                  for name in STAT_FIELDS}
+        if aio_state.reset_hour is not None:
+            merged["reset_hour"] = aio_state.reset_hour
+        if aio_state.reset_timestamp and aio_state.reset_timestamp > datetime.now().timestamp():
+            # AIO's day is still going, so it has the starting stats, and the orders counted locally are added to it
+            for name in STAT_FIELDS:
+                if getattr(aio_state, f"starting_{name}") is not None:
+                    merged[f"starting_{name}"] = getattr(aio_state, f"starting_{name}")
+            merged["daily_order_count"] = aio_state.daily_order_count + local_state.daily_order_count
+            merged["reset_timestamp"] = aio_state.reset_timestamp
+        return local_state._replace(seeded=True, **merged)
+
+    def _load_aio_counters(self) -> None:
+        """Tries again to load the counters kept in AIO, which couldn't be read when the shop's state was created"""
+        state = self._seed_state(self._current_state(), self._provision_aio(aio_username=self._aio_username))
+        if not state.seeded:
+            return
+        self.logger.info(f"Loaded the AIO counters for {self.shop}")
+        self._apply_state(state)
+        self._validate_reset_hour(desired_reset_hour=self.reset_hour)
+        self._save_state()
+
+        # Nothing was sent while they couldn't be loaded, so AIO is brought up to date
+        for feed, value in [("daily-order-count", self.daily_order_count), ("favorite-count", self.favorite_count),
+                            ("rating", self.rating), ("rating-count", self.rating_count),
+                            ("sold-count", self.sold_count), ("reset-hour", self.reset_hour)]:
+            if value is not None:
+                self._send_aio(feed=feed, value=value)
+        self._send_starting_stats()
+        self._log_current_stats()
+
+    def _save_state(self) -> None:
+        """Saves every counter to the local state store in one transaction. Fenced by the lease if there is one"""
+        try:
+            self._state_store.save(self.shop, self._current_state(), lease=self.lease)
+        except LeaseLost:
+            raise
+        except Exception as e:
+            self.logger.warning(f"An error occurred saving state to {self._state_store.path}")
+            self.logger.exception(e)
 
-        return driver
+        for stat, value in [("daily-order-count", self.daily_order_count), ("favorite-count", self.favorite_count),
+                            ("rating", self.rating), ("rating-count", self.rating_count),
+                            ("sold-count", self.sold_count)]:
+            if value is not None:
+                SHOP_STAT.set(value, shop=self.shop, stat=stat)
+
+    def _provision_aio(self, aio_username: str, load_values: bool = True) -> Optional[dict]:
+        """Creates the feed group and feeds if missing and returns the last value of every feed
+
+        The whole group is loaded with one request. Groups recorded in the local provisioning manifest aren't checked
+        for missing feeds, and aren't requested at all when ``load_values`` is False. Returns None if the group
+        couldn't be loaded.
+        """
+        from Adafruit_IO.model import Feed, Group
+
+        group_key = self.shop.lower()
+        feeds = [
+            (Feed(name="Daily Order Count", key="daily-order-count"), "0"),
+            (Feed(name="Favorite Count", key="favorite-count"), None),
+            (Feed(name="Rating", key="rating"), None),
+            (Feed(name="Rating Count", key="rating-count"), None),
+            (Feed(name="Sold Count", key="sold-count"), None),
+            (Feed(name="_Reset Hour", key="reset-hour"), self.default_reset_hour),
+            (Feed(name="_Starting Stats", key="starting-stats"), {"first": "run"}),
+        ]
+        manifest = ProvisioningManifest(path=os.path.join(self._state_dir, "provisioning.json"), logger=self.logger)
+        provisioned = manifest.is_provisioned(aio_username, group_key, [feed.key for feed, _ in feeds])
+        if provisioned and not load_values:
+            return {}
+
+        feed_values = None
+        load_failed = False
+        try:
+            with AIO_REQUEST_SECONDS.time(operation="load-group"):
+                feed_values = load_group_feeds(self._aio, group_key)
+        except Exception as e:
+            self.logger.warning(f"An error occurred loading AIO feed group {group_key}")
+            self.logger.exception(e)
+            load_failed = True
+
+        if provisioned and (load_failed or feed_values is not None):
+            return feed_values
+
+        self.logger.debug("Creating Feed Group and Feeds if missing")
+        if feed_values is None:
+            manifest.forget(aio_username, group_key)
+            try:
+                self.logger.debug(f"Creating Feed Group \"{self.shop}\"")
+                self._aio.create_group(group=Group(name=self.shop, key=group_key))
+            except Exception as e:
+                self.logger.debug(f"Unable to create Feed Group \"{self.shop}\": {e}")
+            feed_values = {}  # A new group has nothing to load
+
+        created = []
+        for feed, initial_value in feeds:
+            if feed.key in feed_values:
+                created.append(feed.key)
+                continue
+            try:
+                self.logger.debug(f"Creating feed \"{feed.name}\"")
+                self._aio.create_feed(feed=feed, group_key=group_key)
+                created.append(feed.key)
+            except Exception as e:
+                self.logger.debug(f"Unable to create feed \"{feed.name}\": {e}")
+                continue
 
-    def _get_starting_stats(self) -> dict:
-        """Gets starting-stats feed and parses the json to dictionary"""
-        starting_stats_response = self._receive_aio(feed="starting-stats")
-        starting_stats_response = starting_stats_response.replace("\'", "\"")
-        return json.loads(starting_stats_response)
+            if initial_value:
+                self._send_aio(feed=feed.key, value=initial_value)
+            else:
+                self._unset_feeds.add(feed.key)
+
+        manifest.mark_provisioned(aio_username, group_key, created)
+        return None if load_failed else feed_values
+
+    def _prime_from_stats(self, stats: EtsyStoreStats) -> None:
+        """Fills in any stats that couldn't be loaded from AIO using a scrape, so they aren't reported as changes"""
+        primed = []
+        for name in ("favorite_count", "rating", "rating_count", "sold_count"):
+            value = getattr(stats, name)
+            if value is None:
+                continue
+            if getattr(self, name) is None:
+                setattr(self, name, value)
+                primed.append(name)
+            if getattr(self, f"starting_{name}") is None:
+                setattr(self, f"starting_{name}", value)
+                primed.append(f"starting_{name}")
+        if not primed:
+            return
+
+        self.logger.debug(f"Set {', '.join(primed)} from scraped stats")
+        for feed, value in [("favorite-count", self.favorite_count), ("rating", self.rating),
+                            ("rating-count", self.rating_count), ("sold-count", self.sold_count)]:
+            if feed in self._unset_feeds and value is not None:
+                self._unset_feeds.discard(feed)
+                self._send_aio(feed=feed, value=value)
+        self._save_state()
+        if any(name.startswith("starting_") for name in primed):
+            self._send_starting_stats()
 
     def _get_selenium(self, url: str) -> Tuple[str, str]:
-        """Gets webpage content with selenium"""
-        driver = None
+        """Gets webpage content with a pooled selenium session"""
         content = None
         title = None
         try:
-            driver = self._get_webdriver()
-            driver.get(url)
-            title = driver.title
-            content = driver.page_source
+            with self._selenium_breaker.guard(), self._webdriver_pool.session() as driver:
+                with PAGE_LOAD_SECONDS.time(source="selenium"):
+                    driver.get(url)
+                    # The page load strategy doesn't wait for the whole page, so wait for just the stats
+                    if not wait_for_page(driver, REQUIRED_FIELD_PATTERNS, self._webdriver_pool.profile.wait_seconds):
+                        self.logger.debug(f"Timed out waiting for the stats on {url}, reading the page as it is")
+                title = driver.title
+                content = driver.page_source
+                self.last_page_bytes = page_transfer_bytes(driver)
+
+            if self.last_page_bytes is not None:
+                PAGE_TRANSFER_BYTES.observe(self.last_page_bytes, source="selenium")
+                self.logger.debug(f"Browser transferred {self.last_page_bytes / 1024:.0f}KB for {url}")
 
             if not content:
                 self.logger.debug(f"No content for url {url}. Page title: {title}")
+        except CircuitOpen as e:
+            self.logger.debug(f"Not getting page {url} with Selenium Chrome: {e}")
         except Exception as e:
-            self.logger.warning(f"An error occurred getting page {url} with Selenium Firefox")
+            self.logger.warning(f"An error occurred getting page {url} with Selenium Chrome")
+            self.logger.exception(e)
+
+        return title, content
+
+    def _fetch_description(self) -> str:
+        """Describes the fetch mode for the startup message"""
+        return {
+            "auto": "HTTP with Selenium Chrome fallback",
+            "http": "HTTP",
+            "selenium": "Selenium Chrome",
+        }[self.fetch_mode]
+
+    def _get_http(self, url: str) -> Tuple[str, str]:
+        """Gets webpage content with the pooled HTTP session"""
+        content = None
+        title = None
+        try:
+            result = self._http_fetcher.fetch(url)
+            title, content = result.title, result.content
+            if not content:
+                self.logger.debug(f"No content for url {url}. Status code: {result.status_code}")
+        except CircuitOpen as e:
+            self.logger.debug(str(e))
+        except Exception as e:
+            self.logger.warning(f"An error occurred getting page {url} with HTTP")
             self.logger.exception(e)
-        finally:
-            if driver:
-                driver.close()
-                driver.quit()
 
         return title, content
 
-    def _validate_reset_hour(self):
+    def _fetch_page(self, url: str) -> Tuple[str, str]:
+        """Gets webpage content using the configured fetch mode. Nothing is fetched while Etsy is failing"""
+        if self._etsy_breaker.state == OPEN:
+            self.logger.debug(f"Skipping {url}, Etsy is failing. Trying again in "
+                              f"{self._etsy_breaker.retry_after():.0f}s")
+            return None, None
+        if self.fetch_mode == "selenium":
+            return self._get_selenium(url=url)
+        if self.fetch_mode == "http":
+            return self._get_http(url=url)
+
+        result = self._fetcher.fetch(url)
+        return result.title, result.content
+
+    def _validate_reset_hour(self, desired_reset_hour: int = None):
         """Used to validate that the reset hour is set correctly in the event it is changed on AIO"""
         # Prioritize AIO, but use the environment variable if not available
-        desired_reset_hour = int(self._receive_aio(feed="reset-hour", default_value=self.default_reset_hour,
-                                                   silent=True))
-        if desired_reset_hour:
+        if desired_reset_hour is None:
+            desired_reset_hour = int(self._receive_aio(feed="reset-hour", default_value=self.default_reset_hour,
+                                                       silent=True))
+        if desired_reset_hour is not None:
             # If the server shows the reset_hour different, update it
             if self.reset_hour != desired_reset_hour:
                 self.logger.debug(f"Changing reset hour from {self.reset_hour} to {desired_reset_hour}")
                 self.reset_hour = desired_reset_hour
 
         # If the reset hour isn't correct for the existing datetime, update it
-        if any([self.reset_datetime.hour != self.reset_hour, self.reset_datetime.minute != 0]):
-            new_reset_datetime = self.reset_datetime
-            new_reset_datetime = new_reset_datetime.replace(hour=self.reset_hour, minute=0)
+        if self.reset_datetime != self.reset_datetime.replace(hour=self.reset_hour, minute=0, second=0, microsecond=0):
+            now = datetime.now()
+            if self.reset_datetime > now:
+                # The day in progress is worked out again for the new hour, along with what it started with
+                new_reset_datetime = window_end("daily", window_start("daily", self.reset_hour, now))
+                self._set_starting_stats(self._window_opening(now), fallback_to_current=False)
+            else:
+                # A reset is already due, and it sets the starting stats
+                new_reset_datetime = self.reset_datetime.replace(hour=self.reset_hour, minute=0, second=0,
+                                                                  microsecond=0)
             self.logger.debug(f"Changing reset time from {self.reset_datetime} to {new_reset_datetime}")
             self.reset_datetime = new_reset_datetime
+            self._save_state()
             self._send_starting_stats()
 
     def _get_feed_name(self, feed: str):
@@ -268,68 +628,138 @@ class AIOEtsyStats:
         return f"{self.shop.lower()}.{feed}"
 
     def _send_aio(self, feed: str, value):
-        """Helper function to send values to AIO and parse for errors"""
-        if self._aio:
-            feed = self._get_feed_name(feed=feed)
-
-            try:
-                self.logger.debug(f"Updating AIO feed {feed} to {value}")
-                if isinstance(value, dict):
-                    value = str(value)
-                _ = self._aio.send_data(feed=feed, value=value)
-            except Exception as e:
-                self.logger.warning(f"An error occurred updating AIO feed {feed} to {value}")
-                self.logger.exception(e)
+        """Helper function to queue values for AIO. They are sent and retried by the publisher"""
+        if not self._aio_seeded:
+            self.logger.debug(f"Not updating AIO feed {feed} until the AIO counters for {self.shop} are loaded")
+            return
+        if self.publish_hook:
+            self.publish_hook(feed, value)
+        else:
+            self._publish_aio(feed=feed, value=value)
+
+    def _publish_aio(self, feed: str, value):
+        """Queues the value with the publisher. With a lease it is checked again right before the value is sent"""
+        if self.lease and not self.lease.held():
+            self.logger.debug(f"Not updating AIO feed {feed} for {self.shop}, another node has taken it over")
+            return
+        if self._aio_publisher:
+            if isinstance(value, dict):
+                value = str(value)
+            self._aio_publisher.publish(group_key=self.shop.lower(), feed_key=feed, value=value,
+                                        fence=self.lease.held if self.lease else None)
+
+    def _notify(self, message: str, level: int = logging.INFO) -> None:
+        """Logs a message meant for people. It also goes to Discord when a webhook is set"""
+        if self.notify_hook:
+            self.notify_hook(level, message.strip())
+        else:
+            self.logger.log(level, message.strip())
 
     def _receive_aio(self, feed: str, default_value: object = None, silent: bool = False):
         """Helper method to get values from aio"""
         return_val = default_value
         if self._aio:
+            from aio_etsy_stats.publisher import is_aio_outage
+
             feed = self._get_feed_name(feed=feed)
 
             try:
-                response = self._aio.receive(feed=feed)
+                with self._aio_breaker.guard(is_failure=is_aio_outage), AIO_REQUEST_SECONDS.time(operation="receive"):
+                    response = self._aio.receive(feed=feed)
                 if not silent:
                     self.logger.debug(f"AIO Feed {feed} has a value of {response.value}")
                 return response.value
+            except CircuitOpen as e:
+                self.logger.debug(f"Not getting AIO feed {feed} value: {e}")
             except Exception as e:
                 self.logger.warning(f"An error occurred getting AIO feed {feed} value")
                 self.logger.exception(e)
         return return_val
 
+    def _history_windows(self, start: datetime, end: datetime, kinds=WINDOW_KINDS) -> dict:
+        """Reset windows overlapping [start, end) from the history, or nothing if it couldn't be read"""
+        try:
+            return self._history.reset_windows(self.shop, self.reset_hour, start=start, end=end, kinds=kinds)
+        except Exception as e:
+            self.logger.warning(f"An error occurred reading reset windows from {self._history.path}")
+            self.logger.exception(e)
+            return {}
+
+    def _window_opening(self, timestamp: datetime) -> Optional[Sample]:
+        """Stats as of the start of the daily window the timestamp falls in, if the history has them"""
+        windows = self._history_windows(start=timestamp, end=timestamp, kinds=("daily",)).get("daily")
+        return windows[0].opening if windows else None
+
+    def _set_starting_stats(self, opening: Optional[Sample], fallback_to_current: bool) -> None:
+        """Sets the starting stats to the window's opening ones. Those the history doesn't have fall back to the
+        current stats or are left alone"""
+        for name in STAT_FIELDS:
+            value = getattr(opening, name) if opening else None
+            if value is None:
+                value = getattr(self, name) if fallback_to_current else getattr(self, f"starting_{name}")
+            setattr(self, f"starting_{name}", value)
+
+    @staticmethod
+    def _window_summary(window: Rollup) -> str:
+        return f"**{window.favorite_delta:+}** favorites, **{window.rating_count_delta:+}** ratings and " \
+               f"**{window.sold_delta:+}** sold"
+
     def _reset_counts(self) -> None:
-        """Reset counts and update AIO"""
-        # We need to get a new reset date and set the values for the starting values
-        new_reset_datetime = datetime.combine(date.today(), time(hour=self.reset_hour, minute=0,
-                                                                 second=0, microsecond=0))
-        if new_reset_datetime < datetime.now():
-            # Just incase you start this app after the current day's reset timer hit
-            new_reset_datetime = self.reset_datetime + timedelta(days=1)
+        """Reset counts and update AIO
+
+        The day's figures come from the history rather than the counters, and the next day starts from the stats as of
+        the reset. Resetting late, e.g. after a restart, gives the same figures as resetting on time.
+        """
+        now = datetime.now()
+        new_reset_datetime = window_end("daily", window_start("daily", self.reset_hour, now))
+        closing_kinds = [kind for kind in WINDOW_KINDS
+                         if window_start(kind, self.reset_hour, self.reset_datetime) == self.reset_datetime]
+        closed = {kind: windows[-1] for kind, windows in self._history_windows(
+            start=self.reset_datetime - timedelta(microseconds=1), end=self.reset_datetime, kinds=closing_kinds
+        ).items() if windows}
+
+        day = closed.get("daily")
+        if day and None not in (day.favorite_delta, day.rating_delta, day.rating_count_delta, day.sold_delta):
+            favorite_delta, rating_delta = day.favorite_delta, day.rating_delta
+            rating_count_delta, sold_delta = day.rating_count_delta, day.sold_delta
+        else:
+            # Nothing was recorded for the day, so the counters are all there is
+            favorite_delta = self.favorite_count - self.starting_favorite_count
+            rating_delta = self.rating - self.starting_rating
+            rating_count_delta = self.rating_count - self.starting_rating_count
+            sold_delta = self.sold_count - self.starting_sold_count
         message = textwrap.dedent(f"""
         {type(self).__name__} for **{self.shop}**
         
         -# Reset time of **{self.reset_datetime:%Y-%m-%d %H:%M:%S%z}** has passed
         -# Daily Order Count was **{self.daily_order_count}**
-        -# Daily Favorites was **{self.favorite_count - self.starting_favorite_count}**
-        -# Daily Rating was **{(self.rating - self.starting_rating):4f}**
-        -# Daily Rating Count was **{self.rating_count - self.starting_rating_count}**
-        -# Daily Sold was **{self.sold_count - self.starting_sold_count}**
+        -# Daily Favorites was **{favorite_delta}**
+        -# Daily Rating was **{rating_delta:4f}**
+        -# Daily Rating Count was **{rating_count_delta}**
+        -# Daily Sold was **{sold_delta}**
         -# Next reset is **{new_reset_datetime:%Y-%m-%d %H:%M:%S%z}**
-        -# Public IP is `{get_public_ip()}`
+        -# Public IP is `{get_public_ip(timeout=self.timeouts.ipify)}`
         """).strip()
+        for kind in ("weekly", "monthly"):
+            window = closed.get(kind)
+            if window and None not in (window.favorite_delta, window.rating_count_delta, window.sold_delta):
+                message += f"\n-# {kind.capitalize()} was {self._window_summary(window)}"
+        top_listings = self._top_listings(since=self.reset_datetime - timedelta(days=1))
+        if top_listings:
+            message += f"\n-# Top listings {top_listings}"
         if bool(environ.get("DEV_LOVE_NOTE", "0")):
             message += "\n-# *Shawn ❤️ Nicole*"
-        self.logger.info(message.strip())
+        self._notify(message)
 
 
-        # Update all things to be equal to current stats
+        # The new day starts with the stats as of the reset, or the current stats if the history doesn't have them
         self.reset_datetime = new_reset_datetime
 
         self.daily_order_count = 0
-        self.starting_favorite_count = self.favorite_count
-        self.starting_rating = self.rating
-        self.starting_rating_count = self.rating_count
-        self.starting_sold_count = self.sold_count
+        self._set_starting_stats(self._window_opening(now), fallback_to_current=True)
+        # Saved locally in one go before anything is sent, so a crash can't leave half of the counters reset
+        self._save_state()
+
         updates = [
             ("daily-order-count", self.daily_order_count),
             ("favorite-count", self.favorite_count),
@@ -342,8 +772,12 @@ class AIOEtsyStats:
 
         self._send_starting_stats()  # Send it when it is updated on the class instance
 
+        if self.history_retention_days:
+            pruned = self._history.prune(self.shop, older_than=timedelta(days=self.history_retention_days))
+            self.logger.debug(f"Pruned {pruned} history sample(s) older than {self.history_retention_days} days")
+
     def _send_starting_stats(self) -> None:
-        """Sends reset info as dict/json. This is loaded if the script restarts so things aren't 0 if between resets"""
+        """Mirrors reset info to AIO as a dict. Loaded on restart when there is no local state, e.g. a new host"""
         self._send_aio(feed="starting-stats", value={
             "starting-favorite-count": self.starting_favorite_count,
             "starting-rating": self.starting_rating,
@@ -354,92 +788,71 @@ class AIOEtsyStats:
 
     def scrape_etsy_stats(self) -> EtsyStoreStats:
         """Used to scrape the Etsy store page. Will need to be modified if they change the way the site layout is"""
-        favorite_count = None
-        rating = None
-        rating_count = None
-        sold_count = None
-        avatar_url = None
-        errors = 0
-
-        soup = None
-        title, page_source = self._get_selenium(url=self.scrape_url)
-
-        if page_source:
-            try:
-                soup = BeautifulSoup(page_source, "html.parser")
-            except Exception as e:
-                self.logger.warning("Unable to have BeautifulSoup parse page source")
-                self.logger.exception(e)
-                errors += 1
-        else:
+        title, page_source = self._fetch_page(url=self.scrape_url)
+        return self.parse_etsy_stats(page_source)
+
+    def parse_etsy_stats(self, page_source: Optional[str]) -> EtsyStoreStats:
+        """Extracts the stats from a fetched sold page"""
+        self.last_page_unchanged = False
+        self._page_fingerprint = None
+        self._page_listing_ids = ()
+        if not page_source:
             self.logger.warning("Nothing was returned for page source")
-            errors = 1
+            return EtsyStoreStats(errors=1)
 
-        if soup:
-            # region Favorite Count
-            try:
-                scripts = soup.find_all(name="script")
-                for script in scripts:
-                    match = re.search(r".*\"num_favorers\":(\d+),.*", script.get_text().strip())
-                    if match:
-                        favorite_count = int(match[1])
-            except Exception as e:
-                self.logger.warning("Error occurred parsing for Favorite Count")
-                self.logger.exception(e)
-                self.logger.warning(f"Page Source:\n{page_source}")
-                errors += 1
-            # endregion
+        # The fingerprint, stats and sold listings come from one pass over the page
+        with PARSE_SECONDS.time(engine=self.parser_engine):
+            if self._parser_pool:
+                parsed = self._parser_pool.parse_page(page_source, engine=self.parser_engine,
+                                                      known_fingerprint=self._processed_fingerprint, logger=self.logger)
+            else:
+                parsed = parse_page(page_source, engine=self.parser_engine,
+                                    known_fingerprint=self._processed_fingerprint, logger=self.logger)
+        if parsed.stats is None:
+            self.fingerprint_counts["hit"] += 1
+            PAGE_FINGERPRINTS.inc(shop=self.shop, result="hit")
+            self.last_page_unchanged = True
+            return self._processed_stats
+        self.fingerprint_counts["miss"] += 1
+        PAGE_FINGERPRINTS.inc(shop=self.shop, result="miss")
+        self._page_fingerprint = parsed.fingerprint
+        self._page_listing_ids = parsed.listing_ids
+
+        stats = parsed.stats
+        for field in STAT_FIELDS:
+            if getattr(stats, field) is None:
+                EXTRACTION_ERRORS.inc(shop=self.shop, field=field)
+        return stats
+
+    def _record_history(self, stats: EtsyStoreStats) -> None:
+        """Adds the scrape to the history"""
+        if all(getattr(stats, field) is None for field in ("favorite_count", "rating", "rating_count", "sold_count")):
+            return
 
-            # region Rating
-            found_rating = None
-            try:
-                found_rating = soup.find(name="input", attrs={"name": "rating"})
-                if found_rating:
-                    rating = float(found_rating.get("value"))
-            except Exception as e:
-                self.logger.warning("Error occurred parsing for Rating")
-                self.logger.exception(e)
-                errors += 1
-            # endregion
-
-            # region Rating Count
-            if found_rating:
-                try:
-                    found_ratings = found_rating.parent.parent.find(string=re.compile(r"\(\d+\)"))
-                    if found_ratings:
-                        rating_count = int(found_ratings.strip().replace("(", "").replace(")", ""))
-                except Exception as e:
-                    self.logger.warning("Error occurred parsing for Rating Count")
-                    self.logger.exception(e)
-                    errors += 1
-            # endregion
-
-            # region Sold Count
-            try:
-                found_sales = soup.find(string=re.compile("([0-9,]) Sales"))
-                if found_sales:
-                    sold_count = int(found_sales.get_text().strip().replace(" Sales", "").replace(",", ""))
-            except Exception as e:
-                self.logger.warning("Error occurred parsing for Sold Count")
-                self.logger.exception(e)
-                errors += 1
-            # endregion
+        try:
+            self._history.record(self.shop, stats, timestamp=datetime.now())
+        except Exception as e:
+            self.logger.warning(f"An error occurred recording history to {self._history.path}")
+            self.logger.exception(e)
 
-            # region Avatar URL
-            try:
-                found_avatar_div = soup.find(name="div", attrs={"class": "condensed-header-shop-image"})
-                if found_avatar_div:
-                    found_avatar_img = found_avatar_div.findChild("img")
-                    if "src" in found_avatar_img.attrs:
-                        avatar_url = found_avatar_img.attrs["src"]
-                    else:
-                        self.logger.debug("Unable to get Avatar URL")
-            except Exception as e:
-                errors += 1
-            # endregion
+    def _record_sold_listings(self) -> List[str]:
+        """Adds the sold page entries to the index and returns the listing ids of new ones"""
+        try:
+            return self._sold_index.record(self.shop, self._page_listing_ids)
+        except Exception as e:
+            self.logger.warning(f"An error occurred recording sold listings to {self._sold_index.path}")
+            self.logger.exception(e)
+            return []
 
-        return EtsyStoreStats(favorite_count=favorite_count, rating=rating, rating_count=rating_count,
-                              sold_count=sold_count, avatar_url=avatar_url, errors=errors)
+    def _top_listings(self, since: datetime, limit: int = 3) -> str:
+        """The most sold listings since the given time, e.g. 1587342210 x3, 1622871045 x1"""
+        try:
+            velocity = self._sold_index.velocity(self.shop, since=since)
+        except Exception as e:
+            self.logger.warning(f"An error occurred reading sold listings from {self._sold_index.path}")
+            self.logger.exception(e)
+            return ""
+        return ", ".join(f"{listing_id} x{sales}" for listing_id, sales in list(velocity.items())[:limit])
 
     def _log_current_stats(self):
         """Log current stats to debug"""
@@ -453,16 +866,42 @@ class AIOEtsyStats:
             ("reset-hour", self.reset_hour), ("reset-datetime", self.reset_datetime)
         ])))
 
-    def collect_and_publish(self) -> None:
-        """Handles the main portion of this class and runs the helper functions in the main order"""
+    def begin_update(self) -> None:
+        """Runs before every scrape"""
+        if self.lease and not self.lease.held():
+            raise LeaseLost(f"{self.lease} is no longer held")
         self.update_total += 1
         self.logger.debug(f"Checking {self.shop} for updates. Count: {self.update_total}")
+        self.last_scrape_changed = False
+        if not self._aio_seeded:
+            self._load_aio_counters()
 
         # Every time you run, check the reset hour to see if it changed
         self._validate_reset_hour()
 
-        # Get Etsy stats
-        stats = self.scrape_etsy_stats()
+    def collect_and_publish(self) -> None:
+        """Handles the main portion of this class and runs the helper functions in the main order"""
+        self.begin_update()
+        self.process_stats(self.scrape_etsy_stats())
+
+    def process_stats(self, stats: EtsyStoreStats) -> None:
+        """Compares scraped stats with the current ones, resets the daily counts if due and publishes what changed"""
+        self.last_scrape_errors = stats.errors
+        SCRAPES.inc(shop=self.shop, result="failure" if stats.errors else "success")
+        # Unchanged pages are still a sample, so the history has no gaps while nothing sells
+        self._record_history(stats)
+        if self.last_page_unchanged:
+            self.logger.debug(f"Stats for {self.shop} are unchanged since the last scrape")
+            # The reset is the only thing that can happen without the page changing
+            if datetime.now() > self.reset_datetime:
+                self._reset_counts()
+            return
+        self._prime_from_stats(stats)
+        if self._discord_handler and stats.avatar_url and self._discord_handler.avatar_url != stats.avatar_url:
+            self._discord_handler.avatar_url = stats.avatar_url
+        if None in (self.favorite_count, self.rating, self.rating_count, self.sold_count):
+            self.logger.warning(f"Stats for {self.shop} haven't been loaded yet. Waiting for a successful scrape")
+            return
         if (self.update_total % 30) == 0:
             self._log_current_stats()
 
@@ -473,12 +912,13 @@ class AIOEtsyStats:
         # region Process Stats
         # Favorites
         if all([isinstance(stats.favorite_count, int), self.favorite_count != stats.favorite_count]):
-            self.logger.info(textwrap.dedent(f"""
+            self._notify(textwrap.dedent(f"""
             Favorites for **{self.shop}**
 
             -# Count changed **{self.favorite_count:,}** -> **{stats.favorite_count:,}**
-            """).strip())
+            """))
             self.favorite_count = stats.favorite_count
+            self.last_scrape_changed = True
             self._send_aio(feed="favorite-count", value=self.favorite_count)
 
         # Rating
@@ -504,12 +944,13 @@ class AIOEtsyStats:
 
             # If it goes up, normal
             if rating_change >= 0:
-                self.logger.info(message.strip())
+                self._notify(message)
             else:
                 # If it goes down, warning
-                self.logger.warning(message.strip())
+                self._notify(message, level=logging.WARNING)
 
         # Sold
+        new_listings = self._record_sold_listings()
         if all([isinstance(stats.sold_count, int), self.sold_count != stats.sold_count]):
             # Create message
             message = textwrap.dedent(f"""
@@ -518,46 +959,80 @@ class AIOEtsyStats:
             -# Sold Count changed **{self.sold_count:,}** -> **{stats.sold_count:,}**
             """).strip()
             if self.sold_count < stats.sold_count:
+                # Each new entry on the sold page is a sale, but more can sell than the page shows or the entries
+                # might not be readable, so the change in the count is the least it can be
+                new_orders = max(len(new_listings), stats.sold_count - self.sold_count)
                 message += f"\n-# Daily Order Count changed from **{self.daily_order_count:,}** -> " \
-                           f"**{(self.daily_order_count + 1):,}**"
-                self.daily_order_count += 1
+                           f"**{(self.daily_order_count + new_orders):,}**"
+                if new_listings:
+                    message += f"\n-# Listings sold {', '.join(new_listings)}"
+                self.daily_order_count += new_orders
                 self._send_aio(feed="daily-order-count", value=self.daily_order_count)
             else:
                 message += f"\n-# Daily Order Count is **{self.daily_order_count:,}**"
-            self.logger.info(message.strip())
+            self._notify(message)
 
             self.sold_count = stats.sold_count
+            self.last_scrape_changed = True
             self._send_aio(feed="sold-count", value=self.sold_count)
         # endregion
 
-    def _add_scheduled_job(self):
-        """Used to add the job. Can be called again if you have to remove it from the schedule"""
-        minutes = self.scrape_interval_minutes
-        if minutes > 9:
-            schedule.every(minutes).to(minutes + 5).minutes.do(self.collect_and_publish)
-        else:
-            schedule.every(minutes).to(minutes + 1).minutes.do(self.collect_and_publish)
+        self._save_state()
+
+        # Later scrapes of the same page can skip all of this
+        if self._page_fingerprint and stats.is_complete():
+            self._processed_fingerprint = self._page_fingerprint
+            self._processed_stats = stats
+
+    def _next_scrape_minutes(self) -> float:
+        """Minutes until the next scrape based on what the last one found"""
+        previous = self._scrape_interval.current_minutes
+        minutes = self._scrape_interval.next_minutes(changed=self.last_scrape_changed, errors=self.last_scrape_errors)
+        if minutes != previous:
+            self.logger.debug(f"Scrape interval for {self.shop} changed from {previous:g} to {minutes:g} minute(s)")
+        return minutes
+
+    def _add_scheduled_job(self, job: Callable = None, minutes: float = None):
+        """Schedules a single run of the job. Jobs return schedule.CancelJob and are added again with a new interval"""
+        import schedule
+
+        job = job or self._run_scheduled_job
+        low, high = jitter_range(minutes or self.scrape_interval_minutes)
+        schedule.every(low).to(high).seconds.do(job)
+
+    def _run_scheduled_job(self):
+        """Scrapes and schedules the next scrape"""
+        import schedule
+
+        try:
+            self.collect_and_publish()
+        except Exception as e:
+            self.last_scrape_errors += 1
+            self.logger.warning(f"An error occurred collecting stats for {self.shop}")
+            self.logger.exception(e)
+        finally:
+            self._add_scheduled_job(minutes=self._next_scrape_minutes())
+        return schedule.CancelJob
 
     def main(self):
         """Run this to have this run on a schedule"""
+        import schedule
+
         # Repeat to update the Etsy counts
         self.logger.debug(f"Scrapes will be performed about every {self.scrape_interval_minutes} minute(s)")
 
-        self._add_scheduled_job()
+        # The first scrape used to happen while constructing, now it happens as soon as the loop starts
+        self._run_scheduled_job()
+
         while True:
             schedule.run_pending()
-            # Sleep randomly to avoid scheduled scrapes that get banned
-            sleep((uniform(0.45, 0.99) * (self.scrape_interval_minutes * 15)))
+            # Sleep until the next scrape is due
+            idle_seconds = schedule.idle_seconds()
+            sleep(max(0.0, idle_seconds) if idle_seconds is not None else self.scrape_interval_minutes * 60)
 
 
 if __name__ == "__main__":
-    client = AIOEtsyStats(shop=environ.get("ETSY_STORE_NAME"),
-                          default_reset_hour=int(environ.get("DEFAULT_RESET_HOUR", 14)),
-                          scrape_interval_minutes=int(environ.get("SCRAPE_INTERVAL_MINUTES", 5)),
-                          aio_username=environ.get("AIO_USERNAME"),
-                          aio_password=environ.get("AIO_PASSWORD"),
-                          discord_webhook=environ.get("DISCORD_WEBHOOK"),
-                          discord_avatar_url=environ.get("DISCORD_AVATAR_URL"),
-                          selenium_host=environ.get("SELENIUM_HOST"),
-                          selenium_port=environ.get("SELENIUM_PORT"))
-    client.main()
+    # Kept so "python aio_etsy_stats/main.py" still starts the daemon
+    from aio_etsy_stats.cli import main as cli_main
+
+    sys.exit(cli_main(["run", *sys.argv[1:]]))
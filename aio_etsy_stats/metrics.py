@@ -0,0 +1,244 @@
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from time import perf_counter
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return f"{{{','.join(pairs)}}}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    """Base for a metric with a fixed set of label names"""
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {', '.join(self.labelnames) or 'none'}, "
+                             f"not {', '.join(labels) or 'none'}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """The metric's sample lines in the text exposition format"""
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}", *self._samples()]
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observes how long the block took in seconds, even if it raised"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            return sum(self._counts.get(self._key(labels), []))
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, list(counts), self._sums[key]) for key, counts in self._counts.items())
+        lines = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, extra=f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds every metric and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric_type: type, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  **kwargs) -> Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_type(name, documentation, labelnames, **kwargs)
+            elif type(metric) is not metric_type or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"{name} is already registered as a {metric.type_name} with different labels")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# region Scrape pipeline
+WEBDRIVER_ACQUIRE_SECONDS = REGISTRY.histogram(
+    "aio_etsy_stats_webdriver_acquire_seconds", "Time waiting for a pooled WebDriver session, including starting one")
+PAGE_LOAD_SECONDS = REGISTRY.histogram(
+    "aio_etsy_stats_page_load_seconds", "Time loading the sold page", ("source",))
+PAGE_TRANSFER_BYTES = REGISTRY.histogram(
+    "aio_etsy_stats_page_transfer_bytes", "Bytes the browser transferred loading the sold page", ("source",),
+    buckets=(25e3, 50e3, 100e3, 250e3, 500e3, 1e6, 2.5e6, 5e6, 10e6))
+PARSE_SECONDS = REGISTRY.histogram(
+    "aio_etsy_stats_parse_seconds", "Time extracting stats from the page", ("engine",))
+EXTRACTION_ERRORS = REGISTRY.counter(
+    "aio_etsy_stats_extraction_errors_total", "Scrapes where a stat couldn't be extracted", ("shop", "field"))
+SCRAPES = REGISTRY.counter(
+    "aio_etsy_stats_scrapes_total", "Scrapes by result", ("shop", "result"))
+PAGE_FINGERPRINTS = REGISTRY.counter(
+    "aio_etsy_stats_page_fingerprints_total", "Pages that matched (hit) or didn't match (miss) the last one",
+    ("shop", "result"))
+SHOP_STAT = REGISTRY.gauge(
+    "aio_etsy_stats_shop_stat", "Current value of each shop stat", ("shop", "stat"))
+# endregion
+
+# region AIO
+AIO_REQUEST_SECONDS = REGISTRY.histogram(
+    "aio_etsy_stats_aio_request_seconds", "Time spent on each AIO request", ("operation",))
+# endregion
+
+# region Dependencies
+CIRCUIT_STATE = REGISTRY.gauge(
+    "aio_etsy_stats_circuit_state", "Circuit breaker state of each dependency. 0 closed, 1 half open, 2 open",
+    ("dependency",))
+CIRCUIT_CALLS = REGISTRY.counter(
+    "aio_etsy_stats_circuit_calls_total", "Calls to each dependency by result. Rejected calls were refused by an open "
+    "breaker", ("dependency", "result"))
+# endregion
+
+
+def _handler_class(registry: MetricsRegistry) -> type:
+    # http.server pulls in ssl and email, so it is only imported when metrics are served
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes of the endpoint would drown out everything else
+
+    return MetricsHandler
+
+
+_servers: Dict[int, "ThreadingHTTPServer"] = {}
+_servers_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0",
+                         registry: MetricsRegistry = REGISTRY) -> Optional["ThreadingHTTPServer"]:
+    """Serves the registry on /metrics from a daemon thread. Calling it again for the same port reuses the server"""
+    if not port:
+        return None
+    from http.server import ThreadingHTTPServer
+
+    with _servers_lock:
+        server = _servers.get(port)
+        if server is None:
+            server = _servers[port] = ThreadingHTTPServer((host, port), _handler_class(registry))
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        return server
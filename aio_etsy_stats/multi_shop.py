@@ -0,0 +1,367 @@
+import asyncio
+import atexit
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import schedule
+
+from aio_etsy_stats.leases import LeaseCoordinator, LeaseLost, ShopLease
+from aio_etsy_stats.main import AIOEtsyStats, stdout_logger
+from aio_etsy_stats.parse_pool import ParserPool
+from aio_etsy_stats.provisioning import default_state_dir
+from aio_etsy_stats.publisher import AIOPublisher, TimeoutClient
+from aio_etsy_stats.resilience import DependencyTimeouts, circuit_breaker
+from aio_etsy_stats.webdriver_pool import BrowserProfile, WebDriverPool
+
+
+class ShopThroughput:
+    """Running totals for the scrapes of a single shop"""
+
+    def __init__(self):
+        self.scrapes = 0
+        self.failures = 0
+        self.skipped = 0  # Scrapes that were due while the previous one for the shop was still running
+        self.busy_seconds = 0.0
+        self.last_seconds = None
+
+    def record(self, seconds: float, failed: bool) -> None:
+        self.scrapes += 1
+        self.busy_seconds += seconds
+        self.last_seconds = seconds
+        if failed:
+            self.failures += 1
+
+    def as_dict(self, elapsed_minutes: float) -> dict:
+        return {
+            "scrapes": self.scrapes,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "avg-seconds": round(self.busy_seconds / self.scrapes, 3) if self.scrapes else None,
+            "last-seconds": round(self.last_seconds, 3) if self.last_seconds is not None else None,
+            "scrapes-per-minute": round(self.scrapes / elapsed_minutes, 4) if elapsed_minutes else 0.0,
+        }
+
+
+class MultiShopRunner:
+    """Scrapes several shops from one process using a bounded pool of browser workers
+
+    Every shop gets its own AIOEtsyStats so the reset hour, counters and AIO feed group stay separate. The scheduled
+    jobs only submit work, so at most ``max_workers`` scrapes (and browser sessions) are active at once. Each shop's
+    next scrape is scheduled from the main thread once the last one finishes, using that shop's adaptive interval.
+
+    With ``lease_seconds`` set the shops are split between every runner sharing the state directory. This runner only
+    updates the shops it holds a lease for, and picks up or hands over shops as other runners start and stop.
+    """
+
+    def __init__(self, shops: List[str], max_workers: int = 2, selenium_host: str = None,
+                 selenium_port: int = None, webdriver_max_navigations: int = 50,
+                 webdriver_max_memory_mb: int = None, browser_profile: BrowserProfile = None,
+                 throughput_log_minutes: int = 60, runtime: str = "schedule", lease_seconds: float = None,
+                 node_id: str = None, **client_kwargs):
+        self.logger = stdout_logger(name=type(self).__name__)
+
+        self.shops = list(dict.fromkeys(shops))  # Drop duplicates but keep the order
+        self.max_workers = max(1, int(max_workers))
+        self.throughput_log_minutes = throughput_log_minutes
+        # schedule submits whole updates to worker threads, asyncio runs them as pipeline stages
+        if runtime not in ("schedule", "asyncio"):
+            raise ValueError(f"runtime must be schedule or asyncio, not {runtime}")
+        self.runtime = runtime
+        self.scrape_interval_minutes = client_kwargs.get("scrape_interval_minutes", 10)
+
+        # Shops share the breakers. Made here first so they are set up with this runner's settings and logger
+        timeouts = client_kwargs.get("timeouts") or DependencyTimeouts()
+        for name in ("etsy", "selenium", "aio", "ipify"):
+            circuit_breaker(name, failure_threshold=client_kwargs.get("breaker_failures", 5),
+                            reset_seconds=client_kwargs.get("breaker_reset_seconds", 60), logger=self.logger)
+
+        # One browser session per worker shared by every shop
+        self._webdriver_pool = WebDriverPool(selenium_host=selenium_host, selenium_port=selenium_port,
+                                             size=self.max_workers, max_navigations=webdriver_max_navigations,
+                                             max_memory_mb=webdriver_max_memory_mb,
+                                             browser_profile=browser_profile, timeout=timeouts.selenium,
+                                             logger=self.logger)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scrape")
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._finished = queue.Queue()  # Shops whose scrape finished and need their next one scheduled
+        self._throughput: Dict[str, ShopThroughput] = {shop: ShopThroughput() for shop in self.shops}
+        self._started = datetime.now()
+
+        # Every shop publishes through one queue so they share the AIO account's rate limit
+        self._aio_publisher = None
+        aio_client = client_kwargs.get("aio_client")
+        if aio_client is None and client_kwargs.get("aio_username") and client_kwargs.get("aio_password"):
+            aio_client = TimeoutClient(client_kwargs["aio_username"], client_kwargs["aio_password"],
+                                       timeout=timeouts.aio)
+        if aio_client is not None:
+            self._aio_publisher = AIOPublisher(
+                client=aio_client,
+                rate_per_minute=client_kwargs.get("aio_rate_per_minute", 30), breaker=circuit_breaker("aio"),
+                logger=self.logger)
+
+        # Parser worker processes are shared by every shop too
+        self.parser_workers = client_kwargs.pop("parser_workers", 0)
+        self._parser_pool = ParserPool(workers=self.parser_workers, logger=self.logger) if self.parser_workers else None
+
+        self._client_kwargs = dict(client_kwargs, selenium_host=selenium_host, selenium_port=selenium_port)
+
+        # region Sharding
+        # Leases live next to the shop state, so runners sharing STATE_DIR share the shops
+        self.lease_seconds = lease_seconds
+        self._coordinator = None
+        self._starting = set()  # Shops whose client is being built after they were taken over
+        leases: Dict[str, ShopLease] = {}
+        if lease_seconds:
+            self._coordinator = LeaseCoordinator(
+                path=os.path.join(client_kwargs.get("state_dir") or default_state_dir(), "state.db"),
+                node_id=node_id, lease_seconds=lease_seconds, logger=self.logger)
+            leases = self._coordinator.rebalance(self.shops)
+            self.logger.debug(f"Node {self._coordinator.node_id} holds {len(leases)} of {len(self.shops)} shop(s)")
+        owned = [shop for shop in self.shops if not self._coordinator or shop.lower() in leases]
+        # endregion
+
+        # Constructing a client loads its state from AIO, so do those on the workers too
+        self.logger.debug(f"Loading {len(owned)} shop(s) with {self.max_workers} worker(s)")
+        self.clients: Dict[str, AIOEtsyStats] = dict(zip(owned, self._executor.map(
+            lambda shop: self._build_client(shop, leases.get(shop.lower())), owned)))
+
+        atexit.register(self._atexit)
+
+    def _build_client(self, shop: str, lease: Optional[ShopLease] = None) -> AIOEtsyStats:
+        return AIOEtsyStats(shop=shop, webdriver_pool=self._webdriver_pool, aio_publisher=self._aio_publisher,
+                            parser_pool=self._parser_pool, lease=lease, **self._client_kwargs)
+
+    def _atexit(self):
+        if self._coordinator:
+            self._coordinator.release_all()
+            self._coordinator.close()
+        self._executor.shutdown(wait=False)
+        self._webdriver_pool.close()
+        if self._parser_pool:
+            self._parser_pool.close()
+        if self._aio_publisher:
+            self._aio_publisher.close()
+
+    def _run_shop(self, shop: str, client: AIOEtsyStats) -> None:
+        start = datetime.now()
+        failed = False
+        try:
+            client.collect_and_publish()
+        except LeaseLost:
+            failed = True
+            client.logger.info(f"Stopped updating {shop}, another node has taken it over")
+        except Exception as e:
+            failed = True
+            client.last_scrape_errors += 1
+            client.logger.warning(f"An error occurred collecting stats for {shop}")
+            client.logger.exception(e)
+        finally:
+            self._record(shop=shop, seconds=(datetime.now() - start).total_seconds(), failed=failed)
+            with self._lock:
+                self._in_flight.discard(shop)
+                dropped = self.clients.get(shop) is not client
+            if dropped:
+                self._close_client(client)  # It was handed over while this scrape was running
+            else:
+                self._finished.put(shop)
+
+    def _record(self, shop: str, seconds: float, failed: bool) -> None:
+        with self._lock:
+            self._throughput[shop].record(seconds=seconds, failed=failed)
+
+    def submit(self, shop: str) -> None:
+        """Queue a scrape for the shop unless one is already queued or running, or the shop is on another node"""
+        with self._lock:
+            client = self.clients.get(shop)
+            if client is None:
+                return
+            if shop in self._in_flight:
+                self._throughput[shop].skipped += 1
+                return
+            self._in_flight.add(shop)
+        self._executor.submit(self._run_shop, shop, client)
+
+    def _submit_scheduled(self, shop: str):
+        """Scheduled job for a shop. It runs once, the next one is added when the scrape finishes"""
+        self.submit(shop)
+        return schedule.CancelJob
+
+    # region Sharding
+    def _close_client(self, client: AIOEtsyStats) -> None:
+        atexit.unregister(client._atexit)
+        try:
+            client._atexit()
+        except Exception as e:
+            self.logger.warning(f"An error occurred closing the client for {client.shop}")
+            self.logger.exception(e)
+
+    def _start_shop(self, shop: str, lease: ShopLease) -> Optional[AIOEtsyStats]:
+        """Builds the client for a shop this node took over. Its state is loaded from what the last node saved"""
+        try:
+            client = self._build_client(shop, lease)
+        except Exception as e:
+            self.logger.warning(f"An error occurred taking over {shop}")
+            self.logger.exception(e)
+            return None
+        finally:
+            with self._lock:
+                self._starting.discard(shop)
+        self.logger.info(f"Took over {shop} from another node")
+        return client
+
+    def _rebalance_leases(self) -> Optional[Dict[str, ShopLease]]:
+        """Renews this node's leases. Returns the shops it should be running, or None if the leases couldn't be read"""
+        try:
+            leases = self._coordinator.rebalance(self.shops)
+        except Exception as e:
+            self.logger.warning("An error occurred renewing shop leases")
+            self.logger.exception(e)
+            return None
+        return {shop: leases[shop.lower()] for shop in self.shops if shop.lower() in leases}
+
+    def _handed_over(self, leases: Dict[str, ShopLease]) -> List[str]:
+        """Shops with a client that this node no longer holds the lease it was built with"""
+        with self._lock:
+            return [shop for shop, client in self.clients.items()
+                    if shop not in leases or leases[shop].token != client.lease.token]
+
+    def _taken_over(self, leases: Dict[str, ShopLease]) -> List[str]:
+        """Shops this node now holds a lease for that don't have a client yet. Marks them as starting"""
+        with self._lock:
+            shops = [shop for shop in leases if shop not in self.clients and shop not in self._starting]
+            self._starting.update(shops)
+        return shops
+
+    def _rebalance(self) -> None:
+        """Drops the shops another node took over and starts the ones this node took over"""
+        leases = self._rebalance_leases()
+        if leases is None:
+            return
+        for shop in self._handed_over(leases):
+            with self._lock:
+                client = self.clients.pop(shop)
+                running = shop in self._in_flight
+            self.logger.info(f"Handed {shop} over to another node")
+            if not running:
+                self._close_client(client)
+        for shop in self._taken_over(leases):
+            self._executor.submit(self._add_shop, shop, leases[shop])
+
+    def _add_shop(self, shop: str, lease: ShopLease) -> None:
+        client = self._start_shop(shop, lease)
+        if client is None:
+            return
+        with self._lock:
+            self.clients[shop] = client
+            self._throughput.setdefault(shop, ShopThroughput())
+        self.submit(shop)
+
+    async def _rebalance_periodically(self, pipeline) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            leases = await loop.run_in_executor(None, self._rebalance_leases)
+            if leases is None:
+                continue
+            for shop in self._handed_over(leases):
+                client = self.clients.pop(shop)
+                self.logger.info(f"Handed {shop} over to another node")
+                asyncio.ensure_future(self._retire(client, pipeline.remove_client(shop)))
+            for shop in self._taken_over(leases):
+                client = await loop.run_in_executor(self._executor, self._start_shop, shop, leases[shop])
+                if client is not None:
+                    self.clients[shop] = client
+                    self._throughput.setdefault(shop, ShopThroughput())
+                    pipeline.add_client(shop, client)
+
+    async def _retire(self, client: AIOEtsyStats, cycle) -> None:
+        """Closes a client once its last update is through the pipeline"""
+        if cycle is not None:
+            await cycle.done.wait()
+        await asyncio.get_running_loop().run_in_executor(None, self._close_client, client)
+    # endregion
+
+    def throughput(self) -> dict:
+        """Per shop and total scrape throughput. Useful for sizing max_workers"""
+        elapsed_seconds = (datetime.now() - self._started).total_seconds()
+        elapsed_minutes = elapsed_seconds / 60
+        with self._lock:
+            shops = {shop: stats.as_dict(elapsed_minutes) for shop, stats in self._throughput.items()}
+            scrapes = sum(stats.scrapes for stats in self._throughput.values())
+            failures = sum(stats.failures for stats in self._throughput.values())
+            skipped = sum(stats.skipped for stats in self._throughput.values())
+            busy_seconds = sum(stats.busy_seconds for stats in self._throughput.values())
+            in_flight = len(self._in_flight)
+
+        return {
+            "shops": shops,
+            "total": {
+                "scrapes": scrapes,
+                "failures": failures,
+                "skipped": skipped,
+                "in-flight": in_flight,
+                "scrapes-per-minute": round(scrapes / elapsed_minutes, 4) if elapsed_minutes else 0.0,
+                # Fraction of the available worker time spent scraping. Close to 1 means add workers
+                "worker-utilization": round(busy_seconds / (elapsed_seconds * self.max_workers), 4)
+                if elapsed_seconds else 0.0,
+            },
+        }
+
+    def _log_throughput(self):
+        self.logger.debug(f"Throughput: {self.throughput()}")
+
+    async def _log_throughput_periodically(self):
+        while True:
+            await asyncio.sleep(self.throughput_log_minutes * 60)
+            self._log_throughput()
+
+    async def _main_async(self):
+        from aio_etsy_stats.pipeline import ScrapePipeline
+
+        # With parser processes there is a parse thread waiting on each of them
+        pipeline = ScrapePipeline(clients=self.clients, fetch_workers=self.max_workers,
+                                  parse_workers=max(1, self.parser_workers), fetch_executor=self._executor,
+                                  queue_size=len(self.shops), on_complete=self._record, logger=self.logger)
+        try:
+            tasks = [pipeline.run()]
+            if self.throughput_log_minutes:
+                tasks.append(self._log_throughput_periodically())
+            if self._coordinator:
+                tasks.append(self._rebalance_periodically(pipeline))
+            await asyncio.gather(*tasks)
+        finally:
+            pipeline.close()
+
+    def main(self):
+        """Run every shop on its own schedule"""
+        self.logger.debug(f"Scrapes will be performed about every {self.scrape_interval_minutes} minute(s) "
+                          f"for {', '.join(self.shops)}")
+        if self.runtime == "asyncio":
+            asyncio.run(self._main_async())
+            return
+
+        for shop in list(self.clients):
+            self.submit(shop)  # First scrape right away to fill in anything AIO didn't have
+        if self.throughput_log_minutes:
+            schedule.every(self.throughput_log_minutes).minutes.do(self._log_throughput)
+        if self._coordinator:
+            schedule.every(self.lease_seconds / 3).seconds.do(self._rebalance)
+
+        while True:
+            schedule.run_pending()
+            # Sleep until the next job is due, waking early to schedule shops whose scrape finished
+            idle_seconds = schedule.idle_seconds()
+            try:
+                shop = self._finished.get(timeout=max(0.0, idle_seconds) if idle_seconds is not None else None)
+            except queue.Empty:
+                continue
+            client = self.clients.get(shop)
+            if client is None:
+                continue  # Handed over to another node
+            client._add_scheduled_job(job=lambda shop=shop: self._submit_scheduled(shop),
+                                      minutes=client._next_scrape_minutes())
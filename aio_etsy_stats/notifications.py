@@ -0,0 +1,216 @@
+import logging
+import threading
+from collections import Counter, deque
+from time import monotonic, sleep
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+import requests
+from discord_logging.handler import DEFAULT_COLOURS, DEFAULT_EMOJIS
+
+# Discord limits for a single webhook message
+MAX_EMBEDS = 10
+MAX_EMBED_CHARACTERS = 6000
+MAX_TITLE_CHARACTERS = 256
+MAX_DESCRIPTION_CHARACTERS = 4096
+
+
+class Notification(NamedTuple):
+    levelno: int
+    message: str
+    record: logging.LogRecord  # Passed to handleError if the message can't be sent
+
+
+class WebhookRateLimit:
+    """When a webhook can next be called, shared by every handler posting to it"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.not_before = 0.0
+
+    def wait_seconds(self) -> float:
+        with self.lock:
+            return max(0.0, self.not_before - monotonic())
+
+    def delay(self, seconds: float) -> None:
+        with self.lock:
+            self.not_before = max(self.not_before, monotonic() + seconds)
+
+
+class QueuedDiscordHandler(logging.Handler):
+    """Logging handler that posts to a Discord webhook from a background thread
+
+    ``emit`` only queues the message. Messages that arrive within ``batch_seconds`` of each other are sent as embeds
+    of a single webhook call. Discord's rate limit headers are followed, and a 429 resends the batch after
+    ``retry_after``. When more than ``max_pending`` messages are waiting the oldest are dropped and summarized in the
+    next message.
+    """
+
+    _rate_limits: Dict[str, WebhookRateLimit] = {}
+    _rate_limits_lock = threading.Lock()
+
+    def __init__(self, service_name: str, webhook_url: str, avatar_url: Optional[str] = None,
+                 batch_seconds: float = 2.0, max_pending: int = 50, max_attempts: int = 3, timeout: float = 5.0,
+                 level: int = logging.NOTSET):
+        super().__init__(level=level)
+        self.service_name = service_name
+        self.webhook_url = webhook_url
+        self.avatar_url = avatar_url
+        self.batch_seconds = batch_seconds
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.counts = Counter()  # queued, sent, requests, rate-limited, dropped, failed
+
+        with self._rate_limits_lock:
+            self._rate_limit = self._rate_limits.setdefault(webhook_url, WebhookRateLimit())
+        self._session = requests.Session()
+        self._condition = threading.Condition()
+        self._pending: Deque[Notification] = deque()
+        self._dropped = 0  # Dropped since the last summary
+        self._sending = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="discord", daemon=True)
+        self._thread.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            notification = Notification(levelno=record.levelno, message=self.format(record), record=record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        with self._condition:
+            if self._closed:
+                return
+            self._pending.append(notification)
+            self.counts["queued"] += 1
+            while len(self._pending) > self.max_pending:
+                self._drop_oldest()
+            self._condition.notify()
+
+    def _drop_oldest(self) -> None:
+        # Prefer dropping routine messages over warnings
+        for index, notification in enumerate(self._pending):
+            if notification.levelno < logging.WARNING:
+                del self._pending[index]
+                break
+        else:
+            self._pending.popleft()
+        self._dropped += 1
+        self.counts["dropped"] += 1
+
+    def _embed(self, notification: Notification) -> dict:
+        emoji = DEFAULT_EMOJIS.get(notification.levelno, "")
+        title, _, description = notification.message.partition("\n")
+        title = f"{emoji} {title}" if emoji else title
+        embed = {"title": title[:MAX_TITLE_CHARACTERS],
+                 "color": DEFAULT_COLOURS.get(notification.levelno) or DEFAULT_COLOURS[None]}
+        if description:
+            embed["description"] = description[:MAX_DESCRIPTION_CHARACTERS]
+        return embed
+
+    def _take_batch(self) -> Tuple[List[dict], List[logging.LogRecord]]:
+        """Takes as many pending messages as fit in one webhook call, along with their records. Call with the
+        condition held"""
+        embeds = []
+        records = []
+        if self._dropped:
+            message = f"{self.service_name} dropped {self._dropped} message(s) while Discord was slow"
+            record = logging.makeLogRecord({"name": self.service_name, "levelno": logging.WARNING,
+                                            "levelname": logging.getLevelName(logging.WARNING), "msg": message})
+            embeds.append(self._embed(Notification(levelno=logging.WARNING, message=message, record=record)))
+            records.append(record)
+            self._dropped = 0
+
+        characters = sum(len(embed["title"]) + len(embed.get("description", "")) for embed in embeds)
+        while self._pending and len(embeds) < MAX_EMBEDS:
+            embed = self._embed(self._pending[0])
+            size = len(embed["title"]) + len(embed.get("description", ""))
+            if embeds and characters + size > MAX_EMBED_CHARACTERS:
+                break
+            records.append(self._pending.popleft().record)
+            embeds.append(embed)
+            characters += size
+        return embeds, records
+
+    def _post(self, embeds: List[dict]) -> Optional[float]:
+        """Sends the embeds. Returns how long to wait before retrying, or None once they are sent. Raises HTTPError if
+        Discord refused them"""
+        payload = {"username": self.service_name, "embeds": embeds}
+        if self.avatar_url:
+            payload["avatar_url"] = self.avatar_url
+        self.counts["requests"] += 1
+        response = self._session.post(self.webhook_url, json=payload, timeout=self.timeout)
+
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            self._rate_limit.delay(float(response.headers.get("X-RateLimit-Reset-After", 1)))
+        if response.status_code == 429:
+            self.counts["rate-limited"] += 1
+            try:
+                retry_after = float(response.json().get("retry_after"))
+            except (TypeError, ValueError):
+                retry_after = float(response.headers.get("Retry-After", 5))
+            self._rate_limit.delay(retry_after)
+            return retry_after
+        if not response.ok:
+            raise requests.HTTPError(f"Discord webhook request failed: {response.status_code}: {response.text}",
+                                     response=response)
+
+        self.counts["sent"] += len(embeds)
+        return None
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._dropped:
+                    if self._closed:
+                        return
+                    self._condition.wait()
+                self._sending = True
+
+            # Give the rest of a burst a moment to arrive so it goes in the same message
+            with self._condition:
+                self._condition.wait_for(lambda: self._closed, timeout=self.batch_seconds)
+            sleep(self._rate_limit.wait_seconds())
+
+            with self._condition:
+                embeds, records = self._take_batch()
+
+            # Logging the errors could loop back into this handler, so they are reported the way logging reports its own
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    retry_after = self._post(embeds)
+                except requests.HTTPError:
+                    # Discord refused the messages, so sending them again won't help
+                    self.counts["failed"] += len(embeds)
+                    self.handleError(records[0])
+                    break
+                except Exception:
+                    self.handleError(records[0])
+                    retry_after = 2.0 ** attempt
+                if retry_after is None:
+                    break
+                if attempt == self.max_attempts:
+                    self.counts["failed"] += len(embeds)
+                    break
+                sleep(retry_after)
+
+            with self._condition:
+                self._sending = False
+                self._condition.notify_all()
+
+    def flush(self, timeout: float = 10) -> bool:
+        """Waits until every queued message was sent. Returns False if the timeout passed first"""
+        with self._condition:
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: not self._pending and not self._dropped and not self._sending,
+                                            timeout=timeout)
+
+    def close(self, timeout: float = 10) -> None:
+        """Sends what is queued and stops the thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout=timeout)
+        self._session.close()
+        super().close()
@@ -0,0 +1,98 @@
+import logging
+import multiprocessing
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from time import monotonic
+from typing import Optional
+
+from aio_etsy_stats.parsing import ParsedPage, parse_page
+
+WARM_UP_PAGE = "<html><body><span>1 Sales</span></body></html>"
+RESTART_DELAY_SECONDS = 60
+
+
+def _warm_up() -> None:
+    """Runs once in each worker so the first real page doesn't pay for imports and compiled patterns"""
+    parse_page(WARM_UP_PAGE, engine="auto", logger=logging.getLogger(__name__))
+
+
+def _ping() -> bool:
+    return True
+
+
+def _parse_page(page_source: str, engine: str, known_fingerprint: Optional[str]) -> ParsedPage:
+    return parse_page(page_source, engine=engine, known_fingerprint=known_fingerprint,
+                      logger=logging.getLogger(__name__))
+
+
+class ParserPool:
+    """Parses pages in worker processes so parsing for many shops isn't limited to one core by the GIL
+
+    Only the page goes to the worker, which fingerprints it and extracts the stats and sold listings in one pass, and
+    only what it found comes back. Workers are started and warmed up when the pool is
+    created. If the pool breaks or a page takes longer than ``timeout`` the page is parsed in-process instead, and a
+    broken pool is started again for the next page.
+    """
+
+    def __init__(self, workers: int = 2, timeout: float = 30, logger: logging.Logger = None):
+        self.workers = max(1, int(workers))
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger(type(self).__name__)
+        self.counts = Counter()  # process, in-process
+
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._next_start = 0.0
+        self._closed = False
+        self._start()
+
+    def _start(self) -> None:
+        # spawn so workers don't inherit the browser pool, publisher and logging threads of this process
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=_warm_up)
+        try:
+            # One task per worker so they are all started and warmed up before the first page
+            for future in [executor.submit(_ping) for _ in range(self.workers)]:
+                future.result(timeout=self.timeout)
+        except Exception as e:
+            self.logger.warning(f"Parser workers didn't start, parsing in-process for now: {e}")
+            executor.shutdown(wait=False)
+            self._next_start = monotonic() + RESTART_DELAY_SECONDS
+            return
+        self._executor = executor
+        self.logger.debug(f"Started {self.workers} parser worker(s)")
+
+    def parse_page(self, page_source: str, engine: str = "auto", known_fingerprint: str = None,
+                   logger: logging.Logger = None) -> ParsedPage:
+        """Same as parsing.parse_page, in a worker when one is available"""
+        with self._lock:
+            if self._executor is None and not self._closed and monotonic() >= self._next_start:
+                self._start()
+            executor = self._executor
+
+        if executor is not None:
+            try:
+                parsed = executor.submit(_parse_page, page_source, engine,
+                                         known_fingerprint).result(timeout=self.timeout)
+                self.counts["process"] += 1
+                return parsed
+            except BrokenProcessPool as e:
+                self.logger.warning(f"Parser workers stopped, restarting them: {e}")
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                executor.shutdown(wait=False)
+            except TimeoutError:
+                self.logger.warning(f"Parsing in a worker took more than {self.timeout} seconds, parsing in-process")
+
+        self.counts["in-process"] += 1
+        return parse_page(page_source, engine=engine, known_fingerprint=known_fingerprint, logger=logger or self.logger)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
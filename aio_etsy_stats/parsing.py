@@ -0,0 +1,278 @@
+import hashlib
+import logging
+import re
+from html import unescape
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+PARSER_ENGINES = ("auto", "fast", "soup")
+
+# region Fast extractor patterns
+# One alternation so the page is scanned a single time, stopping once the stats are found. Rating count and avatar are
+# read from a short window after their anchor instead of walking a tree
+FAVORITES_PATTERN = re.compile(r"(?P<favorites>\"num_favorers\":(?P<favorite_count>\d+),)")
+FAST_PATTERN = re.compile(
+    FAVORITES_PATTERN.pattern +
+    r"|(?P<rating><input\b[^>]*?\bname=[\"']rating[\"'][^>]*>)"
+    r"|(?P<sales>>\s*(?P<sold_count>\d[0-9,]*) Sales\s*<)"
+    r"|(?P<avatar>\bclass=[\"'][^\"']*\bcondensed-header-shop-image\b)"
+)
+FAVORITES_MARKER = "\"num_favorers\":"
+AVATAR_PATTERN = re.compile(r"\bclass=[\"'][^\"']*\bcondensed-header-shop-image\b")
+VALUE_ATTRIBUTE_PATTERN = re.compile(r"\bvalue=[\"']([^\"']*)[\"']")
+RATING_COUNT_PATTERN = re.compile(r">\s*\((\d+)\)\s*<")
+SOLD_LISTING_PATTERN = re.compile(r"\bdata-listing-id=[\"'](\d+)[\"']")
+IMG_SRC_PATTERN = re.compile(r"<img\b[^>]*?\bsrc=[\"']([^\"']+)[\"']")
+RATING_COUNT_WINDOW = 3000
+AVATAR_WINDOW = 1500
+# Not every shop has an avatar, so it's only looked for this far past the other stats instead of to the end of the page
+AVATAR_LOOKAHEAD = 20000
+REQUIRED_ANCHORS = ("favorites", "rating", "sales")
+# endregion
+
+
+class EtsyStoreStats(NamedTuple):
+    """Used to format stats from Etsy store"""
+    favorite_count: Optional[int] = None
+    rating: Optional[float] = None
+    rating_count: Optional[int] = None
+    sold_count: Optional[int] = None
+    avatar_url: Optional[str] = None
+    errors: int = 0
+
+    def is_complete(self) -> bool:
+        """True when every counted stat was found without errors. Not every shop has an avatar"""
+        return self.errors == 0 and None not in (self.favorite_count, self.rating, self.rating_count,
+                                                 self.sold_count)
+
+
+class ParsedPage(NamedTuple):
+    """What one pass over a sold page found. Stats are None when the fingerprint matched the one already processed"""
+    fingerprint: Optional[str] = None
+    stats: Optional[EtsyStoreStats] = None
+    listing_ids: Tuple[str, ...] = ()
+
+
+def find_anchors(page_source: str) -> Dict[str, "re.Match"]:
+    """The match of each stat in the page, found in a single pass that stops once the stats are found
+
+    The first match is used for each stat except favorites. Other shops' favorite counts can come before the shop's
+    own, so like the BeautifulSoup parser the last one in the page is used.
+    """
+    anchors = {}
+    for match in FAST_PATTERN.finditer(page_source):
+        kind = match.lastgroup  # The outer group of each alternative closes last
+        anchors.setdefault(kind, match)
+        if all(required in anchors for required in REQUIRED_ANCHORS):
+            if "avatar" not in anchors:
+                found_avatar = AVATAR_PATTERN.search(page_source, match.end(), match.end() + AVATAR_LOOKAHEAD)
+                if found_avatar:
+                    anchors["avatar"] = found_avatar
+            break
+
+    if "favorites" in anchors:
+        # A plain substring search from the end is far cheaper than scanning the rest of the page with the pattern
+        position = page_source.rfind(FAVORITES_MARKER)
+        while position > anchors["favorites"].start():
+            found_favorites = FAVORITES_PATTERN.match(page_source, position)
+            if found_favorites:
+                anchors["favorites"] = found_favorites
+                break
+            position = page_source.rfind(FAVORITES_MARKER, 0, position)
+    return anchors
+
+
+def extract_stats_fast(page_source: str, logger: logging.Logger = None,
+                       anchors: Dict[str, "re.Match"] = None) -> EtsyStoreStats:
+    """Pulls the stats out of the raw page without building a DOM, reusing the anchors if they were already found"""
+    logger = logger or logging.getLogger(__name__)
+    values = {}
+    errors = 0
+
+    if anchors is None:
+        anchors = find_anchors(page_source)
+    for kind, match in anchors.items():
+        try:
+            if kind == "favorites":
+                values[kind] = int(match["favorite_count"])
+            elif kind == "rating":
+                found_value = VALUE_ATTRIBUTE_PATTERN.search(match[kind])
+                values[kind] = float(unescape(found_value[1])) if found_value else None
+                found_count = RATING_COUNT_PATTERN.search(page_source, match.end(),
+                                                          match.end() + RATING_COUNT_WINDOW)
+                values["rating_count"] = int(found_count[1]) if found_count else None
+            elif kind == "sales":
+                values[kind] = int(match["sold_count"].replace(",", ""))
+            elif kind == "avatar":
+                found_img = IMG_SRC_PATTERN.search(page_source, match.end(), match.end() + AVATAR_WINDOW)
+                values[kind] = unescape(found_img[1]) if found_img else None
+        except Exception as e:
+            logger.debug(f"Fast extractor was unable to parse {kind}: {e}")
+            values[kind] = None
+            errors += 1
+
+    return EtsyStoreStats(favorite_count=values.get("favorites"), rating=values.get("rating"),
+                          rating_count=values.get("rating_count"), sold_count=values.get("sales"),
+                          avatar_url=values.get("avatar"), errors=errors)
+
+
+def extract_sold_listing_ids(page_source: str) -> List[str]:
+    """Listing ids of the sold entries on the /sold page, newest first. A listing sold more than once repeats"""
+    return SOLD_LISTING_PATTERN.findall(page_source)
+
+
+def page_fingerprint(page_source: str, anchors: Dict[str, "re.Match"] = None) -> Optional[str]:
+    """Hashes only the parts of the page the stats come from, so tokens and listings that change between requests don't
+    count as a change
+
+    Returns None when the favorites, rating and sales anchors aren't all found, since the page then has to be parsed.
+    """
+    if anchors is None:
+        anchors = find_anchors(page_source)
+    slices = {}
+    for kind, match in anchors.items():
+        if kind == "rating":
+            found_count = RATING_COUNT_PATTERN.search(page_source, match.end(), match.end() + RATING_COUNT_WINDOW)
+            slices[kind] = match[kind] + (found_count[0] if found_count else "")
+        elif kind == "avatar":
+            found_img = IMG_SRC_PATTERN.search(page_source, match.end(), match.end() + AVATAR_WINDOW)
+            slices[kind] = found_img[0] if found_img else ""
+        else:
+            slices[kind] = match[kind]
+
+    if not all(required in slices for required in REQUIRED_ANCHORS):
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    for kind in ("favorites", "rating", "sales", "avatar"):
+        digest.update(slices.get(kind, "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def extract_stats_soup(page_source: str, logger: logging.Logger = None) -> EtsyStoreStats:
+    """Parses the whole page with BeautifulSoup. Slower, but tolerant of markup the fast extractor doesn't expect"""
+    logger = logger or logging.getLogger(__name__)
+    favorite_count = None
+    rating = None
+    rating_count = None
+    sold_count = None
+    avatar_url = None
+    errors = 0
+
+    soup = None
+    try:
+        from bs4 import BeautifulSoup  # Only loaded for the soup engine or the auto fallback
+
+        soup = BeautifulSoup(page_source, "html.parser")
+    except Exception as e:
+        logger.warning("Unable to have BeautifulSoup parse page source")
+        logger.exception(e)
+        errors += 1
+
+    if soup:
+        # region Favorite Count
+        try:
+            scripts = soup.find_all(name="script")
+            for script in scripts:
+                # The last one in the page is the shop's own, the same as the fast extractor uses
+                found_favorites = FAVORITES_PATTERN.findall(script.get_text())
+                if found_favorites:
+                    favorite_count = int(found_favorites[-1][1])
+        except Exception as e:
+            logger.warning("Error occurred parsing for Favorite Count")
+            logger.exception(e)
+            logger.warning(f"Page Source:\n{page_source}")
+            errors += 1
+        # endregion
+
+        # region Rating
+        found_rating = None
+        try:
+            found_rating = soup.find(name="input", attrs={"name": "rating"})
+            if found_rating:
+                rating = float(found_rating.get("value"))
+        except Exception as e:
+            logger.warning("Error occurred parsing for Rating")
+            logger.exception(e)
+            errors += 1
+        # endregion
+
+        # region Rating Count
+        if found_rating:
+            try:
+                found_ratings = found_rating.parent.parent.find(string=re.compile(r"\(\d+\)"))
+                if found_ratings:
+                    rating_count = int(found_ratings.strip().replace("(", "").replace(")", ""))
+            except Exception as e:
+                logger.warning("Error occurred parsing for Rating Count")
+                logger.exception(e)
+                errors += 1
+        # endregion
+
+        # region Sold Count
+        try:
+            found_sales = soup.find(string=re.compile("([0-9,]) Sales"))
+            if found_sales:
+                sold_count = int(found_sales.get_text().strip().replace(" Sales", "").replace(",", ""))
+        except Exception as e:
+            logger.warning("Error occurred parsing for Sold Count")
+            logger.exception(e)
+            errors += 1
+        # endregion
+
+        # region Avatar URL
+        try:
+            found_avatar_div = soup.find(name="div", attrs={"class": "condensed-header-shop-image"})
+            if found_avatar_div:
+                found_avatar_img = found_avatar_div.findChild("img")
+                if "src" in found_avatar_img.attrs:
+                    avatar_url = found_avatar_img.attrs["src"]
+                else:
+                    logger.debug("Unable to get Avatar URL")
+        except Exception:
+            errors += 1
+        # endregion
+
+    return EtsyStoreStats(favorite_count=favorite_count, rating=rating, rating_count=rating_count,
+                          sold_count=sold_count, avatar_url=avatar_url, errors=errors)
+
+
+def extract_stats(page_source: str, engine: str = "auto", logger: logging.Logger = None,
+                  anchors: Dict[str, "re.Match"] = None) -> EtsyStoreStats:
+    """Extracts the stats with the requested engine
+
+    ``auto`` uses the fast extractor and falls back to BeautifulSoup when it doesn't find every stat. The soup result
+    is only used if it found more than the fast extractor did.
+    """
+    logger = logger or logging.getLogger(__name__)
+    if engine == "soup":
+        return extract_stats_soup(page_source, logger=logger)
+
+    stats = extract_stats_fast(page_source, logger=logger, anchors=anchors)
+    if engine == "fast" or stats.is_complete():
+        return stats
+
+    missing = [field for field in EtsyStoreStats._fields if getattr(stats, field) is None]
+    logger.debug(f"Fast extractor missed {', '.join(missing) or 'nothing'} with {stats.errors} error(s). "
+                 f"Falling back to BeautifulSoup")
+    soup_stats = extract_stats_soup(page_source, logger=logger)
+    if _found_count(soup_stats) > _found_count(stats):
+        return soup_stats
+    return stats
+
+
+def parse_page(page_source: str, engine: str = "auto", known_fingerprint: str = None,
+               logger: logging.Logger = None) -> ParsedPage:
+    """Fingerprints the page and, unless it matches the known fingerprint, extracts the stats and sold listings
+
+    The fingerprint and the fast extractor share the one scan for the stat anchors.
+    """
+    anchors = find_anchors(page_source)
+    fingerprint = page_fingerprint(page_source, anchors=anchors)
+    if fingerprint and fingerprint == known_fingerprint:
+        return ParsedPage(fingerprint=fingerprint)
+    stats = extract_stats(page_source, engine=engine, logger=logger, anchors=anchors)
+    return ParsedPage(fingerprint=fingerprint, stats=stats, listing_ids=tuple(extract_sold_listing_ids(page_source)))
+
+
+def _found_count(stats: EtsyStoreStats) -> int:
+    return sum(getattr(stats, field) is not None for field in EtsyStoreStats._fields if field != "errors")
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor
+from datetime import datetime
+from random import uniform
+from typing import Awaitable, Callable, Dict, Optional
+
+from aio_etsy_stats.leases import LeaseLost
+from aio_etsy_stats.main import AIOEtsyStats
+from aio_etsy_stats.parsing import EtsyStoreStats
+from aio_etsy_stats.scheduler import jitter_range
+
+
+class ScrapeCycle:
+    """One update of a shop as it moves through the stages"""
+
+    def __init__(self, shop: str, client: AIOEtsyStats):
+        self.shop = shop
+        self.client = client
+        self.started = datetime.now()
+        self.page_source: Optional[str] = None
+        self.stats: Optional[EtsyStoreStats] = None
+        self.failed = False
+        self.done = asyncio.Event()
+
+
+class ScrapePipeline:
+    """Runs shop updates as asyncio stages connected by bounded queues
+
+    fetch -> parse -> diff, where the diff stage hands AIO writes to the publish stage and messages to the notify
+    stage. Blocking work runs in executors, so a slow webhook or AIO request only holds up its own stage. A shop has at
+    most one update in the pipeline and schedules its next one once it is through.
+    """
+
+    def __init__(self, clients: Dict[str, AIOEtsyStats], fetch_workers: int = 2, parse_workers: int = 1,
+                 fetch_executor: Executor = None, parse_executor: Executor = None, queue_size: int = None,
+                 on_complete: Callable[[str, float, bool], None] = None, logger: logging.Logger = None):
+        self.clients = dict(clients)
+        self.fetch_workers = max(1, fetch_workers)
+        self.parse_workers = max(1, parse_workers)
+        self.queue_size = queue_size or max(1, len(clients))
+        self.on_complete = on_complete  # Called with the shop, seconds taken and whether it failed
+        self.logger = logger or logging.getLogger(type(self).__name__)
+
+        self._diff_executor = ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix="diff")
+        # One thread each so webhook messages and AIO writes keep their order
+        self._notify_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="notify")
+        self._publish_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="publish")
+        self._owned_executors = [self._diff_executor, self._notify_executor, self._publish_executor]
+        if fetch_executor is None:
+            fetch_executor = ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix="fetch")
+            self._owned_executors.append(fetch_executor)
+        if parse_executor is None:
+            parse_executor = ThreadPoolExecutor(max_workers=self.parse_workers, thread_name_prefix="parse")
+            self._owned_executors.append(parse_executor)
+        self._fetch_executor = fetch_executor
+        self._parse_executor = parse_executor
+
+        self.dropped_notifications = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._fetch_queue: Optional[asyncio.Queue] = None
+        self._parse_queue: Optional[asyncio.Queue] = None
+        self._diff_queue: Optional[asyncio.Queue] = None
+        self._publish_queue: Optional[asyncio.Queue] = None
+        self._notify_queue: Optional[asyncio.Queue] = None
+        self._shop_tasks: Dict[str, asyncio.Task] = {}
+        self._cycles: Dict[str, ScrapeCycle] = {}  # Latest update of each shop
+
+    # region Stages
+    async def _run_stage(self, inbox: asyncio.Queue, work: Callable[[ScrapeCycle], Awaitable[None]],
+                         outbox: asyncio.Queue = None) -> None:
+        while True:
+            cycle = await inbox.get()
+            try:
+                await work(cycle)
+            except Exception as e:
+                self._finish(cycle, error=e)
+                continue
+            if outbox is None:
+                self._finish(cycle)
+            else:
+                await outbox.put(cycle)
+
+    @staticmethod
+    def _fetch(client: AIOEtsyStats) -> Optional[str]:
+        client.begin_update()
+        title, page_source = client._fetch_page(url=client.scrape_url)
+        return page_source
+
+    async def _fetch_stage(self, cycle: ScrapeCycle) -> None:
+        cycle.page_source = await self._loop.run_in_executor(self._fetch_executor, self._fetch, cycle.client)
+
+    async def _parse_stage(self, cycle: ScrapeCycle) -> None:
+        cycle.stats = await self._loop.run_in_executor(self._parse_executor, cycle.client.parse_etsy_stats,
+                                                       cycle.page_source)
+        cycle.page_source = None  # Pages are large, don't hold on to them in the next queue
+
+    async def _diff_stage(self, cycle: ScrapeCycle) -> None:
+        await self._loop.run_in_executor(self._diff_executor, cycle.client.process_stats, cycle.stats)
+
+    async def _publish_stage(self) -> None:
+        while True:
+            client, feed, value = await self._publish_queue.get()
+            try:
+                # Checking the lease is a database query, so it doesn't run on the event loop
+                await self._loop.run_in_executor(self._publish_executor, client._publish_aio, feed, value)
+            except Exception as e:
+                client.logger.warning(f"An error occurred queueing AIO feed {feed}")
+                client.logger.exception(e)
+
+    async def _notify_stage(self) -> None:
+        while True:
+            client, level, message = await self._notify_queue.get()
+            try:
+                await self._loop.run_in_executor(self._notify_executor, client.logger.log, level, message)
+            except Exception as e:
+                self.logger.warning(f"An error occurred sending a notification for {client.shop}")
+                self.logger.exception(e)
+    # endregion
+
+    def _finish(self, cycle: ScrapeCycle, error: Exception = None) -> None:
+        client = cycle.client
+        if isinstance(error, LeaseLost):
+            cycle.failed = True
+            client.logger.info(f"Stopped updating {cycle.shop}, another node has taken it over")
+        elif error is not None:
+            cycle.failed = True
+            client.last_scrape_errors += 1
+            client.logger.warning(f"An error occurred collecting stats for {cycle.shop}")
+            client.logger.exception(error)
+        if self.on_complete:
+            self.on_complete(cycle.shop, (datetime.now() - cycle.started).total_seconds(), cycle.failed)
+        cycle.done.set()
+
+    # region Hooks called from the executor threads
+    def _publish_from_thread(self, client: AIOEtsyStats, feed: str, value) -> None:
+        # Waits for room so AIO writes are never dropped
+        asyncio.run_coroutine_threadsafe(self._publish_queue.put((client, feed, value)), self._loop).result()
+
+    def _offer_notification(self, client: AIOEtsyStats, level: int, message: str) -> None:
+        try:
+            self._notify_queue.put_nowait((client, level, message))
+        except asyncio.QueueFull:
+            # Notifications are dropped rather than holding up the shop behind a slow webhook
+            self.dropped_notifications += 1
+            self.logger.warning(f"Dropped a notification for {client.shop}, {self._notify_queue.qsize()} are waiting. "
+                                f"{self.dropped_notifications} dropped so far")
+
+    def _notify_from_thread(self, client: AIOEtsyStats, level: int, message: str) -> None:
+        self._loop.call_soon_threadsafe(self._offer_notification, client, level, message)
+    # endregion
+
+    async def _schedule_shop(self, shop: str, client: AIOEtsyStats) -> None:
+        while True:
+            cycle = self._cycles[shop] = ScrapeCycle(shop, client)
+            await self._fetch_queue.put(cycle)
+            await cycle.done.wait()
+            low, high = jitter_range(client._next_scrape_minutes())
+            await asyncio.sleep(uniform(low, high))
+
+    def add_client(self, shop: str, client: AIOEtsyStats) -> None:
+        """Starts updating a shop. Call from the event loop once the pipeline is running"""
+        self.clients[shop] = client
+        client.publish_hook = lambda feed, value: self._publish_from_thread(client, feed, value)
+        client.notify_hook = lambda level, message: self._notify_from_thread(client, level, message)
+        self._shop_tasks[shop] = asyncio.ensure_future(self._schedule_shop(shop, client))
+
+    def remove_client(self, shop: str) -> Optional[ScrapeCycle]:
+        """Stops scheduling a shop. Returns its update if one is still going through the stages"""
+        task = self._shop_tasks.pop(shop, None)
+        if task is not None:
+            task.cancel()
+        client = self.clients.pop(shop, None)
+        if client is not None:
+            client.publish_hook = None
+            client.notify_hook = None
+        cycle = self._cycles.pop(shop, None)
+        return cycle if cycle is not None and not cycle.done.is_set() else None
+
+    async def run(self) -> None:
+        """Runs every shop until cancelled. The first update of each shop starts right away"""
+        self._loop = asyncio.get_running_loop()
+        self._fetch_queue = asyncio.Queue(maxsize=self.queue_size)
+        self._parse_queue = asyncio.Queue(maxsize=self.queue_size)
+        self._diff_queue = asyncio.Queue(maxsize=self.queue_size)
+        self._publish_queue = asyncio.Queue(maxsize=self.queue_size * 20)
+        self._notify_queue = asyncio.Queue(maxsize=self.queue_size * 10)
+
+        tasks = [asyncio.ensure_future(self._run_stage(self._fetch_queue, self._fetch_stage, self._parse_queue))
+                 for _ in range(self.fetch_workers)]
+        tasks += [asyncio.ensure_future(self._run_stage(self._parse_queue, self._parse_stage, self._diff_queue))
+                  for _ in range(self.parse_workers)]
+        tasks += [asyncio.ensure_future(self._run_stage(self._diff_queue, self._diff_stage))
+                  for _ in range(self.fetch_workers)]
+        tasks += [asyncio.ensure_future(self._publish_stage()), asyncio.ensure_future(self._notify_stage())]
+        for shop, client in list(self.clients.items()):
+            self.add_client(shop, client)
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for shop in list(self.clients):
+                self.remove_client(shop)
+
+    def close(self) -> None:
+        for executor in self._owned_executors:
+            executor.shutdown(wait=False)
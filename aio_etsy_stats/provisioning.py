@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING, Dict, Iterable, Optional
+
+if TYPE_CHECKING:
+    import Adafruit_IO
+
+
+def default_state_dir() -> str:
+    """Where local state is kept when STATE_DIR isn't set"""
+    return os.path.join(os.path.expanduser("~"), ".aio_etsy_stats")
+
+
+class ProvisioningManifest:
+    """Remembers which AIO groups and feeds have already been created so they aren't checked on every start"""
+
+    _lock = threading.Lock()  # Shared by every instance since shops in one process use the same file
+
+    def __init__(self, path: str, logger: logging.Logger = None):
+        self.path = path
+        self.logger = logger or logging.getLogger(type(self).__name__)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self.logger.debug(f"Ignoring unreadable provisioning manifest {self.path}: {e}")
+            return {}
+
+    def _write(self, manifest: dict) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def _key(username: str, group_key: str) -> str:
+        return f"{username}/{group_key}"
+
+    def is_provisioned(self, username: str, group_key: str, feed_keys: Iterable[str]) -> bool:
+        with self._lock:
+            known = set(self._read().get(self._key(username, group_key), []))
+        return set(feed_keys).issubset(known)
+
+    def mark_provisioned(self, username: str, group_key: str, feed_keys: Iterable[str]) -> None:
+        with self._lock:
+            manifest = self._read()
+            key = self._key(username, group_key)
+            manifest[key] = sorted(set(manifest.get(key, [])) | set(feed_keys))
+            self._write(manifest)
+
+    def forget(self, username: str, group_key: str) -> None:
+        """Used when AIO says a group the manifest knows about is missing"""
+        with self._lock:
+            manifest = self._read()
+            if manifest.pop(self._key(username, group_key), None) is not None:
+                self._write(manifest)
+
+
+def load_group_feeds(client: "Adafruit_IO.Client", group_key: str) -> Optional[Dict[str, Optional[str]]]:
+    """Gets every feed in the group with its last value in one request
+
+    Returns a dict of feed key (without the group prefix) to last value, or None if the group doesn't exist. The
+    client's Group model drops ``last_value``, so the raw response is used.
+    """
+    from Adafruit_IO.errors import RequestError
+
+    try:
+        response = client._get(f"groups/{group_key}")
+    except RequestError as e:
+        if "failed: 404 " in str(e):
+            return None
+        raise
+
+    feeds = {}
+    for feed in response.get("feeds", []):
+        key = feed.get("key", "")
+        if key.startswith(f"{group_key}."):
+            key = key[len(group_key) + 1:]
+        feeds[key] = feed.get("last_value")
+    return feeds
@@ -0,0 +1,288 @@
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import Adafruit_IO
+import requests
+from Adafruit_IO.errors import RequestError, ThrottlingError
+
+from aio_etsy_stats.metrics import AIO_REQUEST_SECONDS
+from aio_etsy_stats.resilience import CircuitBreaker
+
+# RequestError only has the status code in its message
+SERVER_ERROR_PATTERN = re.compile(r"request failed: 5\d\d\b")
+
+
+def is_aio_outage(error: Exception) -> bool:
+    """Whether an error means AIO is down or unreachable, rather than refusing one request like a missing feed"""
+    if isinstance(error, requests.RequestException):
+        return True
+    return isinstance(error, RequestError) and SERVER_ERROR_PATTERN.search(str(error)) is not None
+
+
+class TimeoutClient(Adafruit_IO.Client):
+    """Adafruit IO client whose requests time out. The library's own requests wait for as long as AIO takes"""
+
+    def __init__(self, username: str, key: str, timeout: float = 10, **kwargs):
+        super().__init__(username, key, **kwargs)
+        self.timeout = timeout
+
+    def _get(self, path, params=None):
+        response = requests.get(self._compose_url(path), headers=self._headers({"X-AIO-Key": self.key}),
+                                proxies=self.proxies, params=params, timeout=self.timeout)
+        self._last_response = response
+        self._handle_error(response)
+        return response.json()
+
+    def _post(self, path, data):
+        response = requests.post(self._compose_url(path),
+                                 headers=self._headers({"X-AIO-Key": self.key, "Content-Type": "application/json"}),
+                                 proxies=self.proxies, data=json.dumps(data), timeout=self.timeout)
+        self._last_response = response
+        self._handle_error(response)
+        return response.json()
+
+    def _delete(self, path):
+        response = requests.delete(self._compose_url(path),
+                                   headers=self._headers({"X-AIO-Key": self.key,
+                                                          "Content-Type": "application/json"}),
+                                   proxies=self.proxies, timeout=self.timeout)
+        self._last_response = response
+        self._handle_error(response)
+
+
+class TokenBucket:
+    """Simple token bucket. AIO counts every data point against a per minute limit"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate_per_second = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    def take(self, tokens: float = 1) -> float:
+        """Takes the tokens if they are available. Returns 0 on success or the seconds to wait before trying again"""
+        with self._lock:
+            self._refill()
+            tokens = min(tokens, self.capacity)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate_per_second
+
+
+class PendingWrite(NamedTuple):
+    value: object
+    attempts: int = 0
+    not_before: float = 0.0
+    fence: Optional[Callable[[], bool]] = None  # The write is only sent if this still returns True
+
+
+class AIOPublisher:
+    """Sends feed values to AIO from a background thread so a slow request doesn't hold up the next scrape
+
+    Writes to the same feed that haven't been sent yet are coalesced so only the newest value goes out. Values that
+    are ready at the same time for one group are sent with a single request to the group data endpoint. Requests are
+    paced with a token bucket and failed writes are retried with exponential backoff unless a newer value replaced them.
+    While the breaker for AIO is open, writes are held (and still coalesced) until it lets a request through again.
+
+    A write can carry a fence, like a shop lease's ``held``, that is checked right before it is sent. Writes can wait
+    out an outage for longer than a lease lasts, so a scraper that lost the shop meanwhile doesn't overwrite the new
+    owner's values.
+    """
+
+    def __init__(self, client: Adafruit_IO.Client, rate_per_minute: float = 30, max_pending: int = 100,
+                 max_retries: int = 5, backoff_seconds: float = 2.0, breaker: CircuitBreaker = None,
+                 logger: logging.Logger = None):
+        self.client = client
+        self.breaker = breaker
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.logger = logger or logging.getLogger(type(self).__name__)
+
+        self._bucket = TokenBucket(rate_per_minute=rate_per_minute)
+        self._pending: "OrderedDict[Tuple[str, str], PendingWrite]" = OrderedDict()
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._closed = False
+
+        # Used to see how well writes are being saved
+        self.counts: Dict[str, int] = {"published": 0, "sent": 0, "requests": 0, "coalesced": 0, "retried": 0,
+                                       "held": 0, "dropped": 0, "fenced": 0}
+
+        self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    def publish(self, group_key: str, feed_key: str, value, fence: Callable[[], bool] = None) -> None:
+        """Queue a value for a feed in a group. Replaces a value for the same feed that hasn't been sent yet"""
+        key = (group_key, feed_key)
+        with self._condition:
+            self.counts["published"] += 1
+            if key in self._pending:
+                self.counts["coalesced"] += 1
+                del self._pending[key]
+            elif len(self._pending) >= self.max_pending:
+                (dropped_group, dropped_feed), _ = self._pending.popitem(last=False)
+                self.counts["dropped"] += 1
+                self.logger.warning(f"AIO publish queue is full. Dropped pending value for "
+                                    f"{dropped_group}.{dropped_feed}")
+            self._pending[key] = PendingWrite(value=value, fence=fence)
+            self._condition.notify()
+
+    def _take_ready(self) -> Tuple[Optional[str], List[Tuple[str, PendingWrite]], float]:
+        """Pops every ready write for the group of the oldest ready write. Returns how long to wait if none are"""
+        now = monotonic()
+        group = None
+        writes = []
+        wait = None
+        for (group_key, feed_key), write in list(self._pending.items()):
+            if write.not_before > now:
+                wait = min(wait, write.not_before - now) if wait is not None else write.not_before - now
+                continue
+            if group is None:
+                group = group_key
+            if group_key == group:
+                writes.append((feed_key, write))
+                del self._pending[(group_key, feed_key)]
+        return group, writes, wait
+
+    def _send(self, group_key: str, writes: List[Tuple[str, PendingWrite]]) -> None:
+        if len(writes) == 1:
+            feed_key, write = writes[0]
+            self.logger.debug(f"Updating AIO feed {group_key}.{feed_key} to {write.value}")
+            with AIO_REQUEST_SECONDS.time(operation="send"):
+                self.client.send_data(feed=f"{group_key}.{feed_key}", value=write.value)
+        else:
+            self.logger.debug(f"Updating {len(writes)} AIO feeds in group {group_key}: "
+                              f"{', '.join(f'{feed_key}={write.value}' for feed_key, write in writes)}")
+            # The client doesn't wrap the group data endpoint, but it will build and authenticate the request
+            with AIO_REQUEST_SECONDS.time(operation="send-group"):
+                self.client._post(f"groups/{group_key}/data", {
+                    "feeds": [{"key": feed_key, "value": write.value} for feed_key, write in writes]
+                })
+
+    def _retry(self, group_key: str, writes: List[Tuple[str, PendingWrite]], error: Exception) -> None:
+        with self._condition:
+            for feed_key, write in writes:
+                key = (group_key, feed_key)
+                if key in self._pending:
+                    continue  # A newer value was published while this one was being sent
+                if write.attempts >= self.max_retries:
+                    self.counts["dropped"] += 1
+                    self.logger.warning(f"Giving up updating AIO feed {group_key}.{feed_key} to {write.value} "
+                                        f"after {write.attempts + 1} attempts: {error}")
+                    continue
+                delay = self.backoff_seconds * (2 ** write.attempts)
+                self.counts["retried"] += 1
+                self._pending[key] = write._replace(attempts=write.attempts + 1, not_before=monotonic() + delay)
+
+    def _fenced_off(self, group_key: str, writes: List[Tuple[str, PendingWrite]]) -> List[Tuple[str, PendingWrite]]:
+        """Drops the writes whose fence no longer holds and returns the rest"""
+        allowed = []
+        for feed_key, write in writes:
+            try:
+                holds = write.fence is None or write.fence()
+            except Exception as e:
+                self.logger.warning(f"Unable to check whether AIO feed {group_key}.{feed_key} can still be updated")
+                self.logger.exception(e)
+                holds = False
+            if holds:
+                allowed.append((feed_key, write))
+            else:
+                self.logger.debug(f"Not updating AIO feed {group_key}.{feed_key}, its fence no longer holds")
+        if len(allowed) < len(writes):
+            with self._condition:
+                self.counts["fenced"] += len(writes) - len(allowed)
+        return allowed
+
+    def _hold(self, group_key: str, writes: List[Tuple[str, PendingWrite]], seconds: float) -> None:
+        """Puts writes back without counting an attempt. Called with the condition held"""
+        for feed_key, write in writes:
+            key = (group_key, feed_key)
+            if key not in self._pending:
+                self.counts["held"] += 1
+                self._pending[key] = write._replace(not_before=monotonic() + seconds)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                group_key, writes, wait = self._take_ready()
+                while not writes:
+                    if self._closed:
+                        return
+                    self._condition.wait(timeout=wait)
+                    group_key, writes, wait = self._take_ready()
+                if self.breaker and not self.breaker.allow():
+                    self._hold(group_key, writes, max(1.0, self.breaker.retry_after()))
+                    continue
+                self._in_flight = len(writes)
+
+            # Wait for enough tokens for every data point in the request
+            delay = self._bucket.take(len(writes))
+            while delay > 0:
+                with self._condition:
+                    self._condition.wait(timeout=delay)
+                delay = self._bucket.take(len(writes))
+
+            # Checked as late as possible, since the writes may have been waiting a while
+            writes = self._fenced_off(group_key, writes)
+            if not writes:
+                with self._condition:
+                    self._in_flight = 0
+                    self._condition.notify_all()
+                continue
+
+            try:
+                self._send(group_key, writes)
+                if self.breaker:
+                    self.breaker.record_success()
+                with self._condition:
+                    self.counts["requests"] += 1
+                    self.counts["sent"] += len(writes)
+            except Exception as e:
+                if isinstance(e, ThrottlingError):
+                    self.logger.warning("AIO is throttling requests. Backing off")
+                else:
+                    self.logger.warning(f"An error occurred updating AIO feeds in group {group_key}")
+                    self.logger.exception(e)
+                if self.breaker:
+                    if is_aio_outage(e):
+                        self.breaker.record_failure(e)
+                    else:
+                        self.breaker.record_success()  # It answered, so it is up
+                self._retry(group_key, writes, e)
+            finally:
+                with self._condition:
+                    self._in_flight = 0
+                    self._condition.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Blocks until everything queued has been sent or given up on. Returns False on timeout"""
+        deadline = monotonic() + timeout if timeout is not None else None
+        with self._condition:
+            while self._pending or self._in_flight:
+                remaining = deadline - monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(timeout=remaining)
+        return True
+
+    def close(self, timeout: float = 10) -> None:
+        """Sends what it can within the timeout and stops the background thread"""
+        if not self.flush(timeout=timeout):
+            self.logger.warning(f"{len(self._pending)} AIO update(s) were not sent before closing")
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout=1)
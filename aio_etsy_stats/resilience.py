@@ -0,0 +1,157 @@
+import logging
+import threading
+from contextlib import contextmanager
+from time import monotonic
+from typing import Callable, Dict, Iterator, NamedTuple, Optional
+
+from aio_etsy_stats.metrics import CIRCUIT_CALLS, CIRCUIT_STATE
+
+CLOSED = "closed"
+HALF_OPEN = "half-open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a dependency whose breaker is open"""
+
+
+class DependencyTimeouts(NamedTuple):
+    """Seconds to wait on each dependency before giving up on a call"""
+    etsy: float = 15
+    selenium: float = 30
+    aio: float = 10
+    ipify: float = 5
+
+
+def parse_timeouts(value: Optional[str]) -> DependencyTimeouts:
+    """Parses timeouts like "etsy=20,aio=5". Dependencies that are left out keep their defaults"""
+    if not value:
+        return DependencyTimeouts()
+    timeouts = {}
+    for item in value.split(","):
+        name, _, seconds = item.partition("=")
+        name = name.strip().lower()
+        if name not in DependencyTimeouts._fields:
+            raise ValueError(f"Timeouts can be set for {', '.join(DependencyTimeouts._fields)}, not {name}")
+        timeouts[name] = float(seconds)
+    return DependencyTimeouts(**timeouts)
+
+
+class CircuitBreaker:
+    """Stops calling a dependency that keeps failing, so a scrape skips it quickly instead of waiting on it
+
+    After ``failure_threshold`` failures in a row the breaker opens and calls are refused for ``reset_seconds``. It is
+    then half open and lets ``half_open_calls`` calls through to probe the dependency. A success closes it again and a
+    failure opens it for another ``reset_seconds``.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 60,
+                 half_open_calls: int = 1, logger: logging.Logger = None):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_seconds = reset_seconds
+        self.half_open_calls = max(1, int(half_open_calls))
+        self.logger = logger or logging.getLogger(type(self).__name__)
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0  # In a row
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probed_at = 0.0
+        CIRCUIT_STATE.set(STATE_VALUES[CLOSED], dependency=name)
+
+    def _set_state(self, state: str) -> None:
+        self._state = state
+        if state == HALF_OPEN:
+            self._probes = 0
+        CIRCUIT_STATE.set(STATE_VALUES[state], dependency=self.name)
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and monotonic() - self._opened_at >= self.reset_seconds:
+            self._set_state(HALF_OPEN)
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def retry_after(self) -> float:
+        """Seconds until an open breaker lets a probe through"""
+        with self._lock:
+            if self._current_state() != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_seconds - monotonic())
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead. Every allowed call has to be followed by record_success or record_failure"""
+        with self._lock:
+            state = self._current_state()
+            if state == HALF_OPEN and self._probes >= self.half_open_calls \
+                    and monotonic() - self._probed_at >= self.reset_seconds:
+                self._probes = 0  # The probes never reported back, so let another one through
+            if state == CLOSED or (state == HALF_OPEN and self._probes < self.half_open_calls):
+                if state == HALF_OPEN:
+                    self._probes += 1
+                    self._probed_at = monotonic()
+                return True
+        CIRCUIT_CALLS.inc(dependency=self.name, result="rejected")
+        return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            recovered = self._state != CLOSED
+            self._failures = 0
+            self._set_state(CLOSED)
+        CIRCUIT_CALLS.inc(dependency=self.name, result="success")
+        if recovered:
+            self.logger.info(f"{self.name} is responding again")
+
+    def record_failure(self, error: Exception = None) -> None:
+        with self._lock:
+            self._failures += 1
+            failures = self._failures
+            opened = self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold)
+            if opened:
+                self._opened_at = monotonic()
+                self._set_state(OPEN)
+        CIRCUIT_CALLS.inc(dependency=self.name, result="failure")
+        if opened:
+            self.logger.warning(f"{self.name} failed {failures} time(s) in a row. Not calling it for "
+                                f"{self.reset_seconds:g}s{f': {error}' if error else ''}")
+
+    @contextmanager
+    def guard(self, is_failure: Callable[[Exception], bool] = None) -> Iterator[None]:
+        """Runs the block if the breaker allows it and records how it went. Raises CircuitOpen if it doesn't
+
+        Errors ``is_failure`` returns False for, like a 404, still show the dependency answered and count as successes.
+        """
+        if not self.allow():
+            raise CircuitOpen(f"{self.name} circuit is open, retrying in {self.retry_after():.0f}s")
+        try:
+            yield
+        except Exception as e:
+            if is_failure is None or is_failure(e):
+                self.record_failure(e)
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(name: str, failure_threshold: int = 5, reset_seconds: float = 60,
+                    logger: logging.Logger = None) -> CircuitBreaker:
+    """The breaker for a dependency. There is one per process so every shop sees the same state, and the settings of
+    the first call for a name are the ones used"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, failure_threshold=failure_threshold,
+                                                       reset_seconds=reset_seconds, logger=logger)
+        return breaker
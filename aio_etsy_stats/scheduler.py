@@ -0,0 +1,71 @@
+from datetime import datetime
+from typing import Optional, Tuple
+
+
+def jitter_range(minutes: float) -> Tuple[int, int]:
+    """Range of seconds to pick the next run from, so scrapes don't happen on a fixed beat Etsy can spot"""
+    seconds = max(1, int(minutes * 60))
+    return seconds, seconds + max(30, seconds // 4)
+
+
+def parse_quiet_hours(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Parses hours like "0-6" or "22-5" (wrapping past midnight) into a start and end hour"""
+    if not value:
+        return None
+    start, _, end = value.partition("-")
+    start, end = int(start), int(end)
+    if not (0 <= start <= 23 and 0 <= end <= 23):
+        raise ValueError(f"Quiet hours must be between 0 and 23, not {value}")
+    return start, end
+
+
+def in_quiet_hours(quiet_hours: Optional[Tuple[int, int]], now: datetime) -> bool:
+    if not quiet_hours:
+        return False
+    start, end = quiet_hours
+    if start <= end:
+        return start <= now.hour < end
+    return now.hour >= start or now.hour < end
+
+
+class AdaptiveInterval:
+    """Works out how long to wait before the next scrape from what the previous scrapes found
+
+    Changes to sold or favorite counts shorten the interval towards ``min_minutes``. Without changes it drifts back to
+    ``base_minutes``, or keeps growing towards ``max_minutes`` during quiet hours. Scrapes with errors back off
+    exponentially from the current interval, so a blocked or broken scraper stops hammering Etsy.
+    """
+
+    def __init__(self, base_minutes: float, min_minutes: float = None, max_minutes: float = None,
+                 quiet_hours: Tuple[int, int] = None, speedup_factor: float = 0.5, backoff_factor: float = 2.0):
+        self.base_minutes = base_minutes
+        self.min_minutes = min(min_minutes or base_minutes, base_minutes)
+        self.max_minutes = max(max_minutes or base_minutes, base_minutes)
+        self.quiet_hours = quiet_hours
+        self.speedup_factor = speedup_factor
+        self.backoff_factor = backoff_factor
+
+        self.current_minutes = base_minutes
+        self.consecutive_errors = 0
+
+    def next_minutes(self, changed: bool, errors: int, now: datetime = None) -> float:
+        """Records the result of a scrape and returns the minutes until the next one"""
+        now = now or datetime.now()
+        if errors > 0:
+            self.consecutive_errors += 1
+            self.current_minutes = min(self.max_minutes,
+                                       max(self.current_minutes, self.base_minutes) * self.backoff_factor)
+            return self.current_minutes
+
+        self.consecutive_errors = 0
+        if changed:
+            self.current_minutes = max(self.min_minutes, self.current_minutes * self.speedup_factor)
+        elif in_quiet_hours(self.quiet_hours, now):
+            self.current_minutes = min(self.max_minutes, max(self.current_minutes, self.base_minutes)
+                                       * self.backoff_factor)
+        elif self.current_minutes < self.base_minutes:
+            # Ease back to normal after a burst of activity
+            self.current_minutes = min(self.base_minutes, self.current_minutes / self.speedup_factor)
+        else:
+            self.current_minutes = self.base_minutes
+        return self.current_minutes
@@ -0,0 +1,86 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Sequence
+
+
+def new_sales(previous: Sequence[str], current: Sequence[str]) -> int:
+    """How many entries at the top of the current sold page weren't on the previous one
+
+    The page has no order or receipt ids, the newest sale is first and a listing shows up once per sale, so new sales
+    push the previous page down. They're the entries above the point where the previous page starts again. When the
+    previous page can't be found at all, everything on the current page is new.
+    """
+    for count in range(len(current)):
+        overlap = min(len(previous), len(current) - count)
+        if overlap and list(current[count:count + overlap]) == list(previous[:overlap]):
+            return count
+    return len(current)
+
+
+class SoldListingIndex:
+    """Remembers the last sold page and the sales found on it for each shop
+
+    Only the ``max_entries`` most recent sales are kept per shop, so the index stays small no matter how long it runs.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1000):
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS sold_pages (shop TEXT PRIMARY KEY, listing_ids TEXT NOT NULL, "
+            "updated REAL NOT NULL) WITHOUT ROWID")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS sales (shop TEXT NOT NULL, sold_at REAL NOT NULL, position INTEGER NOT NULL, "
+            "listing_id TEXT NOT NULL, PRIMARY KEY (shop, sold_at, position)) WITHOUT ROWID")
+
+    def record(self, shop: str, listing_ids: Sequence[str], timestamp: datetime = None) -> List[str]:
+        """Records the sold page and returns the ids of the listings sold since the last one, newest first
+
+        The first page recorded for a shop only seeds the index, since those sales happened before it was tracked.
+        """
+        if not listing_ids:
+            return []
+        shop = shop.lower()
+        sold_at = (timestamp or datetime.now()).timestamp()
+
+        with self._lock:
+            with self._connection:
+                self._connection.execute("BEGIN IMMEDIATE")
+                row = self._connection.execute(
+                    "SELECT listing_ids FROM sold_pages WHERE shop = ?", (shop,)).fetchone()
+                sold = list(listing_ids[:new_sales(json.loads(row[0]), listing_ids)]) if row else []
+                self._connection.execute(
+                    "INSERT INTO sold_pages (shop, listing_ids, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT (shop) DO UPDATE SET listing_ids = excluded.listing_ids, updated = excluded.updated",
+                    (shop, json.dumps(list(listing_ids)), sold_at))
+                # Positions count down so the newest sale of the batch sorts first
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO sales (shop, sold_at, position, listing_id) VALUES (?, ?, ?, ?)",
+                    [(shop, sold_at, len(sold) - index, listing_id) for index, listing_id in enumerate(sold)])
+                if sold:
+                    self._connection.execute(
+                        "DELETE FROM sales WHERE shop = ? AND (sold_at, position) NOT IN (SELECT sold_at, position "
+                        "FROM sales WHERE shop = ? ORDER BY sold_at DESC, position DESC LIMIT ?)",
+                        (shop, shop, self.max_entries))
+        return sold
+
+    def velocity(self, shop: str, since: datetime) -> Dict[str, int]:
+        """Sales of each listing since the given time, most sold first"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT listing_id, COUNT(*) AS sold FROM sales WHERE shop = ? AND sold_at >= ? "
+                "GROUP BY listing_id ORDER BY sold DESC, listing_id", (shop.lower(), since.timestamp())).fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
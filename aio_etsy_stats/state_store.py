@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+from aio_etsy_stats.leases import LEASE_HELD_SQL, LeaseLost, ShopLease
+
+
+class ShopState(NamedTuple):
+    """Everything needed to pick up where a shop left off after a restart"""
+    favorite_count: Optional[int] = None
+    rating: Optional[float] = None
+    rating_count: Optional[int] = None
+    sold_count: Optional[int] = None
+    starting_favorite_count: Optional[int] = None
+    starting_rating: Optional[float] = None
+    starting_rating_count: Optional[int] = None
+    starting_sold_count: Optional[int] = None
+    daily_order_count: int = 0
+    reset_hour: Optional[int] = None
+    reset_timestamp: Optional[float] = None
+    seeded: bool = True  # False while the counters kept in AIO couldn't be loaded, so they are loaded once they can be
+    updated_timestamp: Optional[float] = None
+
+
+class StateStore:
+    """Keeps shop state in a local SQLite database in WAL mode
+
+    Each save replaces the whole row in one transaction, so a crash can't leave the counters half updated. Several
+    shops (and processes) can share the database file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        columns = ", ".join(f"{field} REAL" for field in ShopState._fields)
+        self._connection.execute(f"CREATE TABLE IF NOT EXISTS shop_state (shop TEXT PRIMARY KEY, {columns})")
+        # Fields added since the table was created
+        existing = {row[1] for row in self._connection.execute("PRAGMA table_info(shop_state)")}
+        for field in ShopState._fields:
+            if field not in existing:
+                self._connection.execute(f"ALTER TABLE shop_state ADD COLUMN {field} REAL")
+
+    def load(self, shop: str) -> Optional[ShopState]:
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT {', '.join(ShopState._fields)} FROM shop_state WHERE shop = ?", (shop.lower(),)
+            ).fetchone()
+        if row is None:
+            return None
+
+        # SQLite hands back REAL columns as floats. Columns added later are NULL in older rows and get the default
+        values = {}
+        for field, value in zip(ShopState._fields, row):
+            if value is None:
+                continue
+            if ShopState.__annotations__[field] in (int, Optional[int]):
+                value = int(value)
+            elif ShopState.__annotations__[field] is bool:
+                value = bool(value)
+            values[field] = value
+        return ShopState(**values)
+
+    def shops(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._connection.execute("SELECT shop FROM shop_state ORDER BY shop")]
+
+    def save(self, shop: str, state: ShopState, lease: ShopLease = None) -> None:
+        """Saves the state. With a lease the save only happens if the lease is still held, checked in the same
+        transaction, otherwise LeaseLost is raised"""
+        state = state._replace(updated_timestamp=datetime.now().timestamp())
+        placeholders = ", ".join("?" for _ in ShopState._fields)
+        with self._lock:
+            with self._connection:
+                self._connection.execute("BEGIN IMMEDIATE")
+                if lease is not None and self._connection.execute(
+                        LEASE_HELD_SQL, (lease.shop, lease.owner, lease.token, state.updated_timestamp)
+                ).fetchone() is None:
+                    raise LeaseLost(f"{lease} is no longer held")
+                self._connection.execute(
+                    f"INSERT OR REPLACE INTO shop_state (shop, {', '.join(ShopState._fields)}) "
+                    f"VALUES (?, {placeholders})", (shop.lower(), *state)
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
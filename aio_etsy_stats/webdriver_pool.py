@@ -0,0 +1,296 @@
+import logging
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from queue import Empty, Queue
+from time import perf_counter, sleep
+from typing import TYPE_CHECKING, Iterator, List, NamedTuple, Optional, Pattern, Sequence, Tuple
+
+from aio_etsy_stats.metrics import WEBDRIVER_ACQUIRE_SECONDS
+
+# Selenium is only loaded once a browser is needed, so HTTP only and parse only runs don't pay for it
+if TYPE_CHECKING:
+    from selenium import webdriver
+
+FONT_URL_PATTERNS = ("*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot")
+STYLESHEET_URL_PATTERNS = ("*.css",)
+MEDIA_URL_PATTERNS = ("*.mp4", "*.webm", "*.m3u8", "*.mp3")
+
+# Tests the rendered page against the patterns in the browser so only a boolean comes back on every poll
+PAGE_READY_SCRIPT = ("const html = document.documentElement ? document.documentElement.outerHTML : '';"
+                     "return arguments[0].every(pattern => new RegExp(pattern).test(html));")
+# Cross-origin resources without a Timing-Allow-Origin header report 0, so this is a lower bound
+TRANSFER_BYTES_SCRIPT = ("return performance.getEntriesByType('navigation')"
+                         ".concat(performance.getEntriesByType('resource'))"
+                         ".reduce((total, entry) => total + (entry.transferSize || 0), 0);")
+
+
+def test_port(hostname: str, port: int) -> int:
+    """Tests if port is open on remote host"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(2)
+    result = sock.connect_ex((hostname, int(port)))
+    sock.close()
+    return result
+
+
+def get_timedelta_from_now(start: datetime) -> timedelta:
+    result = datetime.now() - start
+    return result
+
+
+def wait_for_page(driver, patterns: Sequence[Pattern], timeout: float) -> bool:
+    """Waits until every pattern matches the rendered page. Returns False if the timeout passed first
+
+    With the eager and none page load strategies ``driver.get`` returns before the page is done loading, so this is
+    what decides when the page has what the parser needs.
+    """
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    sources = [pattern.pattern for pattern in patterns]
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=0.25).until(
+            lambda d: d.execute_script(PAGE_READY_SCRIPT, sources))
+        return True
+    except TimeoutException:
+        return False
+
+
+def page_transfer_bytes(driver) -> Optional[int]:
+    """Bytes the browser transferred for the current page and what it loaded so far, from the performance API"""
+    try:
+        transferred = driver.execute_script(TRANSFER_BYTES_SCRIPT)
+    except Exception:
+        return None
+    return int(transferred) if transferred is not None else None
+
+
+class BrowserProfile(NamedTuple):
+    """How Chrome is started for scraping. The defaults skip loading everything the parser never reads"""
+    headless: bool = True
+    block_images: bool = True
+    block_fonts: bool = True
+    block_stylesheets: bool = True
+    block_media: bool = True
+    blocked_url_patterns: Tuple[str, ...] = ()  # Extra patterns, e.g. ad and analytics hosts
+    page_load_strategy: str = "eager"  # normal, eager or none
+    wait_seconds: float = 15  # How long to wait for the stats to be on the page
+    cache_dir: Optional[str] = None  # Kept between sessions so static files aren't downloaded every time
+    cache_size_mb: int = 200
+
+    def chrome_options(self) -> "webdriver.ChromeOptions":
+        from selenium import webdriver
+
+        options = webdriver.ChromeOptions()
+        options.page_load_strategy = self.page_load_strategy
+        if self.headless:
+            options.add_argument("--headless=new")
+            options.add_argument("--window-size=1280,1024")
+        options.add_argument("--disable-dev-shm-usage")
+        options.add_argument("--disable-extensions")
+        if self.cache_dir:
+            options.add_argument(f"--disk-cache-dir={self.cache_dir}")
+            options.add_argument(f"--disk-cache-size={self.cache_size_mb * 1024 * 1024}")
+        if self.block_images:
+            options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+        return options
+
+    def blocked_urls(self) -> List[str]:
+        """Patterns for requests the browser is told not to make"""
+        patterns = list(self.blocked_url_patterns)
+        if self.block_fonts:
+            patterns.extend(FONT_URL_PATTERNS)
+        if self.block_stylesheets:
+            patterns.extend(STYLESHEET_URL_PATTERNS)
+        if self.block_media:
+            patterns.extend(MEDIA_URL_PATTERNS)
+        return patterns
+
+
+class PooledSession:
+    """A WebDriver session and the bookkeeping used to decide when to recycle it"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.created = datetime.now()
+        self.navigations = 0
+
+
+class WebDriverPool:
+    """Keeps WebDriver sessions alive between scrapes instead of starting a new browser every time
+
+    Sessions are health checked when they are handed out and are recycled after ``max_navigations`` uses or when the
+    page's JS heap grows past ``max_memory_mb``. A session that errors while in use is thrown away and rebuilt on the
+    next request. ``timeout`` bounds waiting for the Selenium port, each command sent to it and each page load.
+    """
+
+    def __init__(self, selenium_host: str = None, selenium_port: int = None, size: int = 1,
+                 max_navigations: int = 50, max_memory_mb: Optional[int] = None,
+                 browser_profile: BrowserProfile = None, timeout: float = 30, logger: logging.Logger = None):
+        self.selenium_host = selenium_host
+        self.selenium_port = selenium_port
+        self.timeout = timeout
+        self.size = max(1, int(size))
+        self.max_navigations = max_navigations
+        self.max_memory_mb = max_memory_mb
+        self.profile = browser_profile or BrowserProfile()
+        if self.profile.page_load_strategy not in ("normal", "eager", "none"):
+            raise ValueError(f"page_load_strategy must be normal, eager or none, not {self.profile.page_load_strategy}")
+        self.logger = logger or logging.getLogger(type(self).__name__)
+
+        self._idle: Queue = Queue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._sessions = set()
+        self._closed = False
+
+        self.created_total = 0  # Used to see how often the browser is started
+        self.recycled_total = 0
+
+    def _wait_for_selenium(self) -> bool:
+        """Waits up to the timeout for the remote selenium port to be open. Returns False if it never opened"""
+        if self.selenium_host and self.selenium_port:
+            self.logger.debug(f"Waiting up to {self.timeout:g}s for selenium port to be open")
+            start = datetime.now()
+            while test_port(self.selenium_host, self.selenium_port) != 0:
+                if get_timedelta_from_now(start) >= timedelta(seconds=self.timeout):
+                    return False
+                sleep(1)
+        return True
+
+    def _create_driver(self):
+        from selenium import webdriver
+        from selenium.webdriver.remote.client_config import ClientConfig
+
+        if not self._wait_for_selenium():
+            raise ConnectionError(f"Selenium port {self.selenium_host}:{self.selenium_port} didn't open within "
+                                  f"{self.timeout:g}s")
+
+        options = self.profile.chrome_options()
+        if self.selenium_host and self.selenium_port:
+            url = f"http://{self.selenium_host}:{self.selenium_port}"
+            driver = webdriver.Remote(
+                command_executor=url,
+                options=options,
+                client_config=ClientConfig(remote_server_addr=url, timeout=self.timeout)
+            )
+        else:
+            driver = webdriver.Chrome(options=options)
+
+        driver.set_page_load_timeout(self.timeout)
+        self._block_urls(driver)
+        return driver
+
+    def _block_urls(self, driver) -> None:
+        """Blocks requests for the asset types the parser never reads. Chrome has no setting for these like images"""
+        patterns = self.profile.blocked_urls()
+        if not patterns:
+            return
+        try:
+            # The remote connection for Chrome has the same CDP command as a local driver's execute_cdp_cmd
+            driver.execute("executeCdpCommand", {"cmd": "Network.enable", "params": {}})
+            driver.execute("executeCdpCommand", {"cmd": "Network.setBlockedURLs", "params": {"urls": patterns}})
+        except Exception as e:
+            self.logger.debug(f"Couldn't block {len(patterns)} URL pattern(s) in the browser: {e}")
+
+    def _new_session(self) -> PooledSession:
+        self.logger.debug("Starting a new WebDriver session")
+        session = PooledSession(self._create_driver())
+        with self._lock:
+            self._sessions.add(session)
+            self.created_total += 1
+        return session
+
+    def _discard(self, session: PooledSession) -> None:
+        """Quits the browser for the session and forgets about it"""
+        with self._lock:
+            self._sessions.discard(session)
+        try:
+            session.driver.quit()
+        except Exception as e:
+            self.logger.debug(f"Error quitting WebDriver session: {e}")
+
+    def _memory_mb(self, session: PooledSession) -> Optional[float]:
+        """JS heap used by the current page in MB. Only Chrome exposes performance.memory"""
+        used = session.driver.execute_script(
+            "return window.performance.memory ? window.performance.memory.usedJSHeapSize : null")
+        if used is None:
+            return None
+        return float(used) / (1024 * 1024)
+
+    def _is_healthy(self, session: PooledSession) -> bool:
+        """Cheap round trip to the browser to make sure the session is still alive"""
+        try:
+            _ = session.driver.current_url
+            return True
+        except Exception as e:
+            self.logger.debug(f"WebDriver session failed health check: {e}")
+            return False
+
+    def _should_recycle(self, session: PooledSession) -> bool:
+        if self.max_navigations and session.navigations >= self.max_navigations:
+            self.logger.debug(f"Recycling WebDriver session after {session.navigations} navigations")
+            return True
+        if self.max_memory_mb:
+            try:
+                memory_mb = self._memory_mb(session)
+            except Exception:
+                memory_mb = None
+            if memory_mb is not None and memory_mb > self.max_memory_mb:
+                self.logger.debug(f"Recycling WebDriver session using {memory_mb:.1f}MB of JS heap")
+                return True
+        return False
+
+    def _checkout(self) -> PooledSession:
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except Empty:
+                return self._new_session()
+
+            if self._is_healthy(session):
+                return session
+            self._discard(session)
+
+    @contextmanager
+    def session(self) -> Iterator:
+        """Borrow a WebDriver for a single navigation. Blocks while every session in the pool is in use"""
+        if self._closed:
+            raise RuntimeError("WebDriverPool is closed")
+
+        start = perf_counter()
+        self._slots.acquire()
+        session = None
+        broken = False
+        try:
+            session = self._checkout()
+            WEBDRIVER_ACQUIRE_SECONDS.observe(perf_counter() - start)
+            session.navigations += 1
+            yield session.driver
+        except Exception:
+            broken = True
+            raise
+        finally:
+            if session:
+                if broken or self._closed or not self._is_healthy(session) or self._should_recycle(session):
+                    if not broken:
+                        self.recycled_total += 1
+                    self._discard(session)
+                else:
+                    self._idle.put(session)
+            self._slots.release()
+
+    def close(self) -> None:
+        """Quit every browser the pool started"""
+        self._closed = True
+        with self._lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            self._discard(session)
+        while not self._idle.empty():
+            try:
+                self._idle.get_nowait()
+            except Empty:
+                break
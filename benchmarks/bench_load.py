@@ -0,0 +1,158 @@
+"""Load test of the whole update loop against a local fake Etsy and an in-memory Adafruit IO
+
+Starts a fake Etsy server with hundreds of simulated shops, builds an AIOEtsyStats for each one sharing a publisher
+like MultiShopRunner does, and runs ``collect_and_publish`` for every shop for a number of rounds on a thread pool.
+Reports end-to-end throughput, update latency percentiles and the Etsy and AIO calls made. Synthetic shops make a
+known number of sales, and the exit code is 1 if the clients counted a different number of orders.
+
+Run from the repository root so the package is importable::
+
+    python -m benchmarks.bench_load
+    python -m benchmarks.bench_load --shops 500 --rounds 10 --workers 16 --etsy-latency-ms 200 --aio-latency-ms 50
+    python -m benchmarks.bench_load --pages recorded/ --json results.json
+
+``--pages`` replays recorded pages instead, one subdirectory of ``*.html`` files per shop served in name order.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from typing import List
+
+from benchmarks.bench_parsing import percentile
+from benchmarks.fakes import FakeAIOClient, FakeEtsyServer, RecordedShop, SimulatedShop
+
+
+def build_shops(args) -> List:
+    if args.pages:
+        return [RecordedShop.from_directory(path) for path in sorted(Path(args.pages).iterdir()) if path.is_dir()]
+    return [SimulatedShop(name=f"LoadTestShop{index:04d}", seed=args.seed + index, sale_rate=args.sale_rate,
+                          favorite_rate=args.favorite_rate) for index in range(args.shops)]
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shops", type=int, default=200, help="Number of synthetic shops")
+    parser.add_argument("--pages", default=None, help="Replay recorded pages from this directory instead")
+    parser.add_argument("--rounds", type=int, default=5, help="Updates of every shop, the first one only seeds")
+    parser.add_argument("--workers", type=int, default=8, help="Shops updated at once")
+    parser.add_argument("--sale-rate", type=float, default=0.3, help="Chance of a sale between two scrapes")
+    parser.add_argument("--favorite-rate", type=float, default=0.5, help="Chance of a favorite between two scrapes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--etsy-latency-ms", type=float, default=0, help="Added to every fake Etsy response")
+    parser.add_argument("--aio-latency-ms", type=float, default=0, help="Added to every fake AIO call")
+    parser.add_argument("--aio-rate-per-minute", type=float, default=600000,
+                        help="Publisher rate limit. 30 is a free AIO account")
+    parser.add_argument("--parser-engine", default="auto")
+    parser.add_argument("--state-dir", default=None, help="Keep local state here instead of a temporary directory")
+    parser.add_argument("--verbose", action="store_true", help="Show the clients' logs")
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    from aio_etsy_stats import main as aio_etsy_stats_main
+    from aio_etsy_stats.main import AIOEtsyStats
+    from aio_etsy_stats.publisher import AIOPublisher
+
+    shops = build_shops(args)
+    server = FakeEtsyServer(shops, latency_seconds=args.etsy_latency_ms / 1000).start()
+    aio_etsy_stats_main.PUBLIC_IP_URL = f"{server.url}/ip"
+    aio = FakeAIOClient(latency_seconds=args.aio_latency_ms / 1000)
+    publisher = AIOPublisher(client=aio, rate_per_minute=args.aio_rate_per_minute, max_pending=len(shops) * 16)
+    # Far from now so a daily reset doesn't clear the order counts mid run
+    reset_hour = (datetime.now().hour + 12) % 24
+
+    temp_dir = tempfile.TemporaryDirectory() if not args.state_dir else None
+    state_dir = args.state_dir or temp_dir.name
+    output = sys.stdout if args.verbose else open(os.devnull, "w")
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="load")
+
+    def build_client(shop) -> AIOEtsyStats:
+        return AIOEtsyStats(shop=shop.name, default_reset_hour=reset_hour, fetch_mode="http",
+                            parser_engine=args.parser_engine, aio_client=aio, aio_publisher=publisher,
+                            state_dir=state_dir, etsy_base_url=server.url)
+
+    def update(client: AIOEtsyStats) -> float:
+        start = perf_counter()
+        client.collect_and_publish()
+        return perf_counter() - start
+
+    # The clients' stdout handlers are bound to whatever stdout is when they are built
+    start = perf_counter()
+    with redirect_stdout(output):
+        clients = list(executor.map(build_client, shops))
+    setup_seconds = perf_counter() - start
+    print(f"Built {len(clients)} clients in {setup_seconds:.2f}s against {server.url}")
+
+    latencies = []
+    rounds = []
+    for round_number in range(1, args.rounds + 1):
+        start = perf_counter()
+        round_latencies = list(executor.map(update, clients))
+        rounds.append(perf_counter() - start)
+        latencies.extend(round_latencies)
+        print(f"Round {round_number}: {len(clients)} updates in {rounds[-1]:.2f}s, "
+              f"slowest {max(round_latencies) * 1000:.1f}ms")
+
+    start = perf_counter()
+    flushed = publisher.flush(timeout=300)
+    drain_seconds = perf_counter() - start
+
+    latencies.sort()
+    update_seconds = sum(rounds)
+    scripted = [shop.scripted_sales for shop in shops]
+    expected_orders = sum(scripted) if None not in scripted else None
+    counted_orders = sum(client.daily_order_count for client in clients)
+    results = {
+        "shops": len(clients),
+        "rounds": args.rounds,
+        "workers": args.workers,
+        "updates": len(latencies),
+        "setup-seconds": round(setup_seconds, 3),
+        "update-seconds": round(update_seconds, 3),
+        "updates-per-second": round(len(latencies) / update_seconds, 1) if update_seconds else None,
+        "p50-ms": round(percentile(latencies, 50) * 1000, 2),
+        "p90-ms": round(percentile(latencies, 90) * 1000, 2),
+        "p99-ms": round(percentile(latencies, 99) * 1000, 2),
+        "max-ms": round(latencies[-1] * 1000, 2) if latencies else None,
+        "publisher-drain-seconds": round(drain_seconds, 3),
+        "publisher-drained": flushed,
+        "etsy-requests": sum(shop.requests for shop in shops),
+        "aio-calls": dict(sorted(aio.calls.items())),
+        "aio-data-points": aio.data_points,
+        "publisher": dict(publisher.counts),
+        "expected-orders": expected_orders,
+        "counted-orders": counted_orders,
+    }
+
+    print()
+    print(f"{results['updates']} updates of {results['shops']} shops on {results['workers']} workers: "
+          f"{results['updates-per-second']} updates/s")
+    print(f"Update latency p50 {results['p50-ms']}ms, p90 {results['p90-ms']}ms, p99 {results['p99-ms']}ms, "
+          f"max {results['max-ms']}ms")
+    print(f"Publisher drained in {results['publisher-drain-seconds']}s: "
+          f"{', '.join(f'{key} {value}' for key, value in results['publisher'].items())}")
+    print(f"Etsy requests {results['etsy-requests']}, AIO data points {results['aio-data-points']}, AIO calls: "
+          f"{', '.join(f'{key} {value}' for key, value in results['aio-calls'].items())}")
+    if expected_orders is not None:
+        print(f"Orders counted {counted_orders} of {expected_orders} scripted")
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    executor.shutdown()
+    publisher.close()
+    server.stop()
+    if expected_orders is not None and counted_orders != expected_orders:
+        print(f"Counted {counted_orders} orders but {expected_orders} were scripted", file=sys.stderr)
+        return 1
+    return 0 if flushed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""Offline benchmark and regression check for the parsing half of scrape_etsy_stats
+
+Feeds the saved /sold page fixtures through each parser engine, optionally padded with extra listing cards to
+simulate larger pages, and reports latency percentiles, peak RSS and peak traced allocations per engine. The
+extracted EtsyStoreStats are compared against fixtures/expected.json and the exit code is 1 on any mismatch.
+
+Run from the repository root so the package is importable::
+
+    python -m benchmarks.bench_parsing
+    python -m benchmarks.bench_parsing --engines fast,soup --sizes 0,2048 --iterations 20 --json results.json
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from time import perf_counter
+from typing import List
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+LISTING_CARD = """
+    <div class="js-merch-stash-check-listing v2-listing-card" data-listing-id="{listing_id}" data-shop-id="48213377">
+        <a class="listing-link" href="https://www.etsy.com/listing/{listing_id}/sold-item-{index}" title="Sold Item {index}">
+            <div class="v2-listing-card__img"><img src="https://i.etsystatic.com/il/{listing_id}/il_340x270.jpg" alt=""></div>
+            <h3 class="v2-listing-card__title">Sold Item {index} (Handmade)</h3>
+            <span class="currency-value">{price}</span>
+        </a>
+        <script type="text/javascript">window.listingData = {{"listing_id":{listing_id},"price":"{price}"}};</script>
+    </div>"""
+
+
+def inflate(page: str, size_kb: int) -> str:
+    """Pads the page with listing cards before </body> until it is about size_kb kilobytes"""
+    if size_kb <= 0 or len(page) >= size_kb * 1024:
+        return page
+
+    cards = []
+    total = len(page)
+    index = 0
+    while total < size_kb * 1024:
+        card = LISTING_CARD.format(listing_id=1000000000 + index, index=index, price=f"{(index % 90) + 9}.99")
+        cards.append(card)
+        total += len(card)
+        index += 1
+
+    head, _, tail = page.rpartition("</body>")
+    return f"{head}{''.join(cards)}\n</body>{tail}"
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def max_rss_kb() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss  # macOS reports bytes, Linux kilobytes
+
+
+def run_case(fixture: str, size_kb: int, engine: str, iterations: int) -> dict:
+    """Runs in a fresh process so peak RSS belongs to this engine and page only"""
+    import logging
+    from aio_etsy_stats.parsing import extract_stats
+
+    logger = logging.getLogger("bench")
+    logger.disabled = True  # The soup path logs a warning with the whole page when it fails
+
+    page = inflate((FIXTURES_DIR / fixture).read_text(encoding="utf-8"), size_kb)
+    baseline_rss = max_rss_kb()
+
+    stats = extract_stats(page, engine=engine, logger=logger)  # Warm up imports and regex caches
+    latencies = []
+    for _ in range(iterations):
+        start = perf_counter()
+        extract_stats(page, engine=engine, logger=logger)
+        latencies.append((perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    extract_stats(page, engine=engine, logger=logger)
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "fixture": fixture,
+        "size-kb": round(len(page) / 1024),
+        "engine": engine,
+        "p50-ms": round(percentile(latencies, 50), 3),
+        "p90-ms": round(percentile(latencies, 90), 3),
+        "p99-ms": round(percentile(latencies, 99), 3),
+        "peak-rss-kb": max_rss_kb(),
+        "rss-growth-kb": max_rss_kb() - baseline_rss,
+        "peak-alloc-kb": round(peak_traced / 1024),
+        "stats": stats._asdict(),
+    }
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--engines", default="fast,soup,auto", help="Comma separated parser engines")
+    parser.add_argument("--sizes", default="0,1024,4096",
+                        help="Comma separated page sizes in KB. 0 uses the fixture as saved")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--fixtures", default=None, help="Only run these comma separated fixture files")
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    expected = json.loads((FIXTURES_DIR / "expected.json").read_text(encoding="utf-8"))
+    fixtures = args.fixtures.split(",") if args.fixtures else list(expected)
+    engines = args.engines.split(",")
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    results = []
+    failures = []
+    context = multiprocessing.get_context("spawn")
+    for fixture in fixtures:
+        for size_kb in sizes:
+            for engine in engines:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(run_case, fixture, size_kb, engine, args.iterations).result()
+                result["correct"] = result["stats"] == expected[fixture]
+                if not result["correct"]:
+                    failures.append(result)
+                results.append(result)
+
+    header = f"{'fixture':<32} {'KB':>6} {'engine':<6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} " \
+             f"{'RSS KB':>9} {'+RSS KB':>8} {'alloc KB':>9}  ok"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(f"{result['fixture']:<32} {result['size-kb']:>6} {result['engine']:<6} {result['p50-ms']:>9} "
+              f"{result['p90-ms']:>9} {result['p99-ms']:>9} {result['peak-rss-kb']:>9} "
+              f"{result['rss-growth-kb']:>8} {result['peak-alloc-kb']:>9}  {'yes' if result['correct'] else 'NO'}")
+
+    for failure in failures:
+        print(f"\n{failure['fixture']} ({failure['size-kb']} KB, {failure['engine']}) extracted "
+              f"{failure['stats']}\n  expected {expected[failure['fixture']]}", file=sys.stderr)
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
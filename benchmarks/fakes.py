@@ -0,0 +1,293 @@
+"""Local stand-ins for Etsy and Adafruit IO so AIOEtsyStats can run without the network
+
+``FakeEtsyServer`` serves ``/shop/<name>/sold`` pages on localhost. Synthetic shops render a page modelled on the saved
+fixtures and change their stats on every request after the first, following a seeded random script, so the number of
+sales that should be counted is known. Recorded shops replay saved pages in order. ``FakeAIOClient`` keeps feeds in
+memory and counts every call.
+"""
+import random
+import re
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import sleep
+from typing import Dict, List, NamedTuple, Optional
+
+from Adafruit_IO.errors import RequestError
+from Adafruit_IO.model import Data, Feed, Group
+
+SOLD_PATH_PATTERN = re.compile(r"^/shop/([^/?]+)/sold/?(?:\?.*)?$")
+SOLD_PAGE_LISTINGS = 24  # Sales shown on the first page of /sold
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="en-US">
+<head>
+    <meta charset="utf-8">
+    <title>Etsy :: Sold Items | {shop}</title>
+    <script type="text/javascript">
+        window.Etsy.Shop = {{"shop_id":{shop_id},"shop_name":"{shop}","num_favorers":{favorite_count},"is_vacation":false}};
+    </script>
+</head>
+<body class="ui-toolkit">
+<div id="content">
+    <div class="shop-home-wider-sections">
+        <div class="wt-display-flex-xs wt-align-items-center condensed-header-shop-image wt-mr-xs-2">
+            <a href="https://www.etsy.com/shop/{shop}">
+                <img class="wt-rounded wt-display-block" src="https://i.etsystatic.com/isla/{shop_id}/isla_75x75.jpg" alt="{shop}">
+            </a>
+        </div>
+        <div class="wt-display-flex-xs wt-align-items-center">
+            <span class="wt-display-inline-flex-xs wt-align-items-center">
+                <input type="hidden" name="rating" value="{rating:.4f}">
+            </span>
+            <span class="wt-text-caption wt-text-gray">({rating_count})</span>
+        </div>
+        <div class="wt-text-caption">
+            <span class="wt-text-caption">{sold_count:,} Sales</span>
+        </div>
+    </div>
+    <div class="listing-grid">{listing_cards}
+    </div>
+</div>
+</body>
+</html>"""
+
+LISTING_CARD = """
+        <div class="js-merch-stash-check-listing v2-listing-card" data-listing-id="{listing_id}" data-shop-id="{shop_id}">
+            <a class="listing-link" href="https://www.etsy.com/listing/{listing_id}/item" title="Item {listing_id}">
+                <h3 class="v2-listing-card__title">Item {listing_id}</h3>
+            </a>
+        </div>"""
+
+
+class SimulatedShop:
+    """A synthetic shop whose stats change on every request after the first one"""
+
+    def __init__(self, name: str, seed: int, sale_rate: float = 0.3, favorite_rate: float = 0.5,
+                 review_rate: float = 0.05):
+        self.name = name
+        self.sale_rate = sale_rate
+        self.favorite_rate = favorite_rate
+        self.review_rate = review_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.shop_id = 40000000 + seed
+        self.catalog = [str(1500000000 + seed * 1000 + index) for index in range(self._random.randint(3, 40))]
+        self.favorite_count = self._random.randint(0, 5000)
+        self.rating_count = self._random.randint(1, 500)
+        self.rating = round(self._random.uniform(4.0, 5.0), 4)
+        self.sold_count = self._random.randint(SOLD_PAGE_LISTINGS, 20000)
+        self.sold_listing_ids: List[str] = [self._random.choice(self.catalog) for _ in range(SOLD_PAGE_LISTINGS)]
+
+        self.requests = 0
+        self.scripted_sales = 0  # Sales made after the first page was served, which the client should count
+
+    def _advance(self) -> None:
+        if self._random.random() < self.sale_rate:
+            self.sold_count += 1
+            self.scripted_sales += 1
+            self.sold_listing_ids.insert(0, self._random.choice(self.catalog))
+            del self.sold_listing_ids[SOLD_PAGE_LISTINGS:]
+        if self._random.random() < self.favorite_rate:
+            self.favorite_count += self._random.choice((1, 1, 1, -1))
+        if self._random.random() < self.review_rate:
+            stars = self._random.choice((5, 5, 5, 4, 3))
+            self.rating = round((self.rating * self.rating_count + stars) / (self.rating_count + 1), 4)
+            self.rating_count += 1
+
+    def page(self) -> str:
+        with self._lock:
+            if self.requests:
+                self._advance()
+            self.requests += 1
+            cards = "".join(LISTING_CARD.format(listing_id=listing_id, shop_id=self.shop_id)
+                            for listing_id in self.sold_listing_ids)
+            return PAGE_TEMPLATE.format(shop=self.name, shop_id=self.shop_id, favorite_count=self.favorite_count,
+                                        rating=self.rating, rating_count=self.rating_count,
+                                        sold_count=self.sold_count, listing_cards=cards)
+
+
+class RecordedShop:
+    """Replays saved pages in order, repeating the last one once they run out"""
+
+    def __init__(self, name: str, pages: List[str]):
+        self.name = name
+        self.pages = pages
+        self.requests = 0
+        self.scripted_sales = None  # Unknown for recorded pages
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_directory(cls, directory: Path) -> "RecordedShop":
+        return cls(name=directory.name, pages=[path.read_text(encoding="utf-8")
+                                               for path in sorted(directory.glob("*.html"))])
+
+    def page(self) -> str:
+        with self._lock:
+            page = self.pages[min(self.requests, len(self.pages) - 1)]
+            self.requests += 1
+            return page
+
+
+class _EtsyHandler(BaseHTTPRequestHandler):
+    server: "FakeEtsyServer"
+
+    def do_GET(self):
+        if self.server.latency_seconds:
+            sleep(self.server.latency_seconds)
+        if self.path == "/ip":
+            self._respond(200, "127.0.0.1", "text/plain")
+            return
+
+        found = SOLD_PATH_PATTERN.match(self.path)
+        shop = self.server.shops.get(found[1].lower()) if found else None
+        if shop is None:
+            self._respond(404, "<html><title>Not Found</title></html>")
+            return
+        self._respond(200, shop.page())
+
+    def _respond(self, status: int, body: str, content_type: str = "text/html; charset=utf-8") -> None:
+        encoded = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeEtsyServer(ThreadingHTTPServer):
+    """Serves the shops' /sold pages, and /ip in place of ipify, from a daemon thread"""
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, shops: List, host: str = "127.0.0.1", port: int = 0, latency_seconds: float = 0.0):
+        super().__init__((host, port), _EtsyHandler)
+        self.shops: Dict[str, object] = {shop.name.lower(): shop for shop in shops}
+        self.latency_seconds = latency_seconds
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-etsy", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeEtsyServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class _Response(NamedTuple):
+    """Enough of a requests response for RequestError to describe it"""
+    status_code: int
+    reason: str
+
+    def json(self) -> dict:
+        return {"error": self.reason}
+
+
+class FakeAIOClient:
+    """In-memory Adafruit IO with the calls AIOEtsyStats and AIOPublisher make
+
+    ``calls`` counts requests by method and ``data_points`` counts values written, which is what AIO rate limits.
+    """
+
+    def __init__(self, username: str = "load-test", latency_seconds: float = 0.0):
+        self.username = username
+        self.latency_seconds = latency_seconds
+        self.calls = Counter()
+        self.data_points = 0
+        self._lock = threading.Lock()
+        self._groups: Dict[str, Dict[str, Optional[str]]] = {}
+
+    def _call(self, method: str) -> None:
+        with self._lock:
+            self.calls[method] += 1
+        if self.latency_seconds:
+            sleep(self.latency_seconds)
+
+    @staticmethod
+    def _split(feed: str):
+        group_key, _, feed_key = feed.rpartition(".")
+        return group_key or "default", feed_key
+
+    def _write(self, group_key: str, feed_key: str, value) -> None:
+        with self._lock:
+            self._groups.setdefault(group_key, {})[feed_key] = str(value)
+            self.data_points += 1
+
+    def _get(self, path: str) -> dict:
+        self._call("get")
+        group_key = path[len("groups/"):]
+        with self._lock:
+            feeds = self._groups.get(group_key)
+            if not path.startswith("groups/") or feeds is None:
+                raise RequestError(_Response(404, "Not Found"))
+            return {"key": group_key, "name": group_key, "feeds": [
+                {"key": f"{group_key}.{key}", "last_value": value} for key, value in feeds.items()]}
+
+    def _post(self, path: str, data: dict) -> list:
+        self._call("post")
+        group_key = path[len("groups/"):-len("/data")]
+        for feed in data["feeds"]:
+            self._write(group_key, feed["key"], feed["value"])
+        return []
+
+    def create_group(self, group: Group) -> Group:
+        self._call("create_group")
+        with self._lock:
+            self._groups.setdefault(group.key, {})
+        return group
+
+    def create_feed(self, feed: Feed, group_key: str = None) -> Feed:
+        self._call("create_feed")
+        with self._lock:
+            self._groups.setdefault(group_key or "default", {}).setdefault(feed.key, None)
+        return feed
+
+    def groups(self, group: str = None):
+        self._call("groups")
+        with self._lock:
+            if group is not None:
+                if group not in self._groups:
+                    raise RequestError(_Response(404, "Not Found"))
+                return Group(name=group, key=group)
+            return [Group(name=key, key=key) for key in self._groups]
+
+    def feeds(self, feed: str = None):
+        self._call("feeds")
+        with self._lock:
+            keys = [f"{group_key}.{key}" for group_key, feeds in self._groups.items() for key in feeds]
+        if feed is not None:
+            if feed not in keys:
+                raise RequestError(_Response(404, "Not Found"))
+            return Feed(name=feed, key=feed)
+        return [Feed(name=key, key=key) for key in keys]
+
+    def send_data(self, feed: str, value, metadata=None, precision=None) -> Data:
+        self._call("send_data")
+        self._write(*self._split(feed), value)
+        return Data(value=str(value))
+
+    def receive(self, feed: str) -> Data:
+        self._call("receive")
+        group_key, feed_key = self._split(feed)
+        with self._lock:
+            value = self._groups.get(group_key, {}).get(feed_key)
+        if value is None:
+            raise RequestError(_Response(404, "Not Found"))
+        return Data(value=value)
+
+    def value(self, feed: str) -> Optional[str]:
+        """Current value of a feed without counting it as a call"""
+        group_key, feed_key = self._split(feed)
+        with self._lock:
+            return self._groups.get(group_key, {}).get(feed_key)
@@ -0,0 +1,27 @@
+import pytest
+
+from aio_etsy_stats import cli, main
+
+
+def test_run_without_shops_is_an_error(monkeypatch, capsys):
+    monkeypatch.delenv("ETSY_STORE_NAME", raising=False)
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main(["run"])
+    assert exit_info.value.code == 2
+    assert "ETSY_STORE_NAME or pass --shop" in capsys.readouterr().err
+
+
+def test_run_shop_overrides_the_environment(monkeypatch):
+    started = []
+
+    class Client:
+        def __init__(self, shop, **kwargs):
+            self.shop = shop
+
+        def main(self):
+            started.append(self.shop)
+
+    monkeypatch.setenv("ETSY_STORE_NAME", "fromenv")
+    monkeypatch.setattr(main, "AIOEtsyStats", Client)
+    assert cli.main(["run", "--shop", "fromargs"]) == 0
+    assert started == ["fromargs"]
@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from aio_etsy_stats.history import HistoryStore, window_end, window_start
+from aio_etsy_stats.parsing import EtsyStoreStats
+
+
+@pytest.fixture
+def history(tmp_path):
+    store = HistoryStore(path=str(tmp_path / "history.db"))
+    yield store
+    store.close()
+
+
+def stats(sold_count=None, rating=None):
+    return EtsyStoreStats(favorite_count=50, rating=rating, rating_count=20, sold_count=sold_count)
+
+
+def test_hourly_and_daily_rollups(history):
+    history.record("Shop", stats(sold_count=100, rating=4.9), timestamp=datetime(2026, 6, 1, 10))
+    history.record("shop", stats(sold_count=101, rating=4.7), timestamp=datetime(2026, 6, 1, 10, 30))
+    history.record("shop", stats(sold_count=104, rating=4.8), timestamp=datetime(2026, 6, 1, 11, 15))
+
+    first_hour, second_hour = history.rollups("shop", "hour")
+    assert (first_hour.bucket_start, first_hour.samples) == (datetime(2026, 6, 1, 10), 2)
+    assert (first_hour.opening.sold_count, first_hour.closing.sold_count) == (100, 101)
+    assert (first_hour.min_rating, first_hour.max_rating) == (4.7, 4.9)
+    # The next hour opens with the sample before it, so the change between scrapes isn't lost
+    assert (second_hour.opening.sold_count, second_hour.closing.sold_count) == (101, 104)
+    assert second_hour.sold_delta == 3
+
+    day, = history.rollups("shop", "day")
+    assert (day.bucket_start, day.samples) == (datetime(2026, 6, 1), 3)
+    assert day.sold_delta == 4
+    assert round(day.rating_delta, 4) == -0.1
+    assert (day.min_rating, day.max_rating) == (4.7, 4.9)
+
+
+def test_missing_stat_keeps_the_last_value(history):
+    history.record("shop", stats(sold_count=100), timestamp=datetime(2026, 6, 1, 10))
+    history.record("shop", stats(), timestamp=datetime(2026, 6, 1, 10, 30))
+
+    hour, = history.rollups("shop", "hour")
+    assert hour.closing.sold_count == 100
+    assert hour.sold_delta == 0
+    assert hour.rating_delta is None
+
+
+def test_rollups_in_range(history):
+    for hour in range(10, 14):
+        history.record("shop", stats(sold_count=hour), timestamp=datetime(2026, 6, 1, hour, 5))
+
+    rollups = history.rollups("shop", "hour", start=datetime(2026, 6, 1, 11), end=datetime(2026, 6, 1, 13))
+    assert [rollup.bucket_start.hour for rollup in rollups] == [11, 12]
+    with pytest.raises(ValueError):
+        history.rollups("shop", "week")
+
+
+@pytest.mark.parametrize("kind, timestamp, start, end", [
+    ("daily", datetime(2026, 6, 1, 13, 59), datetime(2026, 5, 31, 14), datetime(2026, 6, 1, 14)),
+    ("daily", datetime(2026, 6, 1, 14), datetime(2026, 6, 1, 14), datetime(2026, 6, 2, 14)),
+    ("weekly", datetime(2026, 6, 3, 9), datetime(2026, 6, 1, 14), datetime(2026, 6, 8, 14)),
+    ("weekly", datetime(2026, 6, 1, 9), datetime(2026, 5, 25, 14), datetime(2026, 6, 1, 14)),
+    ("monthly", datetime(2026, 6, 15), datetime(2026, 6, 1, 14), datetime(2026, 7, 1, 14)),
+    ("monthly", datetime(2026, 12, 31, 20), datetime(2026, 12, 1, 14), datetime(2027, 1, 1, 14)),
+])
+def test_window_boundaries(kind, timestamp, start, end):
+    assert window_start(kind, 14, timestamp) == start
+    assert window_end(kind, start) == end
+
+
+def test_reset_windows_close_at_the_reset_hour(history):
+    # Sunday the 31st, then the reset on Monday the 1st that closes the day, the week and the month
+    for timestamp, sold_count in [(datetime(2026, 5, 31, 13), 100), (datetime(2026, 5, 31, 15), 102),
+                                  (datetime(2026, 6, 1, 13, 30), 105), (datetime(2026, 6, 1, 14, 30), 107)]:
+        history.record("shop", stats(sold_count=sold_count), timestamp=timestamp)
+
+    reset = datetime(2026, 6, 1, 14)
+    windows = history.reset_windows("shop", 14, start=datetime(2026, 5, 31), end=datetime(2026, 6, 2))
+    assert [(window.bucket_start, window.sold_delta) for window in windows["daily"]] == [
+        (datetime(2026, 5, 30, 14), 0), (datetime(2026, 5, 31, 14), 5), (reset, 2)]
+    for kind in ("weekly", "monthly"):
+        closed, opened = windows[kind]
+        assert (closed.opening.sold_count, closed.closing.sold_count) == (100, 105)
+        assert (opened.bucket_start, opened.sold_delta) == (reset, 2)
+
+    # Only the windows that closed at the reset, which is what the reset asks for
+    closed = history.reset_windows("shop", 14, start=reset - timedelta(microseconds=1), end=reset, kinds=["daily"])
+    assert list(closed) == ["daily"]
+    assert [window.sold_delta for window in closed["daily"]] == [5]
+    assert history.reset_windows("shop", 14, start=reset, end=reset, kinds=[]) == {}
+
+
+def test_prune_keeps_rollups(history):
+    history.record("shop", stats(sold_count=100), timestamp=datetime.now() - timedelta(days=3))
+    history.record("shop", stats(sold_count=101), timestamp=datetime.now())
+
+    assert history.prune("shop", older_than=timedelta(days=1)) == 1
+    assert len(history.samples("shop")) == 1
+    assert len(history.rollups("shop", "day")) == 2
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from aio_etsy_stats import leases, state_store
+from aio_etsy_stats.leases import LeaseCoordinator, LeaseLost, rendezvous_owner
+from aio_etsy_stats.state_store import ShopState, StateStore
+
+SHOPS = [f"shop{number}" for number in range(8)]
+
+
+class FakeDatetime(datetime):
+    current = datetime(2026, 6, 1, 12)
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    monkeypatch.setattr(leases, "datetime", FakeDatetime)
+    monkeypatch.setattr(state_store, "datetime", FakeDatetime)
+    monkeypatch.setattr(FakeDatetime, "current", datetime(2026, 6, 1, 12))
+    return FakeDatetime
+
+
+@pytest.fixture
+def nodes(tmp_path, clock):
+    path = str(tmp_path / "state.db")
+    coordinators = [LeaseCoordinator(path, node_id=node_id, lease_seconds=60) for node_id in ("node-a", "node-b")]
+    store = StateStore(path)
+    yield coordinators, store
+    for coordinator in coordinators:
+        coordinator.close()
+    store.close()
+
+
+def test_first_node_takes_every_shop(nodes):
+    (node_a, _), store = nodes
+    held = node_a.rebalance(SHOPS)
+    assert sorted(held) == SHOPS
+    assert all(lease.token == 1 and lease.held() for lease in held.values())
+
+    # Renewing keeps the token, so the node's own writes aren't fenced off
+    assert {shop: lease.token for shop, lease in node_a.rebalance(SHOPS).items()} == dict.fromkeys(SHOPS, 1)
+    store.save("shop0", ShopState(sold_count=1), lease=held["shop0"])
+    assert store.load("shop0").sold_count == 1
+
+
+def test_joining_node_takes_over_its_shops(nodes):
+    (node_a, node_b), store = nodes
+    old_leases = node_a.rebalance(SHOPS)
+    moving = [shop for shop in SHOPS if rendezvous_owner(shop, ["node-a", "node-b"]) == "node-b"]
+    assert 0 < len(moving) < len(SHOPS)
+
+    # Still leased to node-a, so node-b waits for node-a to let them go
+    assert node_b.rebalance(SHOPS) == {}
+    assert sorted(node_a.rebalance(SHOPS)) == [shop for shop in SHOPS if shop not in moving]
+    taken = node_b.rebalance(SHOPS)
+    assert sorted(taken) == moving
+    assert all(lease.token == 2 for lease in taken.values())
+
+    shop = moving[0]
+    assert not old_leases[shop].held()
+    with pytest.raises(LeaseLost):
+        store.save(shop, ShopState(sold_count=1), lease=old_leases[shop])
+    store.save(shop, ShopState(sold_count=2), lease=taken[shop])
+    assert store.load(shop).sold_count == 2
+
+
+def test_expired_leases_are_taken_over(nodes, clock):
+    (node_a, node_b), store = nodes
+    old_leases = node_a.rebalance(SHOPS)
+
+    # node-a stops heartbeating, and its leases aren't taken before they run out
+    clock.current += timedelta(seconds=30)
+    assert node_b.rebalance(SHOPS) == {}
+    clock.current += timedelta(seconds=31)
+    taken = node_b.rebalance(SHOPS)
+    assert sorted(taken) == SHOPS
+    assert all(lease.token == 2 for lease in taken.values())
+
+    # node-a comes back with its old tokens and can't write over node-b
+    assert not old_leases["shop0"].held()
+    with pytest.raises(LeaseLost):
+        store.save("shop0", ShopState(sold_count=1), lease=old_leases["shop0"])
+    assert store.load("shop0") is None
+
+
+def test_release_all_hands_shops_over_right_away(nodes):
+    (node_a, node_b), _ = nodes
+    old_leases = node_a.rebalance(SHOPS)
+    node_a.release_all()
+
+    assert not any(lease.held() for lease in old_leases.values())
+    assert sorted(node_b.rebalance(SHOPS)) == SHOPS
@@ -0,0 +1,148 @@
+import atexit
+from datetime import datetime, timedelta
+
+import pytest
+import requests
+
+from aio_etsy_stats import main, resilience
+from aio_etsy_stats.main import AIOEtsyStats
+from aio_etsy_stats.parsing import EtsyStoreStats
+from aio_etsy_stats.publisher import AIOPublisher
+from benchmarks.fakes import FakeAIOClient
+
+SHOP = "testshop"
+
+
+class OutageAIOClient(FakeAIOClient):
+    """Fails every request with a connection error while ``down``"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.down = False
+
+    def _call(self, method: str) -> None:
+        super()._call(method)
+        if self.down:
+            raise requests.ConnectionError("AIO is down")
+
+
+def shop_stats(sold_count: int) -> EtsyStoreStats:
+    return EtsyStoreStats(favorite_count=50, rating=4.9, rating_count=20, sold_count=sold_count, avatar_url="a.jpg")
+
+
+@pytest.fixture
+def aio():
+    client = OutageAIOClient()
+    # What an earlier run on another host left in AIO, partway through its day
+    reset_datetime = (datetime.now() + timedelta(hours=6)).replace(minute=0, second=0, microsecond=0)
+    reset_timestamp = reset_datetime.timestamp()
+    for feed, value in [("daily-order-count", 7), ("favorite-count", 50), ("rating", 4.9), ("rating-count", 20),
+                        ("sold-count", 95), ("reset-hour", reset_datetime.hour),
+                        ("starting-stats", {"starting-favorite-count": 48, "starting-rating": 4.9,
+                                            "starting-rating-count": 20, "starting-sold-count": 88,
+                                            "reset-timestamp": reset_timestamp})]:
+        client._write(SHOP, feed, value)
+    return client
+
+
+@pytest.fixture
+def make_client(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "get_public_ip", lambda timeout=None: "127.0.0.1")
+    monkeypatch.setattr(resilience, "_breakers", {})
+    clients = []
+
+    def make(aio: FakeAIOClient, **kwargs) -> AIOEtsyStats:
+        publisher = AIOPublisher(client=aio, rate_per_minute=600000, backoff_seconds=0.01)
+        client = AIOEtsyStats(shop=SHOP, fetch_mode="http", aio_client=aio, aio_publisher=publisher,
+                              state_dir=str(tmp_path), breaker_reset_seconds=0, **kwargs)
+        clients.append((client, publisher))
+        return client
+
+    yield make
+    for client, publisher in clients:
+        atexit.unregister(client._atexit)
+        client._atexit()
+        publisher.close()
+
+
+def test_aio_outage_on_first_start_keeps_aio_counters(aio, make_client):
+    aio.down = True
+    client = make_client(aio)
+    assert client._state_store.load(SHOP).seeded is False
+
+    # Orders still count while AIO can't be read, but nothing is sent over the counters kept there
+    client.process_stats(shop_stats(sold_count=100))
+    client.process_stats(shop_stats(sold_count=102))
+    assert client.daily_order_count == 2
+    assert aio.value(f"{SHOP}.daily-order-count") == "7"
+
+    aio.down = False
+    client.begin_update()
+    assert client._state_store.load(SHOP).seeded is True
+    assert client.daily_order_count == 9
+    assert client.starting_sold_count == 88
+    assert client.sold_count == 102
+    assert client._aio_publisher.flush(timeout=5)
+    assert aio.value(f"{SHOP}.daily-order-count") == "9"
+    assert aio.value(f"{SHOP}.sold-count") == "102"
+
+
+def test_restart_after_an_outage_loads_aio_counters(aio, make_client):
+    aio.down = True
+    make_client(aio)
+
+    aio.down = False
+    client = make_client(aio)
+    assert client.daily_order_count == 7
+    assert client.starting_sold_count == 88
+    assert client._state_store.load(SHOP).seeded is True
+
+
+class FakeDatetime(datetime):
+    current = None
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+@pytest.mark.parametrize("first_scrape, reset_time, closing_kinds", [
+    # A Sunday, so only the day closes
+    (datetime(2026, 5, 31, 10, 17, 23, 456789), datetime(2026, 5, 31, 14, 5), ["daily"]),
+    # The reset on Monday the 1st closes the week and the month too
+    (datetime(2026, 6, 1, 9, 41, 7, 123), datetime(2026, 6, 1, 14, 5), ["daily", "weekly", "monthly"]),
+])
+def test_reset_closes_windows(first_scrape, reset_time, closing_kinds, tmp_path, monkeypatch, request):
+    monkeypatch.setattr(main, "get_public_ip", lambda timeout=None: "127.0.0.1")
+    monkeypatch.setattr(main, "datetime", FakeDatetime)
+    FakeDatetime.current = first_scrape
+    client = AIOEtsyStats(shop=SHOP, fetch_mode="http", default_reset_hour=14, state_dir=str(tmp_path))
+    atexit.unregister(client._atexit)
+    request.addfinalizer(client._atexit)
+    # The first reset is at the reset hour on the dot, not at the second the client started
+    assert client.reset_datetime == datetime(first_scrape.year, first_scrape.month, first_scrape.day, 14)
+
+    history_windows = client._history_windows
+    closed_kinds = []
+
+    def record_closing(start, end, kinds):
+        if end == client.reset_datetime:
+            closed_kinds.extend(kinds)
+        return history_windows(start=start, end=end, kinds=kinds)
+
+    messages = []
+    monkeypatch.setattr(client, "_history_windows", record_closing)
+    client.notify_hook = lambda level, message: messages.append(message)
+
+    client.process_stats(shop_stats(sold_count=100))
+    FakeDatetime.current = first_scrape + timedelta(hours=1)
+    client.process_stats(shop_stats(sold_count=103))
+    FakeDatetime.current = reset_time
+    client.process_stats(shop_stats(sold_count=104))
+
+    assert closed_kinds == closing_kinds
+    reset_message = next(message for message in messages if "has passed" in message)
+    assert "Daily Sold was **3**" in reset_message
+    for kind in ("weekly", "monthly"):
+        assert (f"{kind.capitalize()} was" in reset_message) is (kind in closing_kinds)
+    assert client.reset_datetime == reset_time.replace(hour=14, minute=0) + timedelta(days=1)
@@ -0,0 +1,69 @@
+import logging
+
+import pytest
+import requests
+
+from aio_etsy_stats.notifications import QueuedDiscordHandler
+
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = {}
+        self.text = "Bad Request" if status_code == 400 else ""
+
+    def json(self) -> dict:
+        return {}
+
+
+class FakeSession:
+    """Answers each post with the next status code, or raises it if it is an exception"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.posts = []
+
+    def post(self, url, json=None, timeout=None):
+        self.posts.append(json)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return FakeResponse(response)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    # Retries are a second apart at least, so they are sped up
+    monkeypatch.setattr("aio_etsy_stats.notifications.sleep", lambda seconds: None)
+    handler = QueuedDiscordHandler("Test", webhook_url="https://discord.test/webhook", batch_seconds=0)
+    handler.errors = []
+    handler.handleError = handler.errors.append
+    yield handler
+    handler.close()
+
+
+def notify(handler, message: str) -> logging.LogRecord:
+    record = logging.makeLogRecord({"msg": message, "levelno": logging.INFO, "levelname": "INFO"})
+    handler.handle(record)
+    assert handler.flush(timeout=5)
+    return record
+
+
+def test_refused_message_is_reported_and_not_retried(handler):
+    handler._session = FakeSession(400)
+    record = notify(handler, "Orders for shop")
+    assert handler.errors == [record]
+    assert handler.counts["failed"] == 1
+    assert len(handler._session.posts) == 1
+
+
+def test_request_error_is_reported_and_retried(handler):
+    handler._session = FakeSession(requests.ConnectionError("Discord is down"), 204)
+    record = notify(handler, "Orders for shop")
+    assert handler.errors == [record]
+    assert handler.counts["sent"] == 1
+    assert len(handler._session.posts) == 2
@@ -0,0 +1,60 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from aio_etsy_stats import parsing
+from aio_etsy_stats.parsing import (EtsyStoreStats, ParsedPage, extract_sold_listing_ids, extract_stats,
+                                    extract_stats_fast, extract_stats_soup, page_fingerprint, parse_page)
+
+FIXTURES_DIR = Path(__file__).parent.parent / "benchmarks" / "fixtures"
+EXPECTED = json.loads((FIXTURES_DIR / "expected.json").read_text(encoding="utf-8"))
+
+
+def load_fixture(name: str) -> str:
+    return (FIXTURES_DIR / name).read_text(encoding="utf-8")
+
+
+@pytest.mark.parametrize("fixture", sorted(EXPECTED))
+def test_fast_and_soup_agree(fixture):
+    page_source = load_fixture(fixture)
+    assert extract_stats_fast(page_source) == extract_stats_soup(page_source)
+    assert extract_stats_fast(page_source)._asdict() == EXPECTED[fixture]
+
+
+def test_last_favorite_count_is_the_shops():
+    page_source = load_fixture("sold_repeated_favorers.html")
+    assert extract_stats_fast(page_source).favorite_count == 99
+
+    # The fingerprint comes from the same favorite count
+    assert page_fingerprint(page_source) != page_fingerprint(page_source.replace('"num_favorers":99,',
+                                                                                 '"num_favorers":100,'))
+    assert page_fingerprint(page_source) == page_fingerprint(page_source.replace('"num_favorers":10,',
+                                                                                 '"num_favorers":11,'))
+
+
+@pytest.mark.parametrize("stats, complete", [
+    (EtsyStoreStats(favorite_count=3, rating=5.0, rating_count=1, sold_count=7, avatar_url="avatar.jpg"), True),
+    (EtsyStoreStats(favorite_count=3, rating=5.0, rating_count=1, sold_count=7), True),
+    (EtsyStoreStats(favorite_count=3, rating=5.0, rating_count=1), False),
+    (EtsyStoreStats(favorite_count=3, rating=5.0, rating_count=1, sold_count=7, errors=1), False),
+])
+def test_is_complete_without_an_avatar(stats, complete):
+    assert stats.is_complete() is complete
+
+
+def test_auto_keeps_fast_stats_for_a_shop_without_an_avatar(monkeypatch):
+    def extract_stats_soup_called(*args, **kwargs):
+        raise AssertionError("Fell back to BeautifulSoup")
+
+    monkeypatch.setattr(parsing, "extract_stats_soup", extract_stats_soup_called)
+    page_source = load_fixture("sold_new_shop_no_avatar.html")
+    assert extract_stats(page_source, engine="auto") == extract_stats_fast(page_source)
+
+
+def test_parsed_page_listing_ids():
+    page_source = load_fixture("sold_repeated_favorers.html")
+    parsed = parse_page(page_source)
+    assert parsed.listing_ids == tuple(extract_sold_listing_ids(page_source))
+    # Skipped pages all share the default, so it can't be a list one of them could change
+    assert parse_page(page_source, known_fingerprint=parsed.fingerprint).listing_ids == ParsedPage().listing_ids == ()
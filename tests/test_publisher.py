@@ -0,0 +1,141 @@
+import threading
+
+import pytest
+import requests
+
+from aio_etsy_stats import publisher as publisher_module
+from aio_etsy_stats.publisher import AIOPublisher, TokenBucket
+from aio_etsy_stats.resilience import CLOSED, OPEN, CircuitBreaker
+from benchmarks.fakes import FakeAIOClient
+
+
+class BlockingAIOClient(FakeAIOClient):
+    """Holds the first request until ``release`` is set, so more writes queue up behind it"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def _call(self, method: str) -> None:
+        super()._call(method)
+        self.started.set()
+        self.release.wait(timeout=5)
+
+
+class FailingAIOClient(FakeAIOClient):
+    """Fails the first ``failures`` requests with the given error"""
+
+    def __init__(self, failures: int, error: Exception, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+        self.error = error
+
+    def _call(self, method: str) -> None:
+        super()._call(method)
+        if sum(self.calls.values()) <= self.failures:
+            raise self.error
+
+
+@pytest.fixture
+def aio():
+    return FakeAIOClient()
+
+
+def test_token_bucket_paces_requests(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(publisher_module, "monotonic", lambda: clock[0])
+    bucket = TokenBucket(rate_per_minute=60, capacity=2)
+
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() == 1.0
+    clock[0] += 0.5
+    assert bucket.take() == 0.5
+    clock[0] += 0.5
+    assert bucket.take() == 0
+    # More than the bucket holds only has to wait for a full bucket
+    assert bucket.take(5) == 2.0
+
+
+def test_pending_writes_are_coalesced_and_sent_together():
+    aio = BlockingAIOClient()
+    publisher = AIOPublisher(client=aio, rate_per_minute=600000)
+    publisher.publish("shop", "sold-count", 100)
+    assert aio.started.wait(timeout=5)
+
+    # Queued while the first write is being sent
+    for sold_count in (101, 102, 103):
+        publisher.publish("shop", "sold-count", sold_count)
+    publisher.publish("shop", "daily-order-count", 3)
+    publisher.publish("other", "sold-count", 7)
+    aio.release.set()
+
+    assert publisher.flush(timeout=5)
+    publisher.close()
+    assert aio.value("shop.sold-count") == "103"
+    assert aio.value("shop.daily-order-count") == "3"
+    assert aio.value("other.sold-count") == "7"
+    assert publisher.counts["coalesced"] == 2
+    # One request for the first write, one for the rest of the shop's group and one for the other group
+    assert dict(aio.calls) == {"send_data": 2, "post": 1}
+    assert (publisher.counts["requests"], publisher.counts["sent"]) == (3, 4)
+
+
+def test_writes_are_held_while_the_breaker_is_open():
+    aio = FailingAIOClient(failures=1, error=requests.ConnectionError("AIO is down"))
+    breaker = CircuitBreaker("aio", failure_threshold=1, reset_seconds=0.05)
+    publisher = AIOPublisher(client=aio, rate_per_minute=600000, backoff_seconds=0.01, breaker=breaker)
+    publisher.publish("shop", "sold-count", 100)
+
+    assert publisher.flush(timeout=5)
+    publisher.close()
+    assert aio.value("shop.sold-count") == "100"
+    assert publisher.counts["retried"] == 1
+    assert publisher.counts["held"] >= 1
+    assert publisher.counts["sent"] == 1
+    assert breaker.state == CLOSED
+
+
+def test_write_is_dropped_after_max_retries():
+    aio = FailingAIOClient(failures=10, error=ValueError("Bad value"))
+    publisher = AIOPublisher(client=aio, rate_per_minute=600000, max_retries=2, backoff_seconds=0.01)
+    publisher.publish("shop", "sold-count", 100)
+
+    assert publisher.flush(timeout=5)
+    publisher.close()
+    assert aio.value("shop.sold-count") is None
+    assert aio.calls["send_data"] == 3
+    assert (publisher.counts["retried"], publisher.counts["dropped"]) == (2, 1)
+
+
+def test_fenced_writes_held_through_an_outage_are_dropped(aio):
+    breaker = CircuitBreaker("aio", failure_threshold=1, reset_seconds=0.1)
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    publisher = AIOPublisher(client=aio, rate_per_minute=600000, breaker=breaker)
+
+    # The lease is lost while the writes wait for AIO to come back
+    lease = {"held": True}
+    publisher.publish("shop", "daily-order-count", 3, fence=lambda: lease["held"])
+    publisher.publish("shop", "favorite-count", 10)
+    lease["held"] = False
+
+    assert publisher.flush(timeout=5)
+    publisher.close()
+    assert aio.value("shop.daily-order-count") is None
+    assert aio.value("shop.favorite-count") == "10"
+    assert publisher.counts["fenced"] == 1
+    assert publisher.counts["held"] == 2
+
+
+def test_fence_that_fails_to_check_drops_the_write(aio):
+    def broken_fence():
+        raise RuntimeError("database is locked")
+
+    publisher = AIOPublisher(client=aio, rate_per_minute=600000)
+    publisher.publish("shop", "sold-count", 5, fence=broken_fence)
+    assert publisher.flush(timeout=5)
+    publisher.close()
+    assert aio.value("shop.sold-count") is None
+    assert publisher.counts["fenced"] == 1
@@ -0,0 +1,110 @@
+import pytest
+
+from aio_etsy_stats import resilience
+from aio_etsy_stats.resilience import (CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, DependencyTimeouts,
+                                       circuit_breaker, parse_timeouts)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(resilience, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("etsy", failure_threshold=3, reset_seconds=60)
+
+
+def test_opens_after_failures_in_a_row(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    # A success in between starts the count again
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.retry_after() == 60
+
+
+def test_half_open_probe_closes_or_reopens(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock[0] += 59
+    assert breaker.state == OPEN
+    clock[0] += 1
+    assert breaker.state == HALF_OPEN
+    assert breaker.retry_after() == 0
+
+    # One probe at a time, and a failed probe opens it for another reset_seconds
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    clock[0] += 60
+
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_probe_that_never_reports_back_is_replaced(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock[0] += 60
+    assert breaker.allow()
+    assert not breaker.allow()
+    clock[0] += 60
+    assert breaker.allow()
+
+
+def test_guard(breaker):
+    def is_failure(error):
+        return not isinstance(error, KeyError)
+
+    # An error the dependency answered with doesn't count towards opening the breaker
+    for _ in range(5):
+        with pytest.raises(KeyError), breaker.guard(is_failure=is_failure):
+            raise KeyError("missing")
+    assert breaker.state == CLOSED
+
+    for _ in range(3):
+        with pytest.raises(TimeoutError), breaker.guard(is_failure=is_failure):
+            raise TimeoutError()
+    assert breaker.state == OPEN
+
+    called = []
+    with pytest.raises(CircuitOpen):
+        with breaker.guard():
+            called.append(True)
+    assert called == []
+
+
+def test_one_breaker_per_dependency(monkeypatch):
+    monkeypatch.setattr(resilience, "_breakers", {})
+    breaker = circuit_breaker("aio", failure_threshold=2)
+    assert circuit_breaker("aio", failure_threshold=10) is breaker
+    assert breaker.failure_threshold == 2
+    assert circuit_breaker("etsy") is not breaker
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, DependencyTimeouts()),
+    ("", DependencyTimeouts()),
+    ("etsy=20,aio=5", DependencyTimeouts(etsy=20, aio=5)),
+    (" Selenium = 45 ", DependencyTimeouts(selenium=45)),
+])
+def test_parse_timeouts(value, expected):
+    assert parse_timeouts(value) == expected
+
+
+def test_parse_timeouts_rejects_unknown_dependencies():
+    with pytest.raises(ValueError):
+        parse_timeouts("discord=5")
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from aio_etsy_stats.sold_index import SoldListingIndex, new_sales
+
+
+@pytest.fixture
+def index(tmp_path):
+    sold_index = SoldListingIndex(path=str(tmp_path / "state.db"), max_entries=50)
+    yield sold_index
+    sold_index.close()
+
+
+def scrape(page, sold, page_size=8):
+    """The sold page after the given sales, newest first"""
+    return (list(reversed(sold)) + page)[:page_size]
+
+
+@pytest.mark.parametrize("previous, current, expected", [
+    (["a", "b", "c"], ["a", "b", "c"], 0),
+    (["a", "b", "c"], ["d", "a", "b"], 1),
+    (["a", "b", "c"], ["a", "a", "b"], 1),
+    (["a", "a", "b"], ["a", "a", "a"], 1),
+    (["a", "b", "a"], ["b", "a", "a"], 2),
+    (["a", "b", "c"], ["d", "e", "f"], 3),
+    ([], ["a", "b"], 2),
+])
+def test_new_sales(previous, current, expected):
+    assert new_sales(previous, current) == expected
+
+
+def test_first_page_only_seeds(index):
+    assert index.record("Shop", ["a", "b", "c"]) == []
+    assert index.velocity("shop", since=datetime.fromtimestamp(0)) == {}
+
+
+def test_repeat_sales_across_scrapes(index):
+    start = datetime(2026, 1, 1, 12)
+    page = ["a", "b", "c", "a", "d", "e", "f", "g"]
+    index.record("shop", page, timestamp=start)
+
+    # The same listing sells again and again, which used to shift the older entries onto keys already counted
+    sales = [["a"], ["a", "a"], ["b", "a"], ["a"]]
+    for scrape_number, sold in enumerate(sales, start=1):
+        page = scrape(page, sold)
+        assert index.record("shop", page, timestamp=start + timedelta(minutes=10 * scrape_number)) == sold[::-1]
+
+    assert index.velocity("shop", since=start) == {"a": 5, "b": 1}
+    assert index.velocity("shop", since=start + timedelta(minutes=35)) == {"a": 1}
+
+
+def test_more_sales_than_the_page_shows(index):
+    index.record("shop", ["a", "b", "c"], timestamp=datetime(2026, 1, 1))
+    assert index.record("shop", ["d", "e", "f"], timestamp=datetime(2026, 1, 2)) == ["d", "e", "f"]
+
+
+def test_keeps_most_recent_sales(tmp_path):
+    sold_index = SoldListingIndex(path=str(tmp_path / "state.db"), max_entries=3)
+    start = datetime(2026, 1, 1)
+    page = ["x"]
+    sold_index.record("shop", page, timestamp=start)
+    for minute, listing_id in enumerate(["a", "b", "c", "d"], start=1):
+        page = [listing_id] + page
+        sold_index.record("shop", page, timestamp=start + timedelta(minutes=minute))
+
+    assert sold_index.velocity("shop", since=start) == {"b": 1, "c": 1, "d": 1}
+    sold_index.close()